@@ -0,0 +1,9 @@
+"""
+Offline benchmarking of the bot's API usage.
+server has a stand in for the P&W GraphQL API, and running this package runs the benchmarks against it.
+"""
+import os
+
+# config reads these at import, the values do not matter as nothing leaves the machine
+for _name in ('BOT_TOKEN', 'API_KEY', 'API_KEY_MUT', 'OFFSHORE_API_KEY', 'DB_URL'):
+    os.environ.setdefault(f'MYSQLCONNSTR_{_name}', 'bench')
@@ -0,0 +1,154 @@
+"""
+Runs the API calls made by the bot's commands against the fake API,
+measuring how long they take and how many requests they make.
+Usage: `python -m bench [--repeat N] [--output results.json] [--baseline results.json]`
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import statistics
+import sys
+import time
+from collections.abc import Awaitable, Callable
+
+import aiohttp
+
+from bot.utils import queries, pnwutils, config
+from .server import FakeAPI
+
+
+async def _consume(stream) -> int:
+    return sum([1 async for _ in stream])
+
+
+async def _total_taxed_prod(session: aiohttp.ClientSession) -> None:
+    data = await queries.tax_bracket_query.query(session, alliance_id=4221)
+    tax_ids = [b['id'] for b in data['data'][0]['tax_brackets']]
+    await queries.revenue_query.query(session, {'tax_ids': tax_ids})
+
+
+async def _in_war_range(session: aiohttp.ClientSession) -> None:
+    score = (await queries.nation_score_batch.load(session, 1))['score']
+    await queries.find_in_range_query.query(session, alliance_id=4221, min_score=score * 0.75,
+                                            max_score=score * 1.75)
+
+
+async def _war_alerts(session: aiohttp.ClientSession) -> None:
+    # a burst of new wars arriving from the subscription at once
+    await asyncio.gather(*(queries.new_war_batch.load(session, i, priority=pnwutils.ratelimit.Priority.ALERT)
+                           for i in range(1, 21)))
+
+
+# each scenario makes the api calls of a command or task
+scenarios: dict[str, Callable[[aiohttp.ClientSession], Awaitable]] = {
+    'revenue': lambda s: queries.revenue_query.query(s, {'nation_ids': [1]}),
+    'total_taxed_prod': _total_taxed_prod,
+    'bank_balance': lambda s: queries.bank_info_query.query(s, alliance_id=4221, cache=False),
+    'withdraw': lambda s: pnwutils.Withdrawal(pnwutils.Resources(money=1), 1).withdraw(s),
+    'nation_info': lambda s: queries.nation_info_query.query(s, nation_id=1),
+    'find_slots': lambda s: _consume(queries.find_slots_query.stream(s, alliance_ids=[4221])),
+    'check_resources': lambda s: _consume(queries.alliance_member_res_query.stream(s, alliance_id=4221)),
+    'global_trade_prices': lambda s: _consume(queries.global_trade_prices_query.stream(s)),
+    'in_war_range': _in_war_range,
+    'war_alerts': _war_alerts,
+}
+
+
+def _clear_caches() -> None:
+    for q in vars(queries).values():
+        if isinstance(q, pnwutils.api.APIQuery):
+            q.clear_cache()
+
+
+async def run(api: FakeAPI, names: list[str], repeat: int, cold: bool) -> dict[str, dict[str, float]]:
+    results = {}
+    async with aiohttp.ClientSession() as session:
+        for name in names:
+            timings = []
+            start_requests = len(api.log)
+            for _ in range(repeat):
+                if cold:
+                    _clear_caches()
+                start = time.perf_counter()
+                await scenarios[name](session)
+                timings.append(time.perf_counter() - start)
+            log = api.log[start_requests:]
+            timings.sort()
+            results[name] = {
+                'p50_ms': statistics.median(timings) * 1000,
+                'p95_ms': timings[math.ceil(0.95 * repeat) - 1] * 1000,
+                'max_ms': timings[-1] * 1000,
+                'requests': len(log) / repeat,
+                'rate_limited': sum(r.status == 429 for r in log) / repeat,
+            }
+    return results
+
+
+def compare(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]],
+            tolerance: float) -> list[str]:
+    """Lists the scenarios which got slower by more than [tolerance] or make more requests than in [baseline]."""
+    regressions = []
+    for name, result in results.items():
+        if (base := baseline.get(name)) is None:
+            continue
+        if result['requests'] > base['requests']:
+            regressions.append(f'{name}: {base["requests"]:g} -> {result["requests"]:g} requests')
+        if result['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p50 {base["p50_ms"]:.1f}ms -> {result["p50_ms"]:.1f}ms')
+    return regressions
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the API usage of the bot against a fake API')
+    parser.add_argument('scenarios', nargs='*', help=f'Scenarios to run, out of {", ".join(scenarios)}')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--cold', action='store_true', help='Clear response caches before every run')
+    parser.add_argument('--rows', type=int, default=200, help='Rows returned by lists without recordings')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--rate-limit-every', type=int, default=0)
+    parser.add_argument('--rate', type=float, default=1000,
+                        help='Requests per second allowed by the rate limiter, high by default to not skew timings')
+    parser.add_argument('--output', help='File to save the results to as json')
+    parser.add_argument('--baseline', help='Results to compare against, failing if any scenario has regressed')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown over the baseline')
+    args = parser.parse_args()
+    if unknown := set(args.scenarios) - scenarios.keys():
+        parser.error(f'Unknown scenarios: {", ".join(unknown)}')
+
+    api = FakeAPI(rows=args.rows, latency=args.latency, jitter=args.jitter, rate_limit_every=args.rate_limit_every,
+                  retry_after=0.1)
+    # the api url is looked up on every request, so it can be changed after the bot has been imported
+    pnwutils.constants.base_api_url = await api.start()
+    limiter = pnwutils.ratelimit.get_limiter(config.api_key)
+    # the rate given is used instead of the limit the fake api reports
+    limiter.follow_headers = False
+    limiter.rate = args.rate
+    limiter.capacity = limiter.tokens = max(30, int(args.rate))
+    try:
+        results = await run(api, args.scenarios or list(scenarios), args.repeat, args.cold)
+    finally:
+        await api.close()
+
+    print(f'{"scenario":<22}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}{"requests":>10}{"429s":>8}')
+    for name, r in results.items():
+        print(f'{name:<22}{r["p50_ms"]:>10.1f}{r["p95_ms"]:>10.1f}{r["max_ms"]:>10.1f}'
+              f'{r["requests"]:>10.2f}{r["rate_limited"]:>8.2f}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        return bool(regressions)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,103 @@
+"""
+Data for the fake API, either replayed from recordings or synthesised from the selections of a query.
+Recordings are json files in the fixtures directory named after the operation of the query they are for,
+holding what APIQuery.query returned for it. They can be made with `python -m bench.record`.
+"""
+from __future__ import annotations
+
+import json
+import pathlib
+import random
+from typing import Any
+
+from bot.utils import queries
+from bot.utils.pnwutils import api, constants, graphql
+
+__all__ = ('fixtures_dir', 'signature', 'load_recordings', 'is_connection', 'synthesise')
+
+fixtures_dir = pathlib.Path(__file__).with_name('fixtures')
+
+# fields holding a single object, any other field with selections ending in s is taken to be a list
+_objects = {'alliance', 'attacker', 'defender', 'nation', 'me', 'paginatorInfo', 'bankWithdraw'}
+_booleans = set(constants.project_costs) | {'powered', 'hasMorePages', 'spy_satellite', 'vmode'}
+_choices = {
+    'alliance_position': ('MEMBER', 'MEMBER', 'MEMBER', 'OFFICER', 'APPLICANT'),
+    'war_policy': ('ATTRITION', 'TURTLE', 'BLITZKRIEG', 'FORTRESS', 'MONEYBAGS', 'PIRATE'),
+    'domestic_policy': ('MANIFEST_DESTINY', 'OPEN_MARKETS', 'TECHNOLOGICAL_ADVANCEMENT', 'URBANIZATION'),
+    'war_type': ('ORDINARY', 'ATTRITION', 'RAID'),
+    'type': ('GROUND', 'AIRVINFRA', 'NAVAL', 'MISSILE'),
+    'buy_or_sell': ('buy', 'sell'),
+    'offer_resource': constants.market_res,
+    'color': ('aqua', 'black', 'blue', 'brown', 'green', 'lime', 'orange', 'pink', 'purple', 'red', 'white'),
+}
+
+
+def signature(f: graphql.Field) -> str:
+    """Identifies a field by what is selected, so aliases and variable names do not matter."""
+    args = f'({",".join(sorted(f.arguments))})' if f.arguments else ''
+    selections = f'{{{" ".join(map(signature, f.selections))}}}' if f.selections else ''
+    return f'{f.name}{args}{selections}'
+
+
+def load_recordings(directory: pathlib.Path = fixtures_dir) -> dict[str, Any]:
+    """Maps the signatures of the top level fields of recorded queries to their recorded results."""
+    texts = {op.name: q.query_text for q in vars(queries).values() if isinstance(q, api.APIQuery)
+             for op in graphql.parse(q.query_text)}
+    recordings = {}
+    for path in directory.glob('*.json'):
+        if (text := texts.get(path.stem)) is None:
+            continue
+        op, = graphql.parse(text)
+        recordings[signature(op.selections[0])] = json.loads(path.read_text())
+    return recordings
+
+
+def _leaf(name: str, rng: random.Random, index: int) -> Any:
+    if name == 'id' or name.endswith('_id'):
+        # ids are returned as strings
+        return str(index if name == 'id' else rng.randint(1, 10000))
+    if name in _booleans:
+        return rng.random() < 0.3
+    if (choices := _choices.get(name)) is not None:
+        return rng.choice(choices)
+    if name in ('date', 'last_active'):
+        return f'2023-0{rng.randint(1, 9)}-{rng.randint(10, 28)}T{rng.randint(10, 23)}:00:00+00:00'
+    if name.endswith('name') or name == 'discord':
+        return f'{name.replace("_", " ").title()} {index}'
+    if name == 'vacation_mode_turns':
+        return 0 if rng.random() < 0.9 else rng.randint(1, 100)
+    if name.endswith('turns') or name.endswith('turns_left'):
+        return rng.randint(0, 12)
+    if name in ('score', 'price', 'infrastructure', 'land', 'bonus', 'turn_bonus') or name in constants.market_res:
+        return round(rng.uniform(0, 5000), 2)
+    return rng.randint(0, 50)
+
+
+def _object(selections: list[graphql.Field], rng: random.Random, index: int) -> dict[str, Any]:
+    obj = {}
+    for f in selections:
+        if not f.selections:
+            obj[f.key] = _leaf(f.name, rng, index)
+        elif f.name in _objects or not f.name.endswith('s'):
+            obj[f.key] = _object(f.selections, rng, rng.randint(1, 10000))
+        else:
+            obj[f.key] = [_object(f.selections, rng, rng.randint(1, 10000)) for _ in range(rng.randint(0, 3))]
+    return obj
+
+
+def is_connection(f: graphql.Field) -> bool:
+    """Whether the field is a paginated list of rows, which has its rows under data."""
+    return any(g.name == 'data' for g in f.selections)
+
+
+def synthesise(f: graphql.Field, rng: random.Random, ids: list[int] | None, count: int) -> Any:
+    """
+    Makes up the value of a top level field, with only the rows being returned for connections.
+    If [ids] is given, there is one row for each of them, otherwise lists have [count] entries.
+    """
+    if is_connection(f):
+        data = next(g for g in f.selections if g.name == 'data')
+        return [_object(data.selections, rng, i) for i in (ids if ids is not None else range(1, count + 1))]
+    if f.name not in _objects and f.name.endswith('s'):
+        return [_object(f.selections, rng, i) for i in range(1, count + 1)]
+    return _object(f.selections, rng, 1)
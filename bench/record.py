@@ -0,0 +1,40 @@
+"""
+Records the response to one of the queries in bot.utils.queries from the real API, for the fake API to replay.
+Usage: `python -m bench.record nation_revenue_query nation_ids=1,2,3`, with MYSQLCONNSTR_API_KEY set.
+"""
+import argparse
+import asyncio
+import json
+
+import aiohttp
+
+from bot.utils import queries
+from bot.utils.pnwutils import api, graphql
+from . import fixtures
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description='Record the response to a query')
+    parser.add_argument('query', help='Name of the query in bot.utils.queries')
+    parser.add_argument('variables', nargs='*', help='Variables as name=value, with lists separated by commas')
+    args = parser.parse_args()
+
+    query = getattr(queries, args.query, None)
+    if not isinstance(query, api.APIQuery):
+        parser.error(f'{args.query} is not a query!')
+    variables = {}
+    for var in args.variables:
+        name, _, value = var.partition('=')
+        variables[name] = value.split(',') if isinstance(query.variable_types.get(name), list) else value
+
+    async with aiohttp.ClientSession() as session:
+        data = await query.query(session, cache=False, **variables)
+    op, = graphql.parse(query.query_text)
+    fixtures.fixtures_dir.mkdir(exist_ok=True)
+    path = fixtures.fixtures_dir / f'{op.name}.json'
+    path.write_text(json.dumps(data, indent=2))
+    print(f'Recorded to {path}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,173 @@
+"""
+A stand in for the P&W GraphQL API, serving recorded or synthesised responses to the bot's queries.
+Run with `python -m bench.server` and set PNW_API_URL to its url to point the bot at it.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import functools
+import pathlib
+import random
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from aiohttp import web
+
+from bot.utils.pnwutils import graphql
+from . import fixtures
+
+__all__ = ('RequestRecord', 'FakeAPI')
+
+
+@dataclass
+class RequestRecord:
+    operation: str
+    variables: dict[str, Any]
+    status: int
+    # seconds taken to respond, including the added latency
+    duration: float
+
+
+@functools.lru_cache(maxsize=None)
+def _parse(text: str) -> graphql.Operation:
+    op, = graphql.parse(text)
+    return op
+
+
+def _resolve(value: str, variables: dict[str, Any]) -> Any:
+    """Gets the value of an argument as written in a query."""
+    if value.startswith('$'):
+        return variables.get(value[1:])
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+class FakeAPI:
+    """
+    Answers graphql requests the way the P&W API does, with rows taken from recordings when there are some
+    and otherwise made up from what the query selects.
+    Every request is logged, [latency] (with up to [jitter] seconds more) is added to each response,
+    and every [rate_limit_every]th request is rejected with a 429, when it is set.
+    """
+
+    def __init__(self, *, rows: int = 50, latency: float = 0.05, jitter: float = 0.02,
+                 rate_limit_every: int = 0, retry_after: float = 1, limit: int = 5000,
+                 fixtures_dir: pathlib.Path = fixtures.fixtures_dir, seed: int = 0):
+        self.rows = rows
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.limit = limit
+        self.seed = seed
+        self.recordings = fixtures.load_recordings(fixtures_dir)
+        self.log: list[RequestRecord] = []
+        self._rng = random.Random(seed)
+        self._runner: web.AppRunner | None = None
+        self.url: str | None = None
+
+        self.app = web.Application()
+        self.app.router.add_post('/graphql', self.handle)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Starts serving, returning the url to send requests to."""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f'http://{host}:{port}/graphql'
+        return self.url
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def counts(self) -> collections.Counter[str]:
+        """Number of requests made for each operation."""
+        return collections.Counter(r.operation for r in self.log)
+
+    def _headers(self) -> dict[str, str]:
+        return {'X-RateLimit-Limit': str(self.limit),
+                'X-RateLimit-Remaining': str(max(0, self.limit - len(self.log))),
+                'X-RateLimit-Reset': str(int(time.time()) + 60)}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        start = time.perf_counter()
+        payload = await request.json()
+        op = _parse(payload['query'])
+        variables = payload.get('variables') or {}
+        await asyncio.sleep(self.latency + self._rng.uniform(0, self.jitter))
+
+        if self.rate_limit_every and not (len(self.log) + 1) % self.rate_limit_every:
+            response = web.json_response({'errors': [{'message': 'Too Many Requests'}]}, status=429,
+                                         headers={**self._headers(), 'Retry-After': str(self.retry_after)})
+        else:
+            data = {f.key: self._field(f, variables) for f in op.selections}
+            response = web.json_response({'data': data}, headers=self._headers())
+        self.log.append(RequestRecord(op.name or 'anonymous', variables, response.status,
+                                      time.perf_counter() - start))
+        return response
+
+    def _field(self, f: graphql.Field, variables: dict[str, Any]) -> Any:
+        args = {k: _resolve(v, variables) for k, v in f.arguments.items()}
+        ids = args.get('id')
+        if ids is not None and not isinstance(ids, list):
+            ids = [ids]
+        # the same request always gets the same rows
+        rng = random.Random(f'{self.seed} {fixtures.signature(f)} {sorted(args.items(), key=str)}')
+        recorded = self.recordings.get(fixtures.signature(f))
+
+        if not fixtures.is_connection(f):
+            return fixtures.synthesise(f, rng, ids, self.rows) if recorded is None else recorded
+
+        if recorded is None:
+            rows = fixtures.synthesise(f, rng, ids, self.rows)
+        else:
+            rows = recorded['data'] if isinstance(recorded, dict) else recorded
+            if ids is not None:
+                ids = set(map(str, ids))
+                rows = [row for row in rows if str(row.get('id')) in ids]
+
+        first = args.get('first') or 10
+        page = args.get('page') or 1
+        last_page = max(1, -(-len(rows) // first))
+        info = {'hasMorePages': page < last_page, 'lastPage': last_page, 'currentPage': page,
+                'count': len(rows[(page - 1) * first:page * first]), 'total': len(rows), 'perPage': first}
+        result = {}
+        for g in f.selections:
+            if g.name == 'data':
+                result[g.key] = rows[(page - 1) * first:page * first]
+            elif g.name == 'paginatorInfo':
+                result[g.key] = {h.key: info.get(h.name) for h in g.selections}
+        return result
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description='Serve a fake P&W API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rows', type=int, default=50, help='Rows returned by lists without recordings')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Most seconds randomly added on top of latency')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='Reject every nth request with a 429')
+    args = parser.parse_args()
+
+    api = FakeAPI(rows=args.rows, latency=args.latency, jitter=args.jitter, rate_limit_every=args.rate_limit_every)
+    print(f'Serving at {await api.start(args.host, args.port)}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.close()
+        for operation, count in api.counts().most_common():
+            print(f'{operation}: {count}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
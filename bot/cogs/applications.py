@@ -99,8 +99,7 @@ class ApplicationCog(discordutils.CogBase):
     @commands.has_role(config.gov_role_id)
     async def create_apply_button(self, ctx: commands.Context):
         kv = self.bot.database.get_kv('kv_ints')
-        if old := await kv.get('apply_view_id'):
-            old_view = await self.bot.view_table.get(old)
+        if (old := await kv.get('apply_view_id')) and (old_view := await self.bot.view_table.get(old)):
             discordutils.disable_all(old_view)
             old_view.stop()
             await asyncio.gather(
@@ -215,7 +214,7 @@ class ApplicationCog(discordutils.CogBase):
         await interaction.response.send_message('Closing application channel...')
         applicant = interaction.guild.get_member(record['discord_id'])
         nation_id = record["nation_id"]
-        data = await acceptance_query.query(self.bot.session, nation_id=nation_id)
+        data = await acceptance_query.query(self.bot.session, nation_id=[nation_id])
         data = data['data'][0]
         acc_str = 'Accepted' if record['status'] else 'Rejected'
         info_str = (f'Application Number: {record["application_id"]}, Leader Name: {data["leader_name"]}, '
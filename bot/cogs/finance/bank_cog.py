@@ -2,14 +2,14 @@ import asyncio
 import datetime
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from bot.utils import discordutils, pnwutils, config
 from bot import dbbot
 from bot.cogs.finance import finance_views
 from bot.utils.queries import (
-    bank_transactions_query, bank_info_query, nation_name_query, nation_resources_query, bank_revenue_query,
-    leader_name_query, tax_bracket_query, nation_revenue_query, treasures_query, colours_query)
+    bank_transactions_query, bank_info_query, nation_name_batch, nation_resources_query, bank_revenue_query,
+    leader_name_batch, tax_bracket_query, revenue_query)
 
 
 class BankCog(discordutils.CogBase):
@@ -27,6 +27,16 @@ class BankCog(discordutils.CogBase):
             callback=self.check_res
         ))
 
+    async def cog_load(self) -> None:
+        self.snapshot_ledger.start()
+
+    async def cog_unload(self) -> None:
+        self.snapshot_ledger.cancel()
+
+    @tasks.loop(time=datetime.time(0, 0, tzinfo=datetime.timezone.utc))
+    async def snapshot_ledger(self) -> None:
+        await self.bot.ledger.snapshot()
+
     async def get_transactions(self, entity_id: 'str | int | None' = None,
                                entity_type: 'pnwutils.EntityType | None' = None,
                                transaction_type: 'pnwutils.TransactionType | None' = None
@@ -69,13 +79,13 @@ class BankCog(discordutils.CogBase):
             return
 
         await interaction.response.send_message(
-            embed=pnwutils.Resources(**rec['balance']).create_balance_embed(interaction.user),
+            embed=pnwutils.Resources.from_record(rec['balance']).create_balance_embed(interaction.user),
             ephemeral=ephemeral
         )
         if (date := rec['due_date']) is not None:
             await interaction.followup.send(
                 f'You have a loan due {discord.utils.format_dt(date)} ({discord.utils.format_dt(date, "R")})',
-                embed=pnwutils.Resources(**rec['loaned']).create_embed(title='Loaned Resources'),
+                embed=pnwutils.Resources.from_record(rec['loaned']).create_embed(title='Loaned Resources'),
                 ephemeral=ephemeral
             )
 
@@ -113,11 +123,13 @@ class BankCog(discordutils.CogBase):
              if transaction.time >= start_time),
             pnwutils.Resources())
         if deposited:
-            new_bal_rec = await self.users_table.update(f'balance = balance + {deposited.to_row()}').where(
-                discord_id=user.id).returning_val('balance')
+            async with self.bot.database.transaction() as t:
+                new_bal_rec = await t.get_table('users').update('balance = balance + $1', deposited.to_record()
+                                                                ).where(discord_id=user.id).returning_val('balance')
+                await t.get_table('ledger').record(user.id, 'deposit', deposited)
             await asyncio.gather(
                 user.send('Deposits Recorded! Your balance is now:',
-                          embed=pnwutils.Resources(**new_bal_rec).create_balance_embed(user)),
+                          embed=pnwutils.Resources.from_record(new_bal_rec).create_balance_embed(user)),
                 self.bot.log(embeds=(
                     discordutils.create_embed(user=user, description=f'{user.mention} deposited some resources'),
                     deposited.create_embed(title='Resources Deposited')
@@ -139,7 +151,7 @@ class BankCog(discordutils.CogBase):
             await interaction.response.send_message('Output channel has not been set! Aborting...')
             return
 
-        resources = pnwutils.Resources(**rec['balance'])
+        resources = pnwutils.Resources.from_record(rec['balance'])
         if not resources:
             await interaction.response.send_message('You do not have anything to withdraw! Aborting...', ephemeral=True)
             return
@@ -193,8 +205,7 @@ class BankCog(discordutils.CogBase):
             await user.send('You took too long to reply! Aborting.')
             return
 
-        data = await nation_name_query.query(self.bot.session, nation_id=rec['nation_id'])
-        name = data['data'][0]['nation_name']
+        name = (await nation_name_batch.load(self.bot.session, rec['nation_id']))['nation_name']
 
         custom_id = await self.bot.get_custom_id()
         view = finance_views.WithdrawalView(
@@ -207,12 +218,14 @@ class BankCog(discordutils.CogBase):
             view=view)
         await self.bot.add_view(view, message_id=msg.id)
 
-        new_bal_rec = await self.users_table.update(f'balance = balance - {req_resources.to_row()}').where(
-            discord_id=user.id).returning_val('balance')
+        async with self.bot.database.transaction() as t:
+            new_bal_rec = await t.get_table('users').update('balance = balance - $1', req_resources.to_record()
+                                                            ).where(discord_id=user.id).returning_val('balance')
+            await t.get_table('ledger').record(user.id, 'withdrawal', req_resources * -1, reason)
         await asyncio.gather(
             user.send('Your withdrawal request has been recorded. '
                       'It will be sent to your nation soon.\n\nYour balance is now:',
-                      embed=pnwutils.Resources(**new_bal_rec).create_balance_embed(user)),
+                      embed=pnwutils.Resources.from_record(new_bal_rec).create_balance_embed(user)),
             self.bot.log(embeds=(
                 discordutils.create_embed(user=user, description=f'{user.mention} asked for a withdrawal'),
                 req_resources.create_embed(title='Requested Resources')
@@ -244,7 +257,7 @@ class BankCog(discordutils.CogBase):
                                                     ephemeral=True)
             return
 
-        sender_bal = pnwutils.Resources(**sender_bal_rec)
+        sender_bal = pnwutils.Resources.from_record(sender_bal_rec)
         if not sender_bal:
             await interaction.response.send_message('You do not have anything to transfer! Aborting...', ephemeral=True)
             return
@@ -290,10 +303,14 @@ class BankCog(discordutils.CogBase):
         if not t_resources:
             await user.send('You cannot transfer nothing! Aborting...')
             return
-        final_sender_bal = sender_bal - t_resources
-        await self.users_table.update(f'balance = {final_sender_bal.to_row()}').where(discord_id=user.id)
-        final_receiver_bal_rec = await self.users_table.update(
-            f'balance = balance + {t_resources.to_row()}').where(discord_id=member.id).returning_val('balance')
+        async with self.bot.database.transaction() as t:
+            users_table = t.get_table('users')
+            final_sender_bal = pnwutils.Resources.from_record(await users_table.update(
+                'balance = balance - $1', t_resources.to_record()).where(discord_id=user.id).returning_val('balance'))
+            final_receiver_bal_rec = await users_table.update(
+                'balance = balance + $1', t_resources.to_record()).where(discord_id=member.id).returning_val('balance')
+            await t.get_table('ledger').record(user.id, 'transfer', t_resources * -1, f'To {member.id}')
+            await t.get_table('ledger').record(member.id, 'transfer', t_resources, f'From {user.id}')
         t_embed = t_resources.create_embed(title='Transferred Resources')
         await asyncio.gather(
             user.send(f'You have sent {member.mention} the following resources:', embed=t_embed),
@@ -301,7 +318,7 @@ class BankCog(discordutils.CogBase):
         await asyncio.gather(
             user.send('Your balance is now:', embed=final_sender_bal.create_balance_embed(user)),
             member.send(f'Your balance is now:',
-                        embed=pnwutils.Resources(**final_receiver_bal_rec).create_balance_embed(member)),
+                        embed=pnwutils.Resources.from_record(final_receiver_bal_rec).create_balance_embed(member)),
             self.bot.log(embeds=(
                 discordutils.create_embed(
                     user=user, description=f'{user.mention} transferred resources to {member.mention}'),
@@ -320,13 +337,17 @@ class BankCog(discordutils.CogBase):
         if rec is None:
             await interaction.response.send_message("You don't have an active loan!", ephemeral=True)
             return
-        res = pnwutils.Resources(**rec['balance'])
-        loaned = pnwutils.Resources(**rec['loaned'])
+        res = pnwutils.Resources.from_record(rec['balance'])
+        loaned = pnwutils.Resources.from_record(rec['loaned'])
         res -= loaned
         if res.all_positive():
+            async with self.bot.database.transaction() as t:
+                res = pnwutils.Resources.from_record(await t.get_table('users').update(
+                    'balance = balance - $1', loaned.to_record()
+                ).where(discord_id=interaction.user.id).returning_val('balance'))
+                await t.get_table('loans').delete().where(discord_id=interaction.user.id)
+                await t.get_table('ledger').record(interaction.user.id, 'loan', loaned * -1, 'Loan repaid')
             await asyncio.gather(
-                self.users_table.update(f'balance = {res.to_row()}').where(discord_id=interaction.user.id),
-                self.loans_table.delete().where(discord_id=interaction.user.id),
                 interaction.response.send_message('Your loan has been successfully repaid!\n\nYour balance is now:',
                                                   embed=res.create_balance_embed(interaction.user), ephemeral=True),
                 self.bot.log(embeds=(
@@ -346,7 +367,8 @@ class BankCog(discordutils.CogBase):
         if loan is None:
             await interaction.response.send_message("You don't have an active loan!", ephemeral=True)
             return
-        await interaction.response.send_message(embed=finance_views.LoanData(**loan).to_embed(), ephemeral=True)
+        await interaction.response.send_message(embed=finance_views.LoanData(
+            loan['due_date'], pnwutils.Resources.from_record(loan['loaned'])).to_embed(), ephemeral=True)
 
     @discord.app_commands.default_permissions()
     async def check_bal(self, interaction: discord.Interaction, member: discord.Member):
@@ -356,7 +378,7 @@ class BankCog(discordutils.CogBase):
             await interaction.response.send_message('This user is not registered!')
             return
         await interaction.response.send_message(
-            embed=pnwutils.Resources(**bal_rec).create_balance_embed(member),
+            embed=pnwutils.Resources.from_record(bal_rec).create_balance_embed(member),
             ephemeral=True
         )
 
@@ -395,7 +417,48 @@ class BankCog(discordutils.CogBase):
                                                     ephemeral=ephemeral)
             return
         await interaction.response.send_message(
-            embed=pnwutils.Resources(**bal_rec).create_balance_embed(None),
+            embed=pnwutils.Resources.from_record(bal_rec).create_balance_embed(None),
+            ephemeral=ephemeral
+        )
+
+    @check.command(name='history')
+    @discord.app_commands.describe(date='Date to check the balance at the end of, in the form YYYY-MM-DD',
+                                   ephemeral='Whether to only allow you to see the message')
+    async def check_history(self, interaction: discord.Interaction, member: discord.Member, date: str,
+                            ephemeral: bool = True):
+        """Check the bank balance of this member at the end of a past day (UTC)"""
+        try:
+            day = datetime.date.fromisoformat(date)
+        except ValueError:
+            await interaction.response.send_message('That is not a valid date!', ephemeral=True)
+            return
+        end = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(), datetime.timezone.utc)
+        bal_rec = await self.bot.ledger.balance_at(member.id, end)
+        if bal_rec is None:
+            await interaction.response.send_message('There is no record of this balance!', ephemeral=ephemeral)
+            return
+        await interaction.response.send_message(
+            f"{member.mention}'s balance at the end of {day.isoformat()}:",
+            embed=pnwutils.Resources.from_record(bal_rec).create_balance_embed(None),
+            ephemeral=ephemeral
+        )
+
+    @check.command(name='flow')
+    @discord.app_commands.describe(days='How many days back to look',
+                                   ephemeral='Whether to only allow you to see the message')
+    async def check_flow(self, interaction: discord.Interaction, member: discord.Member,
+                         days: discord.app_commands.Range[int, 1, None] = 30, ephemeral: bool = True):
+        """Check how the bank balance of this member has changed recently, by kind of change"""
+        end = datetime.datetime.now(tz=datetime.timezone.utc)
+        flows = await self.bot.ledger.flows(member.id, end - datetime.timedelta(days=days), end)
+        if not flows:
+            await interaction.response.send_message(
+                f'The balance of {member.mention} has not changed in that time!', ephemeral=ephemeral)
+            return
+        await interaction.response.send_message(
+            f"Changes to {member.mention}'s balance in the last {days} day{'s' * (days != 1)}:",
+            embeds=[pnwutils.Resources.from_record(total).create_embed(title=kind.title())
+                    for kind, total in flows.items()],
             ephemeral=ephemeral
         )
 
@@ -413,10 +476,10 @@ class BankCog(discordutils.CogBase):
                         due_date = discord.utils.format_dt(rec['due_date'])
                         m = interaction.guild.get_member(rec['discord_id'])
                         if m is None:
-                            embeds.append(pnwutils.Resources(**rec['loaned']).create_embed(
+                            embeds.append(pnwutils.Resources.from_record(rec['loaned']).create_embed(
                                 title=f"{rec['discord_id']}'s Loan due on {due_date}"))
                         else:
-                            embeds.append(pnwutils.Resources(**rec['loaned']).create_embed(
+                            embeds.append(pnwutils.Resources.from_record(rec['loaned']).create_embed(
                                 title=f"{m.display_name}'s Loan due on {due_date}"))
                     paginator_pages.append(embeds)
         if paginator_pages:
@@ -453,7 +516,8 @@ class BankCog(discordutils.CogBase):
     async def safekeep(self, interaction: discord.Interaction):
         """Send the entire bank to the offshore for safekeeping"""
 
-        data = await bank_info_query.query(self.bot.session, alliance_id=config.alliance_id)
+        # bypass the cache, since the exact current contents are needed
+        data = await bank_info_query.query(self.bot.session, alliance_id=config.alliance_id, cache=False)
         resources = pnwutils.Resources(**data['data'][0])
 
         withdrawal = pnwutils.Withdrawal(resources, await pnwutils.get_offshore_id(self.bot.session),
@@ -466,12 +530,9 @@ class BankCog(discordutils.CogBase):
         )
 
     async def get_total_balances(self) -> pnwutils.Resources:
-        async with self.bot.database.acquire() as conn:
-            async with conn.transaction():
-                total = pnwutils.Resources()
-                async for bal in self.users_table.select('balance').cursor(conn):
-                    total += pnwutils.Resources(**bal['balance'])
-                return total
+        # kept up to date by a trigger on users, so no balances need to be read, only the few shard rows summed
+        return pnwutils.Resources.from_record(
+            await self.bot.database.get_table('balance_totals').select_val('sum(total)'))
 
     @_bank.command()
     @discord.app_commands.describe(ephemeral='Whether to only allow you to see the message')
@@ -505,7 +566,7 @@ class BankCog(discordutils.CogBase):
         if resources_rec is None:
             await interaction.response.send_message('This user has not been registered!', ephemeral=True)
             return
-        resources = pnwutils.Resources(**resources_rec)
+        resources = pnwutils.Resources.from_record(resources_rec)
         before = resources.copy()
 
         await interaction.response.send_message('Please check your DMs!', ephemeral=True)
@@ -546,8 +607,10 @@ class BankCog(discordutils.CogBase):
             else:
                 resources[res] = amt
 
+        async with self.bot.database.transaction() as t:
+            await t.get_table('users').update('balance = $1', resources.to_record()).where(discord_id=member.id)
+            await t.get_table('ledger').record(member.id, 'adjustment', resources - before, msg.content)
         await asyncio.gather(
-            self.users_table.update(f'balance = {resources.to_row()}').where(discord_id=member.id),
             user.send(f'The balance of {member.mention} has been modified!',
                       embed=resources.create_balance_embed(member)),
             self.bot.log(embeds=(
@@ -564,9 +627,8 @@ class BankCog(discordutils.CogBase):
         """Create a restocking link for all the resources that are waiting to be withdrawn"""
         await interaction.response.defer()
         total = pnwutils.Resources()
-        async for view in self.bot.view_table.get_all():
-            if isinstance(view, finance_views.WithdrawalView):
-                total += view.withdrawal.resources
+        async for view in self.bot.view_table.get_all(finance_views.WithdrawalView.kind()):
+            total += view.withdrawal.resources
 
         await interaction.followup.send(view=discordutils.LinkView(
             'Restock Link',
@@ -581,13 +643,11 @@ class BankCog(discordutils.CogBase):
         tax_bracket_data = await tax_bracket_query.query(self.bot.session, alliance_id=config.alliance_id)
         tax_brackets = [b['id'] for b in tax_bracket_data['data'][0]['tax_brackets']
                         if b['tax_rate'] >= 75 and b['resource_tax_rate'] >= 75]
-        nation_q = asyncio.create_task(nation_revenue_query.query(self.bot.session, tax_ids=tax_brackets))
-        treasure_q = asyncio.create_task(treasures_query.query(self.bot.session))
-        colour_data = await colours_query.query(self.bot.session)
-        treasure_data = await treasure_q
+        nation_data, treasure_data, colour_data = await revenue_query.query(
+            self.bot.session, {'tax_ids': tax_brackets})
         total = sum((pnwutils.models.Nation(nation).revenue(
             colour_data, pnwutils.formulas.treasure_bonus(treasure_data, nation['id'], nation['alliance_id'])
-        ) for nation in (await nation_q)['data']), pnwutils.Resources())
+        ) for nation in nation_data['data']), pnwutils.Resources())
         await interaction.followup.send(embed=total.create_embed(
             title='Total revenue for nations with 75/75 or higher tax'))
 
@@ -607,7 +667,7 @@ class BankCog(discordutils.CogBase):
         await modal.interaction.response.send_message(view=discordutils.LinkView(
             'Withdrawal Link', pnwutils.link.bank(
                 'w', resources,
-                (await leader_name_query.query(self.bot.session, nation_id=nation_id))['data'][0]['leader_name'],
+                (await leader_name_batch.load(self.bot.session, nation_id))['leader_name'],
                 alliance_id=alliance_id
             )
         ))
@@ -237,14 +237,15 @@ class RequestButtonsView(discordutils.PersistentView):
             embed.colour = discord.Colour.green()
             await interaction.response.edit_message(view=self, embed=embed)
             # change balance
-            users_table = self.bot.database.get_table('users')
-            new_bal = pnwutils.Resources(**await users_table.update(
-                f'balance = balance + {loan_data.loaned.to_row()}'
-            ).where(discord_id=self.data.requester_id).returning_val('balance'))
+            async with self.bot.database.transaction() as t:
+                new_bal = pnwutils.Resources.from_record(await t.get_table('users').update(
+                    'balance = balance + $1', loan_data.loaned.to_record()
+                ).where(discord_id=self.data.requester_id).returning_val('balance'))
+                await t.get_table('loans').insert(
+                    discord_id=self.data.requester_id, due_date=loan_data.due_date,
+                    loaned=self.data.resources.to_record())
+                await t.get_table('ledger').record(self.data.requester_id, 'loan', loan_data.loaned, self.data.reason)
             await asyncio.gather(
-                self.bot.database.execute(
-                    f'INSERT INTO loans(discord_id, due_date, loaned) VALUES ($1, $2, {self.data.resources.to_row()})',
-                    self.data.requester_id, loan_data.due_date),
                 interaction.edit_original_response(
                     content=f'{self.data.kind} Request from {self.data.requester.mention}',
                     allowed_mentions=discord.AllowedMentions.none()),
@@ -516,8 +517,11 @@ class WithdrawalView(discordutils.PersistentView):
         # close modal
         await discordutils.respond_to_interaction(reason_modal.interaction)
 
-        await self.bot.database.get_table('users').update(
-            f'balance = balance + {self.withdrawal.resources.to_row()}').where(discord_id=self.receiver_id)
+        async with self.bot.database.transaction() as t:
+            await t.get_table('users').update(
+                'balance = balance + $1', self.withdrawal.resources.to_record()).where(discord_id=self.receiver_id)
+            await t.get_table('ledger').record(self.receiver_id, 'withdrawal', self.withdrawal.resources,
+                                               'Withdrawal cancelled')
 
         button.style = discord.ButtonStyle.success
         discordutils.disable_all(self)
@@ -69,7 +69,7 @@ class MarketCog(discordutils.CogBase):
                 ephemeral=True)
             return
 
-        res = pnwutils.Resources(**bal_rec)
+        res = pnwutils.Resources.from_record(bal_rec)
         total_price = amt * rec['buy_price']
         if res.money < total_price:
             await interaction.followup.send(f'You do not have enough money deposited to do that! '
@@ -111,13 +111,17 @@ class MarketCog(discordutils.CogBase):
         if rej:
             await interaction.followup.send('Cancelling transaction and exiting...', ephemeral=True)
             return
-        final_bal = pnwutils.Resources(
-            **await self.users_table.update(
-                f'balance.money = (balance).money - {total_price}, '
-                f'balance.{res_name} = (balance).{res_name} + {amt}'
-            ).where(discord_id=interaction.user.id).returning_val('balance'))
+        async with self.bot.database.transaction() as t:
+            final_bal = pnwutils.Resources.from_record(
+                await t.get_table('users').update(
+                    f'balance.money = (balance).money - $1, balance.{res_name} = (balance).{res_name} + $2',
+                    total_price, amt
+                ).where(discord_id=interaction.user.id).returning_val('balance'))
+            await t.get_table('market').update('stock = stock - $1', amt).where(resource=res_name)
+            await t.get_table('ledger').record(interaction.user.id, 'market',
+                                               pnwutils.Resources(money=-total_price, **{res_name: amt}),
+                                               f'Bought at {rec["buy_price"]} ppu')
         await asyncio.gather(
-            self.market_table.update(f'stock = stock - {amt}').where(resource=res_name),
             interaction.followup.send(
                 'Transaction complete!', embed=final_bal.create_balance_embed(interaction.user),
                 ephemeral=True),
@@ -175,12 +179,16 @@ class MarketCog(discordutils.CogBase):
             await interaction.followup.send('Cancelling transaction and exiting...', ephemeral=True)
             return
 
-        final_bal = pnwutils.Resources(
-            **await self.users_table.update(
-                f'balance.money = (balance).money + {total_price}, '
-                f'balance.{res_name} = (balance).{res_name} - {amt}'
-            ).where(discord_id=interaction.user.id).returning_val('balance'))
-        await self.market_table.update(f'stock = stock + {amt}').where(resource=res_name)
+        async with self.bot.database.transaction() as t:
+            final_bal = pnwutils.Resources.from_record(
+                await t.get_table('users').update(
+                    f'balance.money = (balance).money + $1, balance.{res_name} = (balance).{res_name} - $2',
+                    total_price, amt
+                ).where(discord_id=interaction.user.id).returning_val('balance'))
+            await t.get_table('market').update('stock = stock + $1', amt).where(resource=res_name)
+            await t.get_table('ledger').record(interaction.user.id, 'market',
+                                               pnwutils.Resources(money=total_price, **{res_name: -amt}),
+                                               f'Sold at {price} ppu')
         await asyncio.gather(
             interaction.followup.send(
                 'Transaction complete!', embed=final_bal.create_balance_embed(interaction.user),
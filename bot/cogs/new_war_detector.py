@@ -1,15 +1,17 @@
 from __future__ import annotations
 
 import asyncio
+import collections
 import traceback
+from collections.abc import Awaitable, Callable
 from typing import Any
 
 import discord
 import pnwkit
+from discord.ext import tasks
 
 from .. import dbbot
-from ..utils import discordutils, pnwutils, config
-from ..utils.queries import new_war_query, update_war_query
+from ..utils import discordutils, dispatch, pnwutils, config, metrics, war_state
 
 
 class NewWarDetectorCog(discordutils.CogBase):
@@ -22,43 +24,85 @@ class NewWarDetectorCog(discordutils.CogBase):
             None: 'updates_channel'
         }
 
-        self.new_war_subscription: pnwkit.Subscription | None = None
-        self.update_war_subscription: pnwkit.Subscription | None = None
+        self.subscriptions: list[pnwkit.Subscription] = []
         self.subscribed = False
-        self.breakpoints: dict[str, int] = {}
+        # events recently handled, as a war between two members is sent by both filtered subscriptions
+        self.recent_events: collections.OrderedDict[tuple, None] = collections.OrderedDict()
+        self.recent_events_size = 1024
+        self.breakpoints = war_state.BreakpointTracker(bot.database.get_table('war_breakpoints'))
+        # wars are rendered from this rather than fetched again for every event
+        self.wars = war_state.WarStore(bot.database.get_table('active_wars'))
+        self.digest = discordutils.AlertDigest(lambda: bot.database.get_kv('kv_ints').get('alert_coalesce_seconds'))
+        # events are (war, is_new), a new war stays new when a later update supersedes it
+        self.dispatcher: dispatch.Dispatcher[tuple[pnwkit.War, bool]] = dispatch.Dispatcher(
+            'wars', self.handle_war, key=lambda event: event[0].id,
+            merge=lambda old, new: (new[0], old[1] or new[1]))
 
     async def cog_load(self) -> None:
+        self.dispatcher.start()
         asyncio.create_task(self.subscribe())
+        self.checkpoint_wars.start()
 
     async def subscribe(self):
         await self.bot.wait_until_ready()
         if not self.subscribed:
             self.subscribed = True
 
-            # note: filtering by alliance_id does not work
-            # as filters only work on models which has them as one of the fields
-            # wars do not define an alliance_id field, only att_alliance_id and def_alliance_id
-            self.new_war_subscription = await pnwkit.Subscription.subscribe(
-                self.bot.kit,
-                'war', 'create',
-                {},
-                self.on_new_war
-            )
-            self.update_war_subscription = await pnwkit.Subscription.subscribe(
-                self.bot.kit,
-                'war', 'update',
-                {},
-                self.on_war_update
-            )
+            # the checkpoint is loaded first, so that it cannot overwrite what events have changed since
+            await asyncio.gather(self.wars.load(), self.breakpoints.load())
+            self.subscriptions = [
+                *await self.subscribe_wars('create', lambda war: self.dispatcher.put((war, True))),
+                *await self.subscribe_wars('update', lambda war: self.dispatcher.put((war, False)))
+            ]
+            # subscribed before seeding so that no events are missed while it runs
+            await self.wars.seed(self.bot.session)
+            for war_id in [i for i in self.breakpoints.breakpoints if i not in self.wars]:
+                self.breakpoints.discard(war_id)
             channel = self.bot.get_channel(await self.bot.database.get_kv('channel_ids').get(self.channels[None]))
             await channel.send(f'subscribed!')
 
     async def cog_unload(self) -> None:
+        self.checkpoint_wars.cancel()
         if self.subscribed:
-            await asyncio.gather(
-                self.new_war_subscription.unsubscribe(),
-                self.update_war_subscription.unsubscribe()
-            )
+            await asyncio.gather(*(s.unsubscribe() for s in self.subscriptions))
+        await self.dispatcher.stop()
+        await asyncio.gather(self.wars.checkpoint(), self.breakpoints.flush(), self.digest.close())
+
+    async def subscribe_wars(self, event: str, callback: Callable[[pnwkit.War], Awaitable[None]]
+                             ) -> tuple[pnwkit.Subscription, ...]:
+        """
+        Subscribes to [event] on wars of the alliance, or on every war if config.filter_war_subscriptions is off.
+        Wars can only be filtered by fields they have, so there is one subscription for each side.
+        """
+        if not config.filter_war_subscriptions:
+            return await pnwkit.Subscription.subscribe(self.bot.kit, 'war', event, {}, callback),
+
+        async def on_event(war: pnwkit.War) -> None:
+            metrics.registry.counter('wars.events', event=event).inc()
+            # an event sent by both subscriptions is identical, and a repeated update would not change anything
+            key = (event, *(war.get(f) for f in war_state.war_fields))
+            if key in self.recent_events:
+                metrics.registry.counter('wars.duplicates', event=event).inc()
+                return
+            self.recent_events[key] = None
+            if len(self.recent_events) > self.recent_events_size:
+                self.recent_events.popitem(last=False)
+            await callback(war)
+
+        return await asyncio.gather(*(
+            pnwkit.Subscription.subscribe(self.bot.kit, 'war', event, {field: [config.alliance_id]}, on_event)
+            for field in ('att_alliance_id', 'def_alliance_id')))
+
+    @tasks.loop(minutes=1)
+    async def checkpoint_wars(self) -> None:
+        self.breakpoints.expire()
+        await asyncio.gather(self.wars.checkpoint(), self.breakpoints.flush())
+
+    async def handle_war(self, event: tuple[pnwkit.War, bool]) -> None:
+        war, is_new = event
+        if is_new:
+            await self.on_new_war(war)
+        await self.on_war_update(war)
 
     async def on_new_war(self, war: pnwkit.War):
         if war.att_alliance_id == config.alliance_id:
@@ -68,11 +112,13 @@ class NewWarDetectorCog(discordutils.CogBase):
         else:
             return
 
+        self.wars.apply(war)
         channel = self.bot.get_channel(await self.bot.database.get_kv('channel_ids').get(self.channels[kind]))
-        data = await new_war_query.query(self.bot.session, war_id=war.id)
-        data = data['data'][0]
+        data = await self.wars.complete(self.bot.session, int(war.id))
+        if data is None:
+            return
 
-        await channel.send(embed=await self.new_war_embed(data, kind))
+        await self.digest.send(channel, await self.new_war_embed(data, kind))
 
     @staticmethod
     async def new_war_embed(data: dict[str, Any], kind: pnwutils.WarType | None) -> discord.Embed:
@@ -110,27 +156,24 @@ class NewWarDetectorCog(discordutils.CogBase):
             kind = pnwutils.WarType.DEF
         else:
             return
-        if (res := getattr(war, f'{kind.string_short}_resistance')) <= 60:
-            if b := self.breakpoints.get(war.id):
-                if res > b:
-                    return
-                self.breakpoints[war.id] = b - 20
-            else:
-                self.breakpoints[war.id] = (res // 20) * 20
-
+        _, state = self.wars.apply(war)
+        if state is None:
+            # the war has ended
+            self.breakpoints.discard(int(war.id))
+            return
+        res = state[f'{kind.string_short}_resistance']
+        if res <= 60 and self.breakpoints.cross(state['id'], res, state['date']):
             channel = self.bot.get_channel(await self.bot.database.get_kv('channel_ids').get(self.channels[None]))
             try:
-                data = await update_war_query.query(self.bot.session, war_id=war.id)
-                data = data['data']
-                if data and data[0][kind.string]['alliance_position'] != 'APPLICANT':
+                data = await self.wars.complete(self.bot.session, state['id'])
+                if data is not None and data[kind.string]['alliance_position'] != 'APPLICANT':
                     embed = discord.Embed(
                         title='Low Resistance War!',
-                        description=pnwutils.war_description(data[0]))
-                    await channel.send(embed=embed)
-                elif war.id in self.breakpoints:
-                    del self.breakpoints[war.id]
-                # if data is empty war has already ended, because query does not have 'active: false'
-                # otherwise low resistance is an applicant
+                        description=pnwutils.war_description(data, None))
+                    await self.digest.send(channel, embed)
+                else:
+                    # the nations could not be found, or low resistance is an applicant
+                    self.breakpoints.discard(state['id'])
             except BaseException as e:
                 await self.on_error(e, channel)
 
@@ -7,7 +7,7 @@ import asyncpg
 import discord
 import pnwkit
 
-from ..utils import discordutils
+from ..utils import discordutils, dispatch, pnwutils
 from .. import dbbot
 from ..utils.queries import find_slots_query
 
@@ -23,6 +23,8 @@ class SlotOpenDetectorCog(discordutils.CogBase):
         self.nation_subscription: pnwkit.Subscription | None = None
         self.info = None
         self.misc_table = bot.database.get_table('misc')
+        self.dispatcher = dispatch.Dispatcher('nations', self.on_nation_update, key=lambda nation: nation.id,
+                                              workers=1)
 
     async def cog_load(self) -> None:
         alliances = await self.bot.database.fetch_val(
@@ -34,22 +36,25 @@ class SlotOpenDetectorCog(discordutils.CogBase):
     async def subscribe(self, coalition: tuple[int]):
         await self.bot.wait_until_ready()
         self.subscribed = True
+        self.dispatcher.start()
         self.nation_subscription = await pnwkit.Subscription.subscribe(
             self.bot.kit,
             'nation', 'update',
             {'alliance_id': coalition},
-            self.on_nation_update
+            self.dispatcher.put
         )
         channel = self.bot.get_channel(await self.bot.database.get_kv('channel_ids').get('slot_open_channel'))
 
         # initial populate
         # find_slots query with unbounded score works
         self.info = await find_slots_query.query(self.bot.session, alliance_ids=coalition,
-                                                 min_score=None, max_score=None)
+                                                 min_score=None, max_score=None,
+                                                 priority=pnwutils.ratelimit.Priority.BACKGROUND)
         await channel.send(f'subscribed!')
 
     async def unsubscribe(self):
         await self.nation_subscription.unsubscribe()
+        await self.dispatcher.stop()
 
     async def cog_unload(self) -> None:
         if self.subscribed:
@@ -65,6 +65,17 @@ class OptionsCog(commands.GroupCog, discordutils.CogBase, group_name='_options')
         await self.channel_ids.set(key, interaction.channel_id)
         await interaction.response.send_message(f'`{kind_text}` channel set!')
 
+    @new_war_detector_options.command()
+    @discord.app_commands.describe(
+        seconds='How long to collect alerts for before sending them together, 0 to send each straight away')
+    async def coalesce(self, interaction: discord.Interaction,
+                       seconds: discord.app_commands.Range[int, 0, 3600]) -> None:
+        """Sets how long war alerts are collected for before being sent in one message"""
+        await self.bot.database.get_kv('kv_ints').set('alert_coalesce_seconds', seconds)
+        await interaction.response.send_message(
+            f'War alerts will be collected for {seconds} seconds!' if seconds else
+            'War alerts will be sent straight away!')
+
     market_options = discord.app_commands.Group(name='market', description='Options for the market system!')
     market_options.guild_ids = config.guild_ids
 
@@ -84,10 +95,10 @@ class OptionsCog(commands.GroupCog, discordutils.CogBase, group_name='_options')
         if price:
             r = f'The {action} price of `{res_name}` has been set to `{price}` ppu.'
         else:
-            price = 'null'
+            price = None
             r = f'{action} `{res_name}` is now disabled!'
 
-        await market_table.update(f'{action.removesuffix("ing")}_price = {price}').where(resource=res_name)
+        await market_table.update(f'{action.removesuffix("ing")}_price = $1', price).where(resource=res_name)
         await interaction.response.send_message(r)
 
     @market_options.command()
@@ -101,7 +112,7 @@ class OptionsCog(commands.GroupCog, discordutils.CogBase, group_name='_options')
                         stock: discord.app_commands.Range[int, 0, None]):
         """Set the stocks of a resource"""
         market_table = self.bot.database.get_table('market')
-        await market_table.update(f'stock = {stock}').where(resource=res_name)
+        await market_table.update('stock = $1', stock).where(resource=res_name)
         await interaction.response.send_message(f'The stock of `{res_name}` has been set to `{stock}` tons.')
 
     # bank_options = options.create_subgroup('bank', 'Options for the bank system!')
@@ -4,7 +4,7 @@ import discord
 from discord.ext import tasks
 
 from .. import dbbot
-from ..utils import discordutils
+from ..utils import discordutils, pnwutils, config
 from ..utils.queries import alliance_member_res_query
 
 
@@ -15,10 +15,10 @@ class ResourceCheckCog(discordutils.CogBase):
 
     @tasks.loop(hours=2)
     async def task(self):
-        data = await alliance_member_res_query.query(self.bot.session, alliance_id=config.alliance_id)
         result = {'Food': [], 'Food And Uranium': [], 'Uranium': []}
         ids = set()
-        for nation in data:
+        async for nation in alliance_member_res_query.stream(self.bot.session, alliance_id=config.alliance_id,
+                                                             priority=pnwutils.ratelimit.Priority.BACKGROUND):
             if nation['alliance_position'] == 'APPLICANT' or nation['vacation_mode_turns'] > 0:
                 continue
             needs_food = not nation['food']
@@ -33,7 +33,7 @@ class ResourceCheckCog(discordutils.CogBase):
                 result['Uranium'].append((nation['id'], nation['nation_name']))
             else:
                 continue
-            ids.add(nation['id'])
+            ids.add(int(nation['id']))
         if ids:
             async with self.bot.database.acquire() as conn:
                 async with conn.transaction():
@@ -43,12 +43,12 @@ class ResourceCheckCog(discordutils.CogBase):
                         self.bot.database
                             .get_table('users')
                             .select('discord_id', 'nation_id')
-                            .where(f'nation_id IN ({",".join(map(str, ids))})')
+                            .where_any(nation_id=ids)
                             .cursor(conn)
                     }
             embed = discord.Embed(title='Ran Out Of...')
             for k, ns in result.items():
-                string = '\n'.join((f'<@{d_id}>' if (d_id := map_discord.get(na[0])) else
+                string = '\n'.join((f'<@{d_id}>' if (d_id := map_discord.get(int(na[0]))) else
                                     f'[{na[1]}/{na[0]}]({pnwutils.link.nation(na[0])})') for na in ns)
                 if string:
                     embed.add_field(name=k, value=string)
@@ -1,4 +1,3 @@
-import asyncio
 import collections
 import datetime
 import io
@@ -7,18 +6,16 @@ import operator
 import re
 
 import aiohttp
-import asyncpg
 import discord
 import matplotlib.pyplot as plt
 import numpy as np
 from discord.ext import commands
 
 from .war import WarCog
-from ..utils import discordutils, pnwutils, config
+from ..utils import discordutils, pnwutils, config, metrics
 from .. import dbbot
-from ..utils.queries import (nation_register_query, alliance_member_res_query, alliance_activity_query,
-                             alliance_tiers_query, nation_info_query, global_trade_prices_query, nation_revenue_query,
-                             treasures_query, colours_query)
+from ..utils.queries import (nation_register_batch, alliance_member_res_query, alliance_activity_query,
+                             alliance_tiers_query, nation_info_query, global_trade_prices_query, revenue_query)
 
 
 class ExtraInfoView(discordutils.TimeoutView):
@@ -102,14 +99,11 @@ class UtilCog(discordutils.CogBase):
                 await interaction.response.send_message("The given ID isn't a number!", ephemeral=True)
                 return
 
-        data = await nation_register_query.query(self.bot.session, nation_id=nation_id)
-        data = data['data']
-        if not data:
-            # nation does not exist, empty list returned
+        data = await nation_register_batch.load(self.bot.session, nation_id)
+        if data is None:
+            # nation does not exist
             await interaction.response.send_message('This nation does not exist!', ephemeral=True)
             return
-        data = data[0]
-        # nation exists, is in one elem list
         if data['alliance_id'] != str(config.alliance_id):
             off_id = await pnwutils.get_offshore_id(self.bot.session)
             if data['alliance_id'] != off_id:
@@ -149,24 +143,18 @@ class UtilCog(discordutils.CogBase):
     @_register.command(name='update')
     async def register_update(self, interaction: discord.Interaction):
         """Update registry using the / separated nation ids in nicknames"""
-        count = 0
         await interaction.response.defer()
-        async with self.bot.database.acquire() as conn:
-            async with conn.transaction():
-                nation_ids = [rec['nation_id'] async for rec in self.users_table.select('nation_id').cursor(conn)]
-                for member in interaction.guild.members:
-                    if '/' in member.display_name:
-                        try:
-                            nation_id = int(member.display_name.split('/')[-1])
-                        except ValueError:
-                            continue
-                        if nation_id not in nation_ids:
-                            count += 1
-                            try:
-                                await self.users_table.insert(discord_id=member.id, nation_id=nation_id)
-                            except asyncpg.UniqueViolationError as e:
-                                await interaction.followup.send(f'An error occurred: {e}')
-        await interaction.followup.send(f'{count} members have been added to the database.')
+        registrations = []
+        for member in interaction.guild.members:
+            if '/' in member.display_name:
+                try:
+                    registrations.append((member.id, int(member.display_name.split('/')[-1])))
+                except ValueError:
+                    continue
+        # members or nations that are already registered are skipped
+        added = await self.users_table.insert_many(
+            'discord_id', 'nation_id', values=registrations).on_conflict().action_nothing()
+        await interaction.followup.send(f'{added} members have been added to the database.')
 
     @_register.command(name='other')
     async def register_other(self, interaction: discord.Interaction, member: discord.Member, nation_id: int):
@@ -176,14 +164,11 @@ class UtilCog(discordutils.CogBase):
                 'A user with this discord ID or nation ID has already been registered!')
             return
 
-        data = await nation_register_query.query(self.bot.session, nation_id=nation_id)
-        data = data['data']
-        if not data:
-            # nation does not exist, empty list returned
+        data = await nation_register_batch.load(self.bot.session, nation_id)
+        if data is None:
+            # nation does not exist
             await interaction.response.send_message('This nation does not exist!', ephemeral=True)
             return
-        data = data[0]
-        # nation exists, is in one elem list
         if data['alliance_id'] != str(config.alliance_id):
             off_id = await pnwutils.get_offshore_id(self.bot.session)
             if data['alliance_id'] != off_id:
@@ -213,8 +198,8 @@ class UtilCog(discordutils.CogBase):
     @_register.command(name='purge')
     async def register_purge(self, interaction: discord.Interaction):
         """Purge accounts that are not in the server from the database"""
-        ids = ', '.join(str(member.id) for member in interaction.guild.members)
-        _, n = (await self.bot.database.execute(f'DELETE FROM users WHERE discord_id NOT IN ({ids})')).split(' ')
+        ids = [member.id for member in interaction.guild.members]
+        _, n = (await self.users_table.delete().where_not_any(discord_id=ids)).split(' ')
         await interaction.response.send_message(f'{n} accounts not in the server have been purged!')
 
     _check = discord.app_commands.Group(name='_check', description='Various checks on members of the alliance',
@@ -224,10 +209,9 @@ class UtilCog(discordutils.CogBase):
     async def check_resources(self, interaction: discord.Interaction):
         """List all nations that have run out of food or uranium in the alliance."""
         await interaction.response.defer()
-        data = await alliance_member_res_query.query(self.bot.session, alliance_id=config.alliance_id)
         result = {'Food': [], 'Food And Uranium': [], 'Uranium': []}
         ids = set()
-        for nation in data:
+        async for nation in alliance_member_res_query.stream(self.bot.session, alliance_id=config.alliance_id):
             if nation['alliance_position'] == 'APPLICANT' or nation['vacation_mode_turns'] > 0:
                 continue
             needs_food = not nation['food']
@@ -242,17 +226,17 @@ class UtilCog(discordutils.CogBase):
                 result['Uranium'].append((nation['id'], nation['nation_name']))
             else:
                 continue
-            ids.add(nation['id'])
+            ids.add(int(nation['id']))
         if ids:
             async with self.bot.database.acquire() as conn:
                 async with conn.transaction():
                     map_discord = {rec['nation_id']: rec['discord_id'] async for rec in
-                                   self.users_table.select('discord_id', 'nation_id').where(
-                                       f'nation_id IN ({",".join(map(str, ids))})').cursor(conn)}
+                                   self.users_table.select('discord_id', 'nation_id').where_any(
+                                       nation_id=ids).cursor(conn)}
 
             embed = discord.Embed(title='Ran Out Of...')
             for k, ns in result.items():
-                string = '\n'.join((f'<@{d_id}>' if (d_id := map_discord.get(na[0])) else
+                string = '\n'.join((f'<@{d_id}>' if (d_id := map_discord.get(int(na[0]))) else
                                     f'[{na[1]}/{na[0]}]({pnwutils.link.nation(na[0])})') for na in ns)
                 if string:
                     embed.add_field(name=k, value=string)
@@ -284,8 +268,8 @@ class UtilCog(discordutils.CogBase):
         async with self.bot.database.acquire() as conn:
             async with conn.transaction():
                 map_discord = {rec['nation_id']: rec['discord_id'] async for rec in
-                               self.users_table.select('discord_id', 'nation_id').where(
-                                   f'nation_id IN ({",".join(map(str, inactives))})').cursor(conn)}
+                               self.users_table.select('discord_id', 'nation_id').where_any(
+                                   nation_id=inactives).cursor(conn)}
 
         for m in discordutils.split_blocks('\n', itertools.chain(
                 (f'Inactive for {days} day{"s" if days != 1 else ""}:',),
@@ -358,11 +342,11 @@ class UtilCog(discordutils.CogBase):
     # note: message command
     async def discords(self, interaction: discord.Interaction, message: discord.Message):
         """Look for the discord accounts of the nation links in the message!"""
-        nation_ids = ','.join(self.nation_link_pattern.findall(message.content))
+        nation_ids = {int(n) for n in self.nation_link_pattern.findall(message.content)}
         if not nation_ids:
             await interaction.response.send_message('No nation links found in this message!')
             return
-        found = await self.users_table.select('discord_id', 'nation_id').where(f'nation_id IN ({nation_ids})')
+        found = await self.users_table.select('discord_id', 'nation_id').where_any(nation_id=nation_ids)
 
         if found:
             await interaction.response.send_message(embed=discord.Embed(
@@ -429,11 +413,10 @@ class UtilCog(discordutils.CogBase):
     @discord.app_commands.command()
     async def global_trade_prices(self, interaction: discord.Interaction):
         """Find the lowest and highest buy and sell prices for each resource on the market"""
-        data = await global_trade_prices_query.query(self.bot.session)
         buy_max = {k: 0 for k in pnwutils.constants.market_res}
         buy_max['credits'] = 0
         sell_min = {}
-        for trade in data:
+        async for trade in global_trade_prices_query.stream(self.bot.session):
             if trade['buy_or_sell'] == 'sell':
                 if not (p := sell_min.get(trade['offer_resource'])) or p > trade['price']:
                     sell_min[trade['offer_resource']] = trade['price']
@@ -467,13 +450,12 @@ class UtilCog(discordutils.CogBase):
                 )
                 return
         await interaction.response.defer()
-        nation_q = asyncio.create_task(nation_revenue_query.query(self.bot.session, nation_ids=[nation_id]))
-        treasure_q = asyncio.create_task(treasures_query.query(self.bot.session))
-        colour_q = asyncio.create_task(colours_query.query(self.bot.session))
-        data = (await nation_q)['data'][0]
+        nation_data, treasure_data, colour_data = await revenue_query.query(
+            self.bot.session, {'nation_ids': [nation_id]})
+        data = nation_data['data'][0]
         n = pnwutils.models.Nation(data)
         await interaction.followup.send(embed=(n.revenue(
-            await colour_q, pnwutils.formulas.treasure_bonus(await treasure_q, data['id'], data['alliance_id'])
+            colour_data, pnwutils.formulas.treasure_bonus(treasure_data, data['id'], data['alliance_id'])
         ) * days).create_embed(
             title=f"{data['nation_name']}'s Revenue {'Per Day' if days == 1 else f'Every {days} days'}"))
 
@@ -488,6 +470,73 @@ class UtilCog(discordutils.CogBase):
             return
         await interaction.response.send_message(f'The extension `{extension}` has been reloaded!')
 
+    @discord.app_commands.command(name='_rate_limits')
+    @discord.app_commands.default_permissions(manage_guild=True)
+    async def rate_limits(self, interaction: discord.Interaction) -> None:
+        """Show the queue depths and waiting times of API requests"""
+        embeds = []
+        for i, stats in enumerate(pnwutils.ratelimit.stats(), 1):
+            embed = discord.Embed(title=f'API Key {i}')
+            for name, values in stats.items():
+                embed.add_field(name=name.title(), value='\n'.join(
+                    f'{k}: {v:.2f}' if isinstance(v, float) else f'{k}: {v}' for k, v in values.items()))
+            embeds.append(embed)
+        await interaction.response.send_message(
+            embeds=embeds[:10] if embeds else None, content=None if embeds else 'No API requests have been made yet!',
+            ephemeral=True)
+
+    @discord.app_commands.command(name='_query_audit')
+    @discord.app_commands.describe(enable='Turn tracking of the fields read from query results on or off')
+    @discord.app_commands.default_permissions(manage_guild=True)
+    async def query_audit(self, interaction: discord.Interaction, enable: bool = None) -> None:
+        """List the fields of each query that were fetched but never read"""
+        if enable is not None:
+            pnwutils.audit.enabled = enable
+            if enable:
+                pnwutils.audit.reset()
+        report = pnwutils.audit.report()
+        text = '\n\n'.join(f'**{op}**\n' + '\n'.join(fields) for op, fields in report.items())
+        await interaction.response.send_message(
+            f'Auditing is {"on" if pnwutils.audit.enabled else "off"}.\n\n{text or "No unread fields found."}'[:2000],
+            ephemeral=True)
+
+    @discord.app_commands.command(name='_metrics')
+    @discord.app_commands.describe(prefix='Only show metrics with names starting with this, such as api.')
+    @discord.app_commands.default_permissions(manage_guild=True)
+    async def dump_metrics(self, interaction: discord.Interaction, prefix: str = '') -> None:
+        """Dump the metrics recorded by the bot"""
+        text = metrics.registry.dump(prefix) or 'No metrics have been recorded!'
+        if len(text) > 1990:
+            await interaction.response.send_message(
+                file=discord.File(io.BytesIO(text.encode()), filename='metrics.txt'), ephemeral=True)
+            return
+        await interaction.response.send_message(f'```{text}```', ephemeral=True)
+
+    @discord.app_commands.command(name='_db_report')
+    @discord.app_commands.default_permissions(manage_guild=True)
+    async def db_report(self, interaction: discord.Interaction) -> None:
+        """Report on database pool usage, the most expensive statements and slow queries"""
+        text = self.bot.database.report()
+        if len(text) > 1990:
+            await interaction.response.send_message(
+                file=discord.File(io.BytesIO(text.encode()), filename='db_report.txt'), ephemeral=True)
+            return
+        await interaction.response.send_message(f'```{text}```', ephemeral=True)
+
+    @discord.app_commands.command(name='_prune_views')
+    @discord.app_commands.describe(delete='Actually delete the views, rather than only counting them')
+    @discord.app_commands.default_permissions(administrator=True)
+    async def prune_views(self, interaction: discord.Interaction, delete: bool = False) -> None:
+        """Count, or delete, the stored views whose kind is not known to the bot"""
+        unknown = await self.bot.view_table.prune(dry_run=not delete)
+        if not unknown:
+            await interaction.response.send_message('There are no stored views of unknown kinds!', ephemeral=True)
+            return
+        text = '\n'.join(f'{kind or "could not be converted"}: {count}' for kind, count in unknown.items())
+        await interaction.response.send_message(
+            f'{"Deleted" if delete else "Would delete"} {sum(unknown.values())} stored views:\n{text}'[:2000],
+            ephemeral=True)
+
     @commands.command()
     @commands.has_guild_permissions(administrator=True)
     async def sync(self, ctx: commands.Context):
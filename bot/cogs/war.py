@@ -7,7 +7,7 @@ import discord
 from ..utils import discordutils, pnwutils, config
 from .. import dbbot
 from ..utils.queries import (individual_war_query, nation_active_wars_query,
-                             find_slots_query, nation_score_query, spy_sat_query, find_in_range_query, military_query)
+                             find_slots_query, nation_score_batch, spy_sat_query, find_in_range_query, military_query)
 
 
 class OddsInfoView(discordutils.TimeoutView):
@@ -138,11 +138,8 @@ class WarCog(discordutils.CogBase):
                     'Incorrect format for ids! Please provide a comma separated ID list, like `4221,1224`')
                 return
 
-        data = await find_slots_query.query(
-            self.bot.session, alliance_ids=alliances, min_score=mi, max_score=ma)
-
         found = collections.defaultdict(set)
-        for n in data:
+        async for n in find_slots_query.stream(self.bot.session, alliance_ids=alliances, min_score=mi, max_score=ma):
             if n['vacation_mode_turns'] > turns or n['alliance_position'] == 'APPLICANT' or n['beige_turns'] > turns:
                 continue
             def_war_turns = [w['turns_left'] for w in n['wars'] if w['def_id'] == n['id'] and w['turns_left'] > 0]
@@ -197,8 +194,8 @@ class WarCog(discordutils.CogBase):
                 await interaction.response.send_message('This user does not have a nation registered!')
                 return
             await interaction.response.defer()
-            score_data = await nation_score_query.query(self.bot.session, nation_id=nation_id)
-            mi, ma = pnwutils.formulas.war_range(score_data['data'][0]['score'])
+            score_data = await nation_score_batch.load(self.bot.session, nation_id)
+            mi, ma = pnwutils.formulas.war_range(score_data['score'])
         await self._find_slots(interaction, ids, turns, mi, ma)
 
     @find.command()
@@ -250,15 +247,15 @@ class WarCog(discordutils.CogBase):
             await interaction.response.send_message('At least one of score and nation_id must be provided!')
             return
         if score is None:
-            score = (await nation_score_query.query(self.bot.session, nation_id=nation_id))['data'][0]['score']
+            score = (await nation_score_batch.load(self.bot.session, nation_id))['score']
         mi, ma = pnwutils.formulas.inverse_war_range(score)
         data = await find_in_range_query.query(self.bot.session, alliance_id=config.alliance_id,
                                                min_score=mi, max_score=ma)
 
-        n_ids = ",".join(e['id'] for e in data['data'] if e['num_cities'] >= min_cities)
+        n_ids = [int(e['id']) for e in data['data'] if e['num_cities'] >= min_cities]
         if n_ids:
             found = await self.bot.database.get_table('users').select(
-                'discord_id', 'nation_id').where(f'nation_id IN ({n_ids})')
+                'discord_id', 'nation_id').where_any(nation_id=n_ids)
 
             await interaction.response.send_message(embed=discord.Embed(
                 title='Nations found in war range',
@@ -13,18 +13,16 @@ async def main():
     d = eval(data)
     nations = d['cogs.util.nations']
     balances = d['cogs.bank.balances']
-    tasks = []
+    rows = []
     async with db:
         print(balances)
         for d_id, n_id in nations.items():
             if bal := balances.get(d_id):
                 res = pnwutils.Resources(**bal)
                 print(d_id, res.to_display_string(','))
-                tasks.append(asyncio.create_task(db.execute(
-                    f'INSERT INTO users(discord_id, nation_id, balance) VALUES ($1, $2, {res.to_row()}) '
-                    f'ON CONFLICT (discord_id) DO UPDATE SET nation_id = $2, balance = {res.to_row()}',
-                    int(d_id), int(n_id))))
-        await asyncio.gather(*tasks)
+                rows.append((int(d_id), int(n_id), res.to_record()))
+        users = databases.Table(db, 'users', {})
+        await users.upsert_many('discord_id', 'nation_id', 'balance', values=rows, conflict=('discord_id',))
         print('done')
 
 if __name__ == '__main__':
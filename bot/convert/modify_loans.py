@@ -21,9 +21,9 @@ async def main():
             if d_id in (826281787948138496, 759557583933145129):
                 continue
             tasks.append(asyncio.create_task(db.execute(
-                f'INSERT INTO loans(discord_id, due_date, loaned) VALUES ($1, $2, '
-                f'{pnwutils.Resources(**loan["resources"]).to_row()})',
-                d_id, datetime.datetime.fromisoformat(loan['due_date']))))
+                'INSERT INTO loans(discord_id, due_date, loaned) VALUES ($1, $2, $3)',
+                d_id, datetime.datetime.fromisoformat(loan['due_date']),
+                pnwutils.Resources(**loan['resources']).to_record())))
         await asyncio.gather(*tasks)
         print('done')
 
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import asyncio
+import collections
 import random
 import traceback
 import pkgutil
@@ -12,7 +13,7 @@ import discord
 import pnwkit
 from discord.ext import tasks, commands
 
-from .utils import discordutils, databases, config
+from .utils import discordutils, databases, pnwutils, config
 
 
 async def database_init_pre(database: databases.Database):
@@ -41,12 +42,69 @@ async def database_init_pre(database: databases.Database):
             CREATE OPERATOR - (leftarg = resources, rightarg = resources, function = sub_resources);
         EXCEPTION WHEN duplicate_function THEN null;
         END $$;
+
+        DO $$ BEGIN
+            CREATE AGGREGATE sum(resources) (
+                sfunc = add_resources, stype = resources, initcond = '(0,0,0,0,0,0,0,0,0,0,0,0)');
+        EXCEPTION WHEN duplicate_function THEN null;
+        END $$;
         ''')
 
 
 async def database_init_post(database: databases.Database):
     # ensure misc table is populated with its single row
     await database.execute('INSERT INTO misc DEFAULT VALUES ON CONFLICT DO NOTHING')
+    # keep the total of all balances up to date as they change, starting from the current total
+    # each connection adds its changes to its own shard row, so concurrent transactions do not queue on one row lock
+    # the starting total goes in shard -1, which no connection writes to
+    await database.execute('''
+        CREATE OR REPLACE FUNCTION track_balance_total() RETURNS TRIGGER AS $$
+        DECLARE change resources := ROW(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0);
+        BEGIN
+            IF TG_OP <> 'DELETE' THEN
+                change := change + NEW.balance;
+            END IF;
+            IF TG_OP <> 'INSERT' THEN
+                change := change - OLD.balance;
+            END IF;
+            INSERT INTO balance_totals(shard, total) VALUES (pg_backend_pid() % 16, change)
+            ON CONFLICT (shard) DO UPDATE SET total = balance_totals.total + EXCLUDED.total;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+
+        DO $$ BEGIN
+            CREATE TRIGGER users_balance_total AFTER INSERT OR DELETE OR UPDATE OF balance ON users
+            FOR EACH ROW EXECUTE FUNCTION track_balance_total();
+        EXCEPTION WHEN duplicate_object THEN null;
+        END $$;
+
+        INSERT INTO balance_totals(shard, total) SELECT -1, sum(balance) FROM users ON CONFLICT DO NOTHING;
+        ''')
+
+
+async def memory_init_pre(database: databases.MemoryDatabase):
+    # stands in for database_init_pre, whose type and operators the memory database provides itself
+    database.new_type('resources', pnwutils.Resources.all_res)
+
+
+async def memory_init_post(database: databases.MemoryDatabase):
+    async def track_balance_total(conn: databases.MemoryConnection, old, new):
+        if old is not None and new is not None and old['balance'] == new['balance']:
+            return
+        change = pnwutils.Resources()
+        if new is not None:
+            change += pnwutils.Resources.from_record(new['balance'])
+        if old is not None:
+            change -= pnwutils.Resources.from_record(old['balance'])
+        # there is only ever one connection, so every change goes in shard 0
+        await conn.execute(
+            'INSERT INTO balance_totals(shard, total) VALUES (0, $1) '
+            'ON CONFLICT (shard) DO UPDATE SET total = balance_totals.total + EXCLUDED.total', change.to_record())
+
+    await database.execute('INSERT INTO misc DEFAULT VALUES ON CONFLICT DO NOTHING')
+    database.add_trigger('users', track_balance_total)
+    await database.execute(
+        'INSERT INTO balance_totals(shard, total) SELECT -1, sum(balance) FROM users ON CONFLICT DO NOTHING')
 
 
 class DBBot(commands.Bot):
@@ -58,7 +116,10 @@ class DBBot(commands.Bot):
         self.excluded = {'debug', }
         self.kit = pnwkit.QueryKit(config.api_key)
 
-        self.database: databases.Database = databases.PGDatabase(database_init_pre, database_init_post, dsn=db_url)
+        # a url of memory: keeps the database in memory, for benchmarks and load tests without postgres
+        self.database: databases.Database = (
+            databases.MemoryDatabase(memory_init_pre, memory_init_post) if db_url.startswith('memory:')
+            else databases.PGDatabase(database_init_pre, database_init_post, dsn=db_url))
 
         self.database.new_table('users', discord_id='BIGINT PRIMARY KEY', nation_id='INT UNIQUE NOT NULL',
                                 balance='resources DEFAULT ROW(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0) NOT NULL')
@@ -76,14 +137,25 @@ class DBBot(commands.Bot):
         self.database.new_table('coalitions', name='TEXT PRIMARY KEY', alliances='INT[] NOT NULL')
         self.database.new_table('misc', one='BOOLEAN GENERATED ALWAYS AS (TRUE) STORED UNIQUE',
                                 open_slot_coalition='TEXT REFERENCES coalitions(name) DEFAULT NULL')
+        self.database.new_table('balance_totals', shard='SMALLINT PRIMARY KEY', total='resources NOT NULL')
         self.database.new_table('to_resend', time='TIMESTAMP(0) WITH TIME ZONE NOT NULL', send_id='BIGINT',
                                 channel_id='BIGINT NOT NULL', message_id='BIGINT NOT NULL')
 
+        self.database.new_table('active_wars', id='INT PRIMARY KEY', date='TIMESTAMP WITH TIME ZONE NOT NULL',
+                                winner_id='INT', turns_left='SMALLINT', war_type='TEXT NOT NULL',
+                                att_id='INT NOT NULL', def_id='INT NOT NULL', att_alliance_id='INT',
+                                def_alliance_id='INT', att_resistance='SMALLINT', def_resistance='SMALLINT',
+                                att_points='SMALLINT', def_points='SMALLINT')
+        self.database.new_table('war_breakpoints', war_id='INT PRIMARY KEY', breakpoint='SMALLINT NOT NULL',
+                                expires='TIMESTAMP WITH TIME ZONE NOT NULL')
+
         self.database.new_kv('channel_ids', 'BIGINT')
         self.database.new_kv('kv_ints', 'INT')
         self.database.new_kv('kv_bools', 'BOOL')
-        self.view_table = databases.ViewTable(self.database, 'views')
+        self.view_table = databases.ViewTable(self.database, 'views', discordutils.PersistentView.kinds)
         self.database.add_table(self.view_table)
+        self.ledger = databases.LedgerTable(self.database, 'ledger')
+        self.database.add_table(self.ledger)
 
         self.possible_statuses = possible_statuses if possible_statuses is not None else (
             *map(discord.Game, ("with Python", "with the P&W API")),
@@ -92,6 +164,11 @@ class DBBot(commands.Bot):
         )
 
         discordutils.PersistentView.bot = self
+        # stored views are only restored when used, and the most recently used are kept listening
+        self.hot_views: collections.OrderedDict[int, discordutils.PersistentView] = collections.OrderedDict()
+        self.hot_views_size = 128
+        # views being restored, so that interactions arriving meanwhile wait for the same restore
+        self.restoring_views: dict[int, asyncio.Task[discordutils.PersistentView | None]] = {}
 
         self.tree.error(self.on_app_command_error)
         self.command_ids: dict[int, dict[str, int]] = {}
@@ -142,21 +219,60 @@ class DBBot(commands.Bot):
     async def change_status(self):
         await self.change_presence(activity=random.choice(self.possible_statuses))
 
-    async def add_view(self, view: discordutils.PersistentView, *, message_id: int | None = None) -> None:
+    def _listen_to_view(self, view: discordutils.PersistentView, message_id: int | None = None) -> None:
         super().add_view(view, message_id=message_id)
+        self.hot_views[view.custom_id] = view
+        if len(self.hot_views) > self.hot_views_size:
+            # the view stays stored, and will be restored again when next used
+            _, cold = self.hot_views.popitem(last=False)
+            cold.stop()
+
+    async def add_view(self, view: discordutils.PersistentView, *, message_id: int | None = None) -> None:
+        self._listen_to_view(view, message_id)
         await self.view_table.add(view)
 
     async def remove_view(self, view: discordutils.PersistentView):
+        self.hot_views.pop(view.custom_id, None)
         await self.view_table.remove(view.custom_id)
 
+    async def on_interaction(self, interaction: discord.Interaction):
+        """Restores the stored view that a pressed component belongs to, if it is not already listening."""
+        if interaction.type is not discord.InteractionType.component:
+            return
+        custom_id = interaction.data.get('custom_id', '')
+        view_id = discordutils.PersistentView.parse_custom_id(custom_id)
+        if view_id is None:
+            return
+        if view_id in self.hot_views:
+            self.hot_views.move_to_end(view_id)
+            return
+        restoring = self.restoring_views.get(view_id)
+        if restoring is None:
+            restoring = self.restoring_views[view_id] = asyncio.create_task(self._restore_view(view_id))
+        view = await asyncio.shield(restoring)
+        if view is None:
+            return
+        # the view was not listening when this interaction was dispatched, so dispatch it now
+        if not discordutils.dispatch_restored(view, interaction):
+            await interaction.response.send_message('Sorry, please press that again!', ephemeral=True)
+
+    async def _restore_view(self, view_id: int) -> discordutils.PersistentView | None:
+        try:
+            view = await self.view_table.get(view_id)
+            if view is not None:
+                self._listen_to_view(view)
+            return view
+        finally:
+            del self.restoring_views[view_id]
+
     async def on_ready(self):
         self.change_status.start()
-
-        # add views
-        async for view in self.view_table.get_all():
-            super().add_view(view)
-            print(f'Adding a {type(view)} from storage!')
-
+        if renamed := await self.view_table.migrate_kinds():
+            print(f'Renamed the kind of {renamed} stored views to include their module')
+        for kind, count in (await self.view_table.unknown_kinds()).items():
+            print(f'{count} stored views are ' + (f'of unknown kind {kind}' if kind is not None else
+                                                 'in the old format and could not be converted') +
+                  ', they can be deleted with _prune_views')
         print('Ready!')
 
     async def on_app_command_error(self, interaction: discord.Interaction,
@@ -4,3 +4,4 @@ from . import config
 from . import databases
 # from . import help_command
 from . import queries
+from . import war_state
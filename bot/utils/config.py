@@ -31,8 +31,13 @@ api_key: str = os.environ['MYSQLCONNSTR_API_KEY']
 api_key_mut: str = os.environ['MYSQLCONNSTR_API_KEY_MUT']
 offshore_api_key = os.environ['MYSQLCONNSTR_OFFSHORE_API_KEY']
 database_url: str = os.environ['MYSQLCONNSTR_DB_URL']
+# requests allowed per window by the api key, replaced by the X-RateLimit-Limit header once a response arrives
+api_rate_limit: int = 60
+api_rate_window: float = 60
 alliance_id: int = 4221
 alliance_name: str = 'Dark Brotherhood'
+# subscribe only to wars involving the alliance, instead of to every war in the game
+filter_war_subscriptions: bool = True
 
 interviewer_role_id = 331571201686372356
 interview_questions = (
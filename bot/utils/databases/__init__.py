@@ -1,3 +1,5 @@
 from .postgresql import *
 from .classes import*
 from .misc import *
+from .ledger import *
+from .memory import *
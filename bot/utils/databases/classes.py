@@ -2,10 +2,14 @@ from __future__ import annotations
 
 import abc
 import asyncio
-from collections.abc import Awaitable, Callable, Iterable
+import copy
+import functools
+import json
+import traceback
+from collections.abc import Awaitable, Callable, Collection, Iterable, Sequence
 from typing import Any, Generic, TypeVar
 
-__all__ = ('Database', 'Table', 'KVTable')
+__all__ = ('Database', 'Transaction', 'Table', 'KVTable')
 
 import asyncpg
 
@@ -18,15 +22,18 @@ class RecordClass(asyncpg.Record):
 
 
 InitFunc = Callable[['Database'], Awaitable[object]]
+ListenerFunc = Callable[[str], object]
 
 
 class Database(abc.ABC, Generic[R]):
-    __slots__ = ('init_pre', 'init_post', 'tables')
+    __slots__ = ('init_pre', 'init_post', 'tables', '_tasks')
 
     def __init__(self, init_pre: InitFunc, init_post: InitFunc):
         self.init_pre = init_pre
         self.init_post = init_post
         self.tables: dict[str, Table] = {}
+        # background tasks, kept so that they are not garbage collected while running
+        self._tasks: set[asyncio.Task] = set()
 
     async def initialise(self) -> None:
         try:
@@ -35,11 +42,55 @@ class Database(abc.ABC, Generic[R]):
             for table in self.tables.values():
                 await table.create()
             await self.init_post(self)
+            await self.load_kv_caches()
         except asyncpg.PostgresSyntaxError as e:
 
             print(e.as_dict())
             raise
 
+    async def load_kv_caches(self) -> None:
+        """Fills the cache of every KVTable, keeping them up to date through notifications of changes."""
+        kv_tables = [t for t in self.tables.values() if isinstance(t, KVTable)]
+        if kv_tables:
+            # listen first, so that changes made while loading are not missed
+            await self.listen(KVTable.channel, self._on_kv_change, self._on_listen_lost)
+            for table in kv_tables:
+                await table.load()
+
+    def _spawn(self, coro: Awaitable[object]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and (e := task.exception()) is not None:
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    def _on_kv_change(self, payload: str) -> None:
+        change = json.loads(payload)
+        table = self.tables.get(change['table'])
+        if isinstance(table, KVTable):
+            self._spawn(table.refresh(change['key']))
+
+    def _on_listen_lost(self) -> None:
+        # without notifications the caches could go stale, so read from the database until listening again
+        for table in self.tables.values():
+            if isinstance(table, KVTable):
+                table.cache = None
+        self._spawn(self._relisten())
+
+    async def _relisten(self, max_delay: float = 60) -> None:
+        delay = 1.
+        while True:
+            try:
+                await self.load_kv_caches()
+                return
+            except Exception as e:
+                print(f'Listening for changes failed, retrying in {delay:.0f}s: {e!r}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
     @abc.abstractmethod
     async def __aenter__(self):
         ...
@@ -68,10 +119,25 @@ class Database(abc.ABC, Generic[R]):
     async def fetch_val(self, query, *args, timeout: float | None = None) -> Any:
         ...
 
+    @abc.abstractmethod
+    async def copy_insert(self, query, table: str, cols: Sequence[str], records: Iterable[Sequence],
+                          *, timeout: float | None = None) -> str:
+        """Copies [records] of [cols] into the staging table for [table], then runs [query] to insert from it."""
+        ...
+
     @abc.abstractmethod
     async def acquire(self) -> Any:
         ...
 
+    @abc.abstractmethod
+    async def listen(self, channel: str, callback: ListenerFunc,
+                     on_lost: Callable[[], object] | None = None) -> None:
+        """
+        Calls [callback] with the payload of each notification sent on [channel], by any connection.
+        [on_lost] is called if the database stops delivering them.
+        """
+        ...
+
     def new_table(self, name: str, /, additional: str = '', **cols: str) -> None:
         table = Table(self, name, cols, additional)
         self.tables[name] = table
@@ -89,30 +155,177 @@ class Database(abc.ABC, Generic[R]):
     def get_kv(self, name: str) -> 'KVTable':
         return self.tables[name]  # type: ignore
 
+    def report(self) -> str:
+        """A summary of how the database has been performing."""
+        return 'No report is available for this database.'
+
+    def transaction(self) -> 'Transaction':
+        """
+        A unit of work, whose statements all run on one connection and are committed together.
+        Use it as `async with database.transaction() as t:`, and reach tables through `t.get_table(...)`.
+        """
+        return Transaction(self)
+
+
+class Transaction:
+    """
+    Runs statements on a single connection inside a transaction, which is committed when the block exits normally
+    and rolled back if it raises. Statements on it must be awaited one after another, not gathered.
+    """
+    __slots__ = ('database', 'conn', '_acquire', '_transaction', '_tables', '_on_commit')
+
+    def __init__(self, database: Database):
+        self.database = database
+        self.conn: Any = None
+        self._acquire: Any = None
+        self._transaction: Any = None
+        self._tables: dict[str, Table] = {}
+        self._on_commit: list[Callable[[], object]] = []
+
+    async def __aenter__(self) -> Transaction:
+        self._acquire = self.database.acquire()
+        self.conn = await self._acquire.__aenter__()
+        try:
+            self._transaction = self.conn.transaction()
+            await self._transaction.__aenter__()
+        except BaseException as e:
+            await self._acquire.__aexit__(type(e), e, e.__traceback__)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        callbacks, self._on_commit = self._on_commit, []
+        try:
+            await self._transaction.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            await self._acquire.__aexit__(exc_type, exc_val, exc_tb)
+            self.conn = None
+        if exc_type is None:
+            for callback in callbacks:
+                callback()
+
+    def on_commit(self, callback: Callable[[], object]) -> None:
+        """Calls [callback] once the transaction has been committed, and never if it is rolled back."""
+        self._on_commit.append(callback)
+
+    def execute(self, query, *args, timeout: float | None = None) -> Awaitable[str]:
+        return self.conn.execute(query, *args, timeout=timeout)
+
+    def execute_many(self, query, args, *, timeout: float | None = None) -> Awaitable[None]:
+        return self.conn.executemany(query, args, timeout=timeout)
+
+    def fetch(self, query, *args, timeout: float | None = None) -> Awaitable[Iterable]:
+        return self.conn.fetch(query, *args, timeout=timeout)
+
+    def copy_insert(self, query, table: str, cols: Sequence[str], records: Iterable[Sequence],
+                    *, timeout: float | None = None) -> Awaitable[str]:
+        return copy_insert(self.conn, query, table, cols, records, timeout=timeout)
+
+    def fetch_row(self, query, *args, timeout: float | None = None) -> Awaitable[Any]:
+        return self.conn.fetchrow(query, *args, timeout=timeout)
+
+    def fetch_val(self, query, *args, timeout: float | None = None) -> Awaitable[Any]:
+        return self.conn.fetchval(query, *args, timeout=timeout)
+
+    def get_table(self, name: str) -> Table:
+        """The table called [name], with its statements run as part of this transaction."""
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = self.database.tables[name].bind(self)
+        return table
+
+    def get_kv(self, name: str) -> KVTable:
+        return self.get_table(name)  # type: ignore
+
 
 T = TypeVar('T')
 
 
+@functools.lru_cache(maxsize=None)
+def _conditions(keys: tuple[str, ...], start: int, template: str, joiner: str) -> str:
+    """
+    Builds a WHERE clause with a [template] such as '{} = ${}' for each key, numbered from [start].
+    The clause only depends on the shape of the query, so it is built once and the same text is sent each time,
+    letting asyncpg reuse the statement it prepared for it on each connection.
+    """
+    return ' WHERE ' + joiner.join(template.format(k, i) for i, k in enumerate(keys, start))
+
+
+def _staging(table: str) -> str:
+    return f'{table}_staging'
+
+
+async def copy_insert(conn: Any, query: str, table: str, cols: Sequence[str], records: Iterable[Sequence],
+                      *, timeout: float | None = None) -> str:
+    """
+    Copies [records] into a temporary table with the [cols] of [table], in one round trip however many there are,
+    then runs [query], which inserts from it. The temporary table only lasts for the transaction this opens on [conn].
+    """
+    staging = _staging(table)
+    async with conn.transaction():
+        await conn.execute(f'CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS '
+                           f'SELECT {",".join(cols)} FROM {table} WITH NO DATA', timeout=timeout)
+        await conn.copy_records_to_table(staging, records=records, columns=list(cols), timeout=timeout)
+        result = await conn.execute(query, timeout=timeout)
+        # dropped now as well, in case this is nested in a longer transaction that copies into it again
+        await conn.execute(f'DROP TABLE {staging}', timeout=timeout)
+    return result
+
+
+def _row_count(status: str) -> int:
+    """The number of rows written by a statement, from its status such as 'INSERT 0 5'."""
+    return int(status.rsplit(' ', 1)[-1])
+
+
+@functools.lru_cache(maxsize=None)
+def _copy_insert_string(table: str, cols: tuple[str, ...]) -> str:
+    cols_string = ','.join(cols)
+    return f'INSERT INTO {table}({cols_string}) SELECT {cols_string} FROM {_staging(table)}'
+
+
+@functools.lru_cache(maxsize=None)
+def _select_string(table: str, selecting: str) -> str:
+    return f'SELECT {selecting} FROM {table}'
+
+
+@functools.lru_cache(maxsize=None)
+def _insert_string(table: str, cols: tuple[str, ...]) -> str:
+    values_string = ','.join(f'${i}' for i in range(1, len(cols) + 1))
+    return f'INSERT INTO {table}({",".join(cols)}) VALUES ({values_string})'
+
+
 class Query(Awaitable[T]):
     __slots__ = ('query', 'table', 'coro', 'args')
 
-    def __init__(self, table: Table, query: str, coro: Callable[..., Awaitable], args: Iterable | None = None):
+    def __init__(self, table: Table, query: str, coro: Callable[..., Awaitable], args: Collection | None = None):
         self.query = query
         self.table = table
         self.coro = coro
-        self.args: Iterable = () if args is None else args
+        self.args: Collection = () if args is None else args
 
     def __await__(self):
         return self.coro(self.query, *self.args).__await__()
 
+    def _bind(self, conditions: dict[str, Any], template: str, joiner: str = ' AND ') -> Query:
+        # numbering carries on from any arguments already bound, such as those of an update
+        self.query += _conditions(tuple(conditions), len(self.args) + 1, template, joiner)
+        self.args = (*self.args, *conditions.values())
+        return self
+
     def where(self, condition: str | None = None, **conditions: Any) -> Query:
         if condition is None:
-            self.query += ' WHERE ' + ' AND '.join(f'{k} = ${i}' for i, k in enumerate(conditions.keys(), 1))
-            self.args = conditions.values()
-        else:
-            self.query += f' WHERE {condition}'
+            return self._bind(conditions, '{} = ${}')
+        self.query += f' WHERE {condition}'
         return self
 
+    def where_any(self, **conditions: Collection) -> Query:
+        """Matches rows where each column is one of the values given for it, like IN but with one bound array."""
+        return self._bind({k: list(v) for k, v in conditions.items()}, '{} = ANY(${})')
+
+    def where_not_any(self, **conditions: Collection) -> Query:
+        """Matches rows where each column is none of the values given for it."""
+        return self._bind({k: list(v) for k, v in conditions.items()}, '{} <> ALL(${})')
+
     def returning(self, returning) -> Query:
         self.query += f' RETURNING {returning}'
         self.coro = self.table.database.fetch
@@ -131,8 +344,12 @@ class Query(Awaitable[T]):
     def cursor(self, conn):
         return conn.cursor(self.query, *self.args)
 
-    def on_conflict(self, target: str):
-        self.query += f'ON CONFLICT {target} DO'
+    def on_conflict(self, target: str | None = None):
+        """
+        Adds an ON CONFLICT clause for the columns in [target], such as '(discord_id)', to be followed by an action.
+        Without a target, a conflict on any unique constraint is caught, which only action_nothing() can handle.
+        """
+        self.query += ' ON CONFLICT DO' if target is None else f' ON CONFLICT {target} DO'
         return self
 
     def action_nothing(self):
@@ -143,9 +360,8 @@ class Query(Awaitable[T]):
         self.query += f' UPDATE SET {updates}'
         return self
 
-    def where_or(self, **conditions):
-        self.query += ' WHERE ' + ' OR '.join((f'{k} = {v}' for k, v in conditions.items()))
-        return self
+    def where_or(self, **conditions: Any) -> Query:
+        return self._bind(conditions, '{} = ${}', ' OR ')
 
     def order_by(self, *cond: str):
         self.query += ' ORDER BY ' + ','.join(cond)
@@ -155,7 +371,7 @@ class Query(Awaitable[T]):
 class Table:
     __slots__ = ('database', 'name', 'cols', 'additional')
 
-    def __init__(self, database: Database, name: str, cols: dict[str, str], additional: str = ''):
+    def __init__(self, database: Database | Transaction, name: str, cols: dict[str, str], additional: str = ''):
         self.database = database
         self.name = name
         self.cols = cols
@@ -165,8 +381,20 @@ class Table:
         cols_string = ','.join(f'{n} {t}' for n, t in self.cols.items())
         return self.database.execute(f'CREATE TABLE IF NOT EXISTS {self.name} ({cols_string}{self.additional})')
 
+    def emulate(self, database: Any) -> None:
+        """
+        Called by a MemoryDatabase before the table is created,
+        to register what stands in for the parts of the table it cannot run, such as triggers.
+        """
+
     def _select_string(self, selecting: str):
-        return f'SELECT {selecting} FROM {self.name}'
+        return _select_string(self.name, selecting)
+
+    def bind(self, database: Database | Transaction) -> Table:
+        """A copy of this table that runs its statements through [database] instead."""
+        table = copy.copy(self)
+        table.database = database
+        return table
 
     def select(self, *to_select) -> Query[list]:
         if to_select:
@@ -187,48 +415,128 @@ class Table:
                            ).where_or(**conditions) is not None
 
     def insert(self, **to_insert: Any) -> Query[str]:
-        values_string = ','.join(f'${i}' for i in range(1, len(to_insert) + 1))
-        return Query(self, f'INSERT INTO {self.name}({",".join(to_insert.keys())}) VALUES ({values_string})',
-                     self.database.execute, to_insert.values())
+        return Query(self, _insert_string(self.name, tuple(to_insert)), self.database.execute, to_insert.values())
+
+    async def _copy_insert_count(self, query: str, *args: Any) -> int:
+        return _row_count(await self.database.copy_insert(query, *args))
 
-    def insert_many(self, *cols: str, values: Iterable[Iterable]) -> Query[None]:
-        values_string = ','.join(f'${i}' for i in range(1, len(cols) + 1))
-        return Query(self, f'INSERT INTO {self.name}({",".join(cols)}) VALUES ({values_string})',
-                     self.database.execute_many, (values,))
+    def insert_many(self, *cols: str, values: Iterable[Sequence]) -> Query[int]:
+        """
+        Inserts a row for each of [values], which are copied in bulk rather than inserted one at a time.
+        Like insert, ON CONFLICT can be added to the query returned, which gives the number of rows written.
+        """
+        return Query(self, _copy_insert_string(self.name, cols), self._copy_insert_count, (self.name, cols, values))
 
-    def update(self, updates: str) -> Query[str]:
-        return Query(self, f'UPDATE {self.name} SET {updates}', self.database.execute)
+    def upsert_many(self, *cols: str, values: Iterable[Sequence], conflict: Sequence[str]) -> Query[int]:
+        """Inserts [values] like insert_many, updating the rest of [cols] of rows with the same [conflict] columns."""
+        updates = ','.join(f'{c} = EXCLUDED.{c}' for c in cols if c not in conflict)
+        query = self.insert_many(*cols, values=values).on_conflict(f'({",".join(conflict)})')
+        return query.action_update(updates) if updates else query.action_nothing()
+
+    def update(self, updates: str, *args: Any) -> Query[str]:
+        """Updates rows with [updates], in which $1, $2, ... refer to [args]."""
+        return Query(self, f'UPDATE {self.name} SET {updates}', self.database.execute, args)
 
     def delete(self) -> Query:
         return Query(self, f'DELETE FROM {self.name}', self.database.execute)
 
 
 class KVTable(Table, Generic[T]):
-    __slots__ = ()
+    """
+    A table of keys and values, read from an in-memory copy once loaded.
+    A trigger notifies every connection of each change, however it was made, so the copy is kept up to date.
+    """
+    __slots__ = ('value_type', 'cache', 'unbound', '_reading')
+    channel = 'kv_change'
 
     def __init__(self, database: Database, name: str, t: str):
         super().__init__(database, name, {'key': 'TEXT PRIMARY KEY', 'value': f'{t} NOT NULL'})
-
-    def get(self, key: str) -> Awaitable[T | None]:
-        return self.database.fetch_val(f'SELECT value FROM {self.name} WHERE key = $1', key)
+        self.value_type = t
+        # None until loaded, or when notifications of changes cannot be received
+        self.cache: dict[str, T] | None = None
+        # the table this was bound from, if it is bound to a transaction
+        self.unbound: KVTable | None = None
+        # reads into the cache are made one at a time, so an older read cannot finish after a newer one
+        self._reading = asyncio.Lock()
+
+    def bind(self, database: Database | Transaction) -> KVTable:
+        table = super().bind(database)
+        # reads go through the transaction so that they see its writes, which only reach the cache once committed
+        table.cache = None
+        table.unbound = self
+        return table
+
+    def _cache_update(self, kv: dict[str, T]) -> None:
+        if self.unbound is not None:
+            self.database.on_commit(functools.partial(self.unbound._cache_update, kv))
+        elif self.cache is not None:
+            self.cache.update(kv)
+
+    async def create(self) -> str:
+        return (await super().create() + '\n' + await self.database.execute(f'''
+            CREATE OR REPLACE FUNCTION notify_kv_change() RETURNS TRIGGER AS $$ BEGIN
+                PERFORM pg_notify('{self.channel}', json_build_object(
+                    'table', TG_TABLE_NAME, 'key', CASE TG_OP WHEN 'DELETE' THEN OLD.key ELSE NEW.key END)::TEXT);
+                RETURN NULL;
+            END $$ LANGUAGE plpgsql;
+
+            DO $$ BEGIN
+                CREATE TRIGGER {self.name}_notify AFTER INSERT OR UPDATE OR DELETE ON {self.name}
+                FOR EACH ROW EXECUTE FUNCTION notify_kv_change();
+            EXCEPTION WHEN duplicate_object THEN null;
+            END $$;
+        '''))
+
+    def emulate(self, database: Any) -> None:
+        async def notify(conn, old: dict[str, Any] | None, new: dict[str, Any] | None) -> None:
+            key = (old if new is None else new)['key']
+            conn.notify(self.channel, json.dumps({'table': self.name, 'key': key}))
+        database.add_trigger(self.name, notify)
+
+    async def load(self) -> None:
+        async with self._reading:
+            self.cache = {rec['key']: rec['value'] for rec in await self.database.fetch(
+                f'SELECT key, value FROM {self.name}')}
+
+    async def refresh(self, key: str) -> None:
+        async with self._reading:
+            value = await self.database.fetch_val(f'SELECT value FROM {self.name} WHERE key = $1', key)
+            if self.cache is None:
+                return
+            if value is None:
+                self.cache.pop(key, None)
+            else:
+                self.cache[key] = value
+
+    async def get(self, key: str) -> T | None:
+        if self.cache is not None:
+            return self.cache.get(key)
+        return await self.database.fetch_val(f'SELECT value FROM {self.name} WHERE key = $1', key)
 
     async def is_set(self, key: str) -> bool:
+        if self.cache is not None:
+            return key in self.cache
         return await self.database.fetch_val(f'SELECT TRUE FROM {self.name} WHERE key = $1', key) is not None
 
     async def all_set(self, *keys: str) -> bool:
-        keys_string = ','.join(f'${i}' for i in range(1, len(keys) + 1))
-        return await self.database.fetch_val(f'SELECT COUNT(*) FROM {self.name} WHERE key IN ({keys_string})',
-                                             *keys) == len(keys)
+        if self.cache is not None:
+            return all(k in self.cache for k in keys)
+        return await self.database.fetch_val(f'SELECT COUNT(*) FROM {self.name} WHERE key = ANY($1)',
+                                             keys) == len(keys)
 
-    def set(self, key: str, value: T) -> Awaitable[str]:
-        return self.database.execute(f'''
+    async def set(self, key: str, value: T) -> str:
+        result = await self.database.execute(f'''
             INSERT INTO {self.name}(key, value) VALUES ($1, $2)
             ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
         ''', key, value)
+        # the notification will arrive shortly, but reads right after this should already see the new value
+        self._cache_update({key: value})
+        return result
 
-    def set_many(self, **kv: T) -> Awaitable[str]:
-        values_str = ','.join(f'({k},{v})' for k, v in kv.items())
-        return self.database.execute(f'''
-            INSERT INTO {self.name}(key, value) VALUES {values_str}
-            ON CONFLICT (value) DO UPDATE SET value = EXCLUDED.value
-        ''')
+    async def set_many(self, **kv: T) -> str:
+        result = await self.database.execute(f'''
+            INSERT INTO {self.name}(key, value) SELECT * FROM unnest($1::TEXT[], $2::{self.value_type}[])
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        ''', list(kv.keys()), list(kv.values()))
+        self._cache_update(kv)
+        return result
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import datetime
+import operator
+from collections.abc import Iterable
+from typing import Any
+
+from . import classes
+
+__all__ = ('LedgerTable',)
+
+
+class LedgerTable(classes.Table):
+    """
+    An append-only record of every change to balances, with periodic snapshots of each balance.
+    A balance at any time is found from the nearest snapshot and the changes between it and that time.
+    Entries are written by the transaction that changes the balance, after changing it, so each is committed or
+    rolled back with it.
+    """
+    __slots__ = ('snapshots',)
+
+    def __init__(self, database: classes.Database, name: str):
+        super().__init__(database, name, {
+            'id': 'BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY', 'discord_id': 'BIGINT NOT NULL',
+            'time': 'TIMESTAMP WITH TIME ZONE NOT NULL', 'kind': 'TEXT NOT NULL', 'change': 'resources NOT NULL',
+            'note': 'TEXT DEFAULT NULL'})
+        self.snapshots = f'{name}_snapshots'
+
+    async def create(self) -> str:
+        result = await super().create() + '\n' + await self.database.execute(f'''
+            CREATE INDEX IF NOT EXISTS {self.name}_member_time ON {self.name}(discord_id, time);
+            CREATE TABLE IF NOT EXISTS {self.snapshots} (
+                discord_id BIGINT NOT NULL, time TIMESTAMP WITH TIME ZONE NOT NULL, balance resources NOT NULL,
+                PRIMARY KEY (discord_id, time));
+        ''')
+        # the first snapshot records the balances from before the ledger existed
+        if await self.database.fetch_val(f'SELECT TRUE FROM {self.snapshots} LIMIT 1') is None:
+            await self.snapshot()
+        return result
+
+    async def record(self, discord_id: int, kind: str, change: Any, note: str | None = None) -> None:
+        """
+        Adds an entry for a change of [change] to the balance of [discord_id], such as a deposit.
+        [change] is a pnwutils.Resources, negative where the balance went down.
+        Call this on the table from the transaction making the change, as in `t.get_table('ledger')`,
+        so that the entry is only kept if the change is.
+        """
+        # timed when written rather than when the transaction started, so a snapshot taken in between is not
+        # mistaken for one that includes the change
+        await self.database.execute(f'''
+            INSERT INTO {self.name}(discord_id, time, kind, change, note) VALUES ($1, clock_timestamp(), $2, $3, $4)
+        ''', discord_id, kind, change.to_record(), note)
+
+    async def snapshot(self) -> None:
+        """Records the current balance of each member whose balance has changed since their last snapshot."""
+        async with self.database.transaction() as t:
+            # waits for transactions that have changed balances to commit, and holds back new ones until this does,
+            # so each change is either in the balances read here or has an entry timed after the snapshot
+            await t.execute(f'LOCK TABLE users, {self.name} IN SHARE MODE')
+            now = await t.fetch_val('SELECT clock_timestamp()')
+            # every member is snapshotted by the first snapshot, so since then only those with newer entries need one
+            last = await t.fetch_val(f'SELECT max(time) FROM {self.snapshots}')
+            if last is None:
+                await t.execute(f'''
+                    INSERT INTO {self.snapshots}(discord_id, time, balance) SELECT discord_id, $1, balance FROM users
+                ''', now)
+                return
+            await t.execute(f'''
+                INSERT INTO {self.snapshots}(discord_id, time, balance)
+                SELECT DISTINCT l.discord_id, $2, u.balance FROM {self.name} l
+                JOIN users u ON u.discord_id = l.discord_id WHERE l.time > $1
+            ''', last, now)
+
+    async def _change(self, discord_id: int, start: datetime.datetime, end: datetime.datetime) -> Iterable[int]:
+        return await self.database.fetch_val(f'SELECT sum(change) FROM {self.name} '
+                                             f'WHERE discord_id = $1 AND time > $2 AND time <= $3',
+                                             discord_id, start, end)
+
+    async def balance_at(self, discord_id: int, time: datetime.datetime) -> Iterable[int] | None:
+        """
+        The balance of [discord_id] at [time], as a `resources` value, or None if they are not registered.
+        Snapshots before [time] are preferred, otherwise the changes since [time] are taken from a later one.
+        Members registered since the last snapshot have none, so their changes are added up from zero.
+        """
+        s = await self.database.fetch_row(f'''
+            SELECT time, balance FROM {self.snapshots} WHERE discord_id = $1 AND time <= $2
+            ORDER BY time DESC LIMIT 1
+        ''', discord_id, time)
+        if s is not None:
+            return tuple(map(operator.add, s['balance'], await self._change(discord_id, s['time'], time)))
+        s = await self.database.fetch_row(f'''
+            SELECT time, balance FROM {self.snapshots} WHERE discord_id = $1 AND time > $2
+            ORDER BY time LIMIT 1
+        ''', discord_id, time)
+        if s is not None:
+            return tuple(map(operator.sub, s['balance'], await self._change(discord_id, time, s['time'])))
+        if await self.database.fetch_val('SELECT TRUE FROM users WHERE discord_id = $1', discord_id) is None:
+            return None
+        return tuple(await self.database.fetch_val(
+            f'SELECT sum(change) FROM {self.name} WHERE discord_id = $1 AND time <= $2', discord_id, time))
+
+    async def flows(self, discord_id: int, start: datetime.datetime, end: datetime.datetime) -> dict[str, Any]:
+        """The total change of each kind to the balance of [discord_id] from [start] to [end]."""
+        return {rec['kind']: rec['total'] for rec in await self.database.fetch(f'''
+            SELECT kind, sum(change) AS total FROM {self.name}
+            WHERE discord_id = $1 AND time >= $2 AND time < $3 GROUP BY kind ORDER BY kind
+        ''', discord_id, start, end)}
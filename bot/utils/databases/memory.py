@@ -0,0 +1,1411 @@
+"""
+An in-memory stand-in for the postgres database, for benchmarks and tests on a machine without postgres.
+It does not check schemas the way postgres would: only the DDL statements listed in _compile are accepted, and those
+creating functions and triggers are skipped in favour of their Python emulation. Transactions can be rolled back but
+are not isolated from each other, and locks do nothing. Tests against it therefore check neither DDL nor transaction
+semantics, which need the postgres variants of the tests.
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import copy
+import datetime
+import functools
+import operator
+import re
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable, Sequence
+from typing import Any, Optional
+
+import asyncpg
+
+from . import classes
+from .postgresql import _template, _top_statements
+from .. import metrics
+
+__all__ = ('MemoryDatabase', 'MemoryConnection', 'Record')
+
+# triggers take the connection and the row before and after each change, None when inserted or deleted
+Trigger = Callable[['MemoryConnection', Optional[dict[str, Any]], Optional[dict[str, Any]]], Awaitable[object]]
+
+
+class Record:
+    """A row returned from a statement, read by column name or position like an asyncpg Record."""
+    __slots__ = ('_keys', '_values')
+
+    def __init__(self, keys: Sequence[str], values: Sequence[Any]):
+        self._keys = tuple(keys)
+        self._values = tuple(values)
+
+    def __getitem__(self, key: str | int) -> Any:
+        if isinstance(key, str):
+            try:
+                return self._values[self._keys.index(key)]
+            except ValueError:
+                raise KeyError(key) from None
+        return self._values[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self._keys else default
+
+    def keys(self) -> Iterable[str]:
+        return iter(self._keys)
+
+    def values(self) -> Iterable[Any]:
+        return iter(self._values)
+
+    def items(self) -> Iterable[tuple[str, Any]]:
+        return zip(self._keys, self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Record) and self._values == other._values
+
+    def __repr__(self) -> str:
+        return f'<Record {" ".join(f"{k}={v!r}" for k, v in self.items())}>'
+
+
+# parsing
+
+_KEYWORDS = frozenset({
+    'ALL', 'AND', 'ANY', 'AS', 'ASC', 'BY', 'CONFLICT', 'DEFAULT', 'DESC', 'DISTINCT', 'DO', 'FROM', 'GROUP',
+    'IN', 'INNER', 'IS', 'JOIN', 'LEFT', 'LIMIT', 'NOT', 'NULL', 'ON', 'OR', 'ORDER', 'RETURNING', 'SELECT', 'SET',
+    'VALUES', 'WHERE'})
+
+_token_re = re.compile(r'''\s*(?:
+    (?P<param>\$\d+)
+    |(?P<string>'(?:[^']|'')*')
+    |(?P<number>\d+(?:\.\d+)?)
+    |(?P<name>[A-Za-z_]\w*)
+    |(?P<op>::|<>|<=|>=|!=|[-+*/(),.=<>\[\]])
+)''', re.VERBOSE)
+
+
+def _tokenize(text: str) -> list[tuple[str, str]]:
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = _token_re.match(text, pos)
+        if match is None:
+            raise asyncpg.PostgresSyntaxError(f'Unexpected "{text[pos:pos + 20].strip()}" in: {text}')
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+
+def _elementwise(op: Callable[[Any, Any], Any]) -> Callable[[Any, Any], Any]:
+    """Applies [op] to two values, field by field for composite values such as `resources`."""
+    def apply(a, b):
+        if a is None or b is None:
+            return None
+        if isinstance(a, tuple) or isinstance(b, tuple):
+            values = tuple(map(op, a, b))
+            composite = a if hasattr(a, '_make') else b
+            return composite._make(values) if hasattr(composite, '_make') else values
+        return op(a, b)
+    return apply
+
+
+def _compare(op: Callable[[Any, Any], bool]) -> Callable[[Any, Any], bool | None]:
+    def apply(a, b):
+        return None if a is None or b is None else op(a, b)
+    return apply
+
+
+_arithmetic = {'+': _elementwise(operator.add), '-': _elementwise(operator.sub),
+               '*': _elementwise(operator.mul), '/': _elementwise(operator.truediv)}
+_comparisons = {'=': _compare(operator.eq), '<>': _compare(operator.ne), '!=': _compare(operator.ne),
+                '<': _compare(operator.lt), '<=': _compare(operator.le),
+                '>': _compare(operator.gt), '>=': _compare(operator.ge)}
+_functions: dict[str, Callable[..., Any]] = {
+    'now': lambda ctx: datetime.datetime.now(tz=datetime.timezone.utc),
+    'clock_timestamp': lambda ctx: datetime.datetime.now(tz=datetime.timezone.utc),
+    'coalesce': lambda ctx, *values: next((v for v in values if v is not None), None),
+    'abs': lambda ctx, value: None if value is None else abs(value),
+    'lower': lambda ctx, value: None if value is None else value.lower(),
+    'upper': lambda ctx, value: None if value is None else value.upper(),
+    'nextval': lambda ctx, sequence: ctx.database.next_value(sequence),
+}
+_aggregates = frozenset({'count', 'sum', 'max', 'min'})
+
+
+class _Context:
+    """The rows an expression is evaluated against, by table name and alias, along with the arguments."""
+    __slots__ = ('database', 'params', 'scope', 'rows', 'tables', 'group')
+
+    def __init__(self, database: MemoryDatabase, params: Sequence[Any], scope: dict[str, dict[str, Any]],
+                 rows: tuple[dict[str, Any], ...], tables: dict[str, _Table], group: list[_Context] | None = None):
+        self.database = database
+        self.params = params
+        self.scope = scope
+        self.rows = rows
+        self.tables = tables
+        self.group = group
+
+
+class _Expr:
+    """
+    A compiled expression, along with what the planner needs to know about it:
+    the column it reads if it is just one, whether it reads any columns at all,
+    and the `column = value` comparisons it requires to hold.
+    """
+    __slots__ = ('fn', 'name', 'column', 'constant', 'aggregate', 'equalities')
+
+    def __init__(self, fn: Callable[[_Context], Any], name: str = '?column?',
+                 column: tuple[str | None, str] | None = None, constant: bool = False, aggregate: bool = False,
+                 equalities: tuple[tuple[tuple[str | None, str], _Expr], ...] = ()):
+        self.fn = fn
+        self.name = name
+        self.column = column
+        self.constant = constant
+        self.aggregate = aggregate
+        self.equalities = equalities
+
+
+def _truthy(value: Any) -> bool:
+    return value is not None and bool(value)
+
+
+def _constant(value: Any, name: str = '?column?') -> _Expr:
+    return _Expr(lambda ctx: value, name, constant=True)
+
+
+def _combine(fn: Callable[[_Context], Any], *parts: _Expr, name: str = '?column?', **kwargs: Any) -> _Expr:
+    return _Expr(fn, name, constant=all(p.constant for p in parts), aggregate=any(p.aggregate for p in parts),
+                 **kwargs)
+
+
+def _column(qualifier: str | None, name: str) -> _Expr:
+    if qualifier is None:
+        def fn(ctx: _Context) -> Any:
+            for row in ctx.rows:
+                if name in row:
+                    return row[name]
+            raise asyncpg.UndefinedColumnError(f'column "{name}" does not exist')
+    else:
+        def fn(ctx: _Context) -> Any:
+            try:
+                row = ctx.scope[qualifier]
+            except KeyError:
+                raise asyncpg.UndefinedTableError(f'missing FROM-clause entry for table "{qualifier}"') from None
+            try:
+                return row[name]
+            except KeyError:
+                raise asyncpg.UndefinedColumnError(f'column {qualifier}.{name} does not exist') from None
+    return _Expr(fn, name, column=(qualifier, name))
+
+
+def _aggregate(name: str, inner: _Expr | None) -> _Expr:
+    def fn(ctx: _Context) -> Any:
+        if inner is None:
+            return len(ctx.group)
+        values = [v for v in (inner.fn(member) for member in ctx.group) if v is not None]
+        if name == 'count':
+            return len(values)
+        if not values:
+            # like the sum(resources) aggregate, which starts from zero
+            return ctx.database.zero(ctx, inner) if name == 'sum' else None
+        if name == 'sum':
+            return functools.reduce(_arithmetic['+'], values)
+        return max(values) if name == 'max' else min(values)
+    return _Expr(fn, name, aggregate=True)
+
+
+class _Parser:
+    """Parses the subset of PostgreSQL used by the tables and cogs, compiling expressions into functions."""
+    __slots__ = ('text', 'tokens', 'pos')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def fail(self, expected: str):
+        found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else 'the end'
+        raise asyncpg.PostgresSyntaxError(f'Expected {expected}, not "{found}", in: {self.text}')
+
+    def peek(self, offset: int = 0) -> tuple[str, str]:
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else ('end', '')
+
+    def at_end(self) -> bool:
+        return self.pos >= len(self.tokens)
+
+    def at(self, *words: str) -> bool:
+        return all(self.peek(i)[0] == 'name' and self.peek(i)[1].upper() == w for i, w in enumerate(words))
+
+    def accept(self, *words: str) -> bool:
+        if self.at(*words):
+            self.pos += len(words)
+            return True
+        return False
+
+    def expect(self, *words: str) -> None:
+        if not self.accept(*words):
+            self.fail(' '.join(words))
+
+    def accept_op(self, op: str) -> bool:
+        if self.peek() == ('op', op):
+            self.pos += 1
+            return True
+        return False
+
+    def expect_op(self, op: str) -> None:
+        if not self.accept_op(op):
+            self.fail(op)
+
+    def identifier(self) -> str:
+        kind, value = self.peek()
+        if kind != 'name':
+            self.fail('a name')
+        self.pos += 1
+        return value.lower()
+
+    def at_alias(self) -> bool:
+        kind, value = self.peek()
+        return kind == 'name' and value.upper() not in _KEYWORDS
+
+    def names(self) -> list[str]:
+        self.expect_op('(')
+        names = [self.identifier()]
+        while self.accept_op(','):
+            names.append(self.identifier())
+        self.expect_op(')')
+        return names
+
+    def exprs(self) -> list[_Expr]:
+        exprs = [self.expr()]
+        while self.accept_op(','):
+            exprs.append(self.expr())
+        return exprs
+
+    # expressions, from the loosest binding operators to the tightest
+
+    def expr(self) -> _Expr:
+        left = self.conjunction()
+        while self.accept('OR'):
+            right = self.conjunction()
+
+            def fn(ctx, a=left.fn, b=right.fn):
+                x = a(ctx)
+                if x is True:
+                    return True
+                y = b(ctx)
+                return True if y is True else (None if x is None or y is None else False)
+            left = _combine(fn, left, right)
+        return left
+
+    def conjunction(self) -> _Expr:
+        left = self.negation()
+        while self.accept('AND'):
+            right = self.negation()
+
+            def fn(ctx, a=left.fn, b=right.fn):
+                x = a(ctx)
+                if x is False:
+                    return False
+                y = b(ctx)
+                return False if y is False else (None if x is None or y is None else True)
+            left = _combine(fn, left, right, equalities=left.equalities + right.equalities)
+        return left
+
+    def negation(self) -> _Expr:
+        if self.accept('NOT'):
+            inner = self.negation()
+            return _combine(lambda ctx: None if (v := inner.fn(ctx)) is None else not v, inner)
+        return self.comparison()
+
+    def comparison(self) -> _Expr:
+        left = self.additive()
+        if self.accept('IS'):
+            negate = self.accept('NOT')
+            self.expect('NULL')
+            return _combine(lambda ctx: (left.fn(ctx) is None) != negate, left)
+        if self.accept('IN'):
+            self.expect_op('(')
+            options = self.exprs()
+            self.expect_op(')')
+            return _combine(lambda ctx: None if (v := left.fn(ctx)) is None else v in [o.fn(ctx) for o in options],
+                            left, *options)
+        kind, op = self.peek()
+        if kind != 'op' or op not in _comparisons:
+            return left
+        self.pos += 1
+        if op in ('=', '<>') and (self.at('ANY') or self.at('ALL')):
+            quantifier = self.identifier()
+            self.expect_op('(')
+            array = self.expr()
+            self.expect_op(')')
+            if (op, quantifier) == ('=', 'any'):
+                return _combine(lambda ctx: None if (v := left.fn(ctx)) is None else v in array.fn(ctx), left, array)
+            if (op, quantifier) == ('<>', 'all'):
+                return _combine(lambda ctx: None if (v := left.fn(ctx)) is None else v not in array.fn(ctx),
+                                left, array)
+            self.fail('= ANY or <> ALL')
+        right = self.additive()
+        compare = _comparisons[op]
+        equalities = ()
+        if op == '=':
+            equalities = tuple((a.column, b) for a, b in ((left, right), (right, left)) if a.column is not None)
+        return _combine(lambda ctx: compare(left.fn(ctx), right.fn(ctx)), left, right, equalities=equalities)
+
+    def additive(self) -> _Expr:
+        left = self.multiplicative()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            apply = _arithmetic[self.tokens[self.pos][1]]
+            self.pos += 1
+            right = self.multiplicative()
+            left = _combine(lambda ctx, a=left.fn, b=right.fn, f=apply: f(a(ctx), b(ctx)), left, right)
+        return left
+
+    def multiplicative(self) -> _Expr:
+        left = self.unary()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            apply = _arithmetic[self.tokens[self.pos][1]]
+            self.pos += 1
+            right = self.unary()
+            left = _combine(lambda ctx, a=left.fn, b=right.fn, f=apply: f(a(ctx), b(ctx)), left, right)
+        return left
+
+    def unary(self) -> _Expr:
+        if self.accept_op('-'):
+            inner = self.unary()
+            return _combine(lambda ctx: None if (v := inner.fn(ctx)) is None else -v, inner)
+        return self.postfix()
+
+    def postfix(self) -> _Expr:
+        node = self.primary()
+        while True:
+            if self.accept_op('::'):
+                # values are kept as given, so casts only need to be skipped
+                self.identifier()
+                if self.accept_op('['):
+                    self.expect_op(']')
+            elif self.peek() == ('op', '.'):
+                self.pos += 1
+                field = self.identifier()
+                inner = node
+                node = _combine(lambda ctx: None if (v := inner.fn(ctx)) is None else getattr(v, field),
+                                inner, name=field)
+            else:
+                return node
+
+    def primary(self) -> _Expr:
+        kind, value = self.peek()
+        self.pos += 1
+        if kind == 'param':
+            index = int(value[1:]) - 1
+
+            def fn(ctx):
+                try:
+                    return ctx.params[index]
+                except IndexError:
+                    raise asyncpg.InterfaceError(f'the statement expects an argument for {value}') from None
+            return _Expr(fn, constant=True)
+        if kind == 'string':
+            return _constant(value[1:-1].replace("''", "'"))
+        if kind == 'number':
+            return _constant(float(value) if '.' in value else int(value))
+        if kind == 'op' and value == '(':
+            node = self.expr()
+            self.expect_op(')')
+            return node
+        if kind != 'name':
+            self.pos -= 1
+            self.fail('an expression')
+        upper = value.upper()
+        if upper in ('TRUE', 'FALSE'):
+            return _constant(upper == 'TRUE', 'bool')
+        if upper == 'NULL':
+            return _constant(None)
+        if upper == 'ROW':
+            self.expect_op('(')
+            fields = self.exprs()
+            self.expect_op(')')
+            return _combine(lambda ctx: tuple(f.fn(ctx) for f in fields), *fields, name='row')
+        if self.peek() == ('op', '('):
+            return self.call(value.lower())
+        if self.peek() == ('op', '.') and self.peek(1)[0] == 'name':
+            self.pos += 1
+            return _column(value.lower(), self.identifier())
+        return _column(None, value.lower())
+
+    def call(self, name: str) -> _Expr:
+        self.expect_op('(')
+        if name == 'count' and self.accept_op('*'):
+            self.expect_op(')')
+            return _aggregate(name, None)
+        args = [] if self.peek() == ('op', ')') else self.exprs()
+        self.expect_op(')')
+        if name in _aggregates:
+            if len(args) != 1:
+                self.fail(f'one argument to {name}')
+            return _aggregate(name, args[0])
+        try:
+            function = _functions[name]
+        except KeyError:
+            raise asyncpg.UndefinedFunctionError(f'function {name} is not supported by the memory database') from None
+        return _combine(lambda ctx: function(ctx, *(a.fn(ctx) for a in args)), *args, name=name)
+
+    # statements
+
+    def items(self) -> list[tuple[_Expr, str]] | None:
+        """The columns of a SELECT or RETURNING, or None for *."""
+        if self.accept_op('*'):
+            return None
+        items = []
+        while True:
+            node = self.expr()
+            items.append((node, self.identifier() if self.accept('AS') else node.name))
+            if not self.accept_op(','):
+                return items
+
+    def source(self) -> _Source:
+        if self.at('UNNEST') and self.peek(1) == ('op', '('):
+            self.pos += 1
+            self.expect_op('(')
+            arrays = self.exprs()
+            self.expect_op(')')
+            return _Source('unnest', self.identifier() if self.accept('AS') or self.at_alias() else 'unnest', arrays)
+        name = self.identifier()
+        return _Source(name, self.identifier() if self.accept('AS') or self.at_alias() else name)
+
+    def select(self) -> _Select:
+        distinct = self.accept('DISTINCT')
+        items = self.items()
+        source = where = limit = None
+        joins = []
+        group = []
+        order = []
+        if self.accept('FROM'):
+            source = self.source()
+            while self.at('JOIN') or self.at('LEFT') or self.at('INNER'):
+                left = self.accept('LEFT')
+                if not left:
+                    self.accept('INNER')
+                self.expect('JOIN')
+                joined = self.source()
+                self.expect('ON')
+                joins.append((joined, self.expr(), left))
+        if self.accept('WHERE'):
+            where = self.expr()
+        if self.accept('GROUP', 'BY'):
+            group = self.exprs()
+        if self.accept('ORDER', 'BY'):
+            while True:
+                key = self.expr()
+                descending = self.accept('DESC')
+                if not descending:
+                    self.accept('ASC')
+                order.append((key, descending))
+                if not self.accept_op(','):
+                    break
+        if self.accept('LIMIT'):
+            limit = self.expr()
+        return _Select(items, source, joins, where, group, order, limit, distinct)
+
+    def assignments(self) -> list[tuple[str, str | None, _Expr]]:
+        assignments = []
+        while True:
+            target = self.identifier()
+            field = self.identifier() if self.accept_op('.') else None
+            self.expect_op('=')
+            assignments.append((target, field, self.expr()))
+            if not self.accept_op(','):
+                return assignments
+
+    def insert(self) -> _Insert:
+        table = self.identifier()
+        cols = self.names() if self.peek() == ('op', '(') else None
+        rows = select = None
+        if self.accept('DEFAULT', 'VALUES'):
+            cols, rows = [], [[]]
+        elif self.accept('VALUES'):
+            rows = []
+            while True:
+                self.expect_op('(')
+                rows.append(self.exprs())
+                self.expect_op(')')
+                if not self.accept_op(','):
+                    break
+        else:
+            self.expect('SELECT')
+            select = self.select()
+        target = action = None
+        if self.accept('ON', 'CONFLICT'):
+            target = self.names() if self.peek() == ('op', '(') else None
+            self.expect('DO')
+            if self.accept('NOTHING'):
+                action = []
+            else:
+                self.expect('UPDATE', 'SET')
+                action = self.assignments()
+        returning = self.items() if self.accept('RETURNING') else ()
+        return _Insert(table, cols, rows, select, target, action, returning)
+
+    def update(self) -> _Update:
+        table = self.identifier()
+        self.expect('SET')
+        assignments = self.assignments()
+        where = self.expr() if self.accept('WHERE') else None
+        returning = self.items() if self.accept('RETURNING') else ()
+        return _Update(table, assignments, where, returning)
+
+    def delete(self) -> _Delete:
+        table = self.identifier()
+        where = self.expr() if self.accept('WHERE') else None
+        returning = self.items() if self.accept('RETURNING') else ()
+        return _Delete(table, where, returning)
+
+    def statement(self) -> _Statement:
+        if self.accept('SELECT'):
+            statement = self.select()
+        elif self.accept('INSERT', 'INTO'):
+            statement = self.insert()
+        elif self.accept('UPDATE'):
+            statement = self.update()
+        elif self.accept('DELETE', 'FROM'):
+            statement = self.delete()
+        else:
+            raise NotImplementedError(f'The memory database does not support: {self.text}')
+        if not self.at_end():
+            self.fail('the end of the statement')
+        return statement
+
+
+def _split(text: str, separator: str) -> list[str]:
+    """Splits [text] on [separator], except inside quotes, parentheses and $$ bodies."""
+    parts = []
+    depth = 0
+    start = i = 0
+    quoted = dollar = False
+    while i < len(text):
+        c = text[i]
+        if dollar:
+            if text.startswith('$$', i):
+                dollar = False
+                i += 1
+        elif quoted:
+            quoted = c != "'"
+        elif c == "'":
+            quoted = True
+        elif text.startswith('$$', i):
+            dollar = True
+            i += 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+# tables
+
+class _Column:
+    __slots__ = ('type', 'composite', 'not_null', 'default', 'generated', 'identity', 'next_value')
+
+    def __init__(self, database: MemoryDatabase, definition: str):
+        self.type = re.match(r'[\w\[\]]+', definition).group().lower()
+        self.composite = database.types.get(self.type)
+        upper = definition.upper()
+        self.not_null = 'NOT NULL' in upper or 'PRIMARY KEY' in upper
+        self.default = self.generated = self.identity = None
+        if match := re.search(r'GENERATED (?:ALWAYS|BY DEFAULT) AS IDENTITY(?: \(([^)]*)\))?', definition, re.I):
+            options = match.group(1) or ''
+            minimum = re.search(r'MINVALUE (\d+)', options, re.I)
+            maximum = re.search(r'MAXVALUE (\d+)', options, re.I)
+            self.identity = (int(minimum.group(1)) if minimum else 1,
+                             int(maximum.group(1)) if maximum else None, 'CYCLE' in options.upper())
+            self.next_value = self.identity[0]
+        elif match := re.search(r'GENERATED ALWAYS AS \((.*)\) STORED', definition, re.I):
+            self.generated = _Parser(match.group(1)).expr()
+        if self.identity is None and (
+                match := re.search(r"DEFAULT (ROW\([^)]*\)|'(?:[^']|'')*'|[^\s,]+)", definition, re.I)):
+            self.default = _Parser(match.group(1)).expr()
+
+    def coerce(self, value: Any) -> Any:
+        if value is not None and self.composite is not None and not isinstance(value, self.composite):
+            return self.composite._make(value)
+        return value
+
+    def next_identity(self) -> int:
+        minimum, maximum, cycle = self.identity
+        value = self.next_value
+        if maximum is not None and value > maximum:
+            if not cycle:
+                raise asyncpg.SequenceGeneratorLimitExceededError('identity column reached its maximum value')
+            value = minimum
+        self.next_value = value + 1
+        return value
+
+
+class _Table:
+    """The rows of a table by an internal row id, with an index for each unique set of columns."""
+    __slots__ = ('name', 'columns', 'unique', 'foreign', 'rows', 'next_id')
+
+    def __init__(self, database: MemoryDatabase, name: str, body: str):
+        self.name = name
+        self.columns: dict[str, _Column] = {}
+        self.unique: dict[tuple[str, ...], dict[tuple, int]] = {}
+        # columns, the table they reference and the columns in it
+        self.foreign: list[tuple[tuple[str, ...], str, tuple[str, ...]]] = []
+        for definition in _split(body, ','):
+            upper = definition.upper()
+            if match := re.match(r'(?:PRIMARY KEY|UNIQUE)\s*\(([^)]*)\)', definition, re.I):
+                self.unique[tuple(c.strip().lower() for c in match.group(1).split(','))] = {}
+            elif match := re.match(r'FOREIGN KEY\s*\(([^)]*)\) REFERENCES (\w+)\s*\(([^)]*)\)', definition, re.I):
+                self.foreign.append((tuple(c.strip().lower() for c in match.group(1).split(',')),
+                                     match.group(2).lower(),
+                                     tuple(c.strip().lower() for c in match.group(3).split(','))))
+            elif upper.startswith(('CONSTRAINT', 'CHECK')):
+                continue
+            else:
+                col_name, _, rest = definition.partition(' ')
+                col_name = col_name.lower()
+                self.columns[col_name] = _Column(database, rest)
+                if 'PRIMARY KEY' in upper or re.search(r'\bUNIQUE\b', upper):
+                    self.unique[(col_name,)] = {}
+                if match := re.search(r'REFERENCES (\w+)\s*\((\w+)\)', definition, re.I):
+                    self.foreign.append(((col_name,), match.group(1).lower(), (match.group(2).lower(),)))
+        self.rows: dict[int, dict[str, Any]] = {}
+        self.next_id = 0
+
+    def new_row(self, ctx: _Context, values: dict[str, Any]) -> dict[str, Any]:
+        for name in values:
+            if name not in self.columns:
+                raise asyncpg.UndefinedColumnError(f'column "{name}" of relation "{self.name}" does not exist')
+        row = {}
+        for name, column in self.columns.items():
+            if name in values:
+                value = values[name]
+            elif column.identity is not None:
+                value = column.next_identity()
+            elif column.default is not None:
+                value = column.default.fn(ctx)
+            else:
+                value = None
+            row[name] = column.coerce(value)
+        for name, column in self.columns.items():
+            if column.generated is not None:
+                row[name] = column.generated.fn(_Context(ctx.database, ctx.params, {self.name: row}, (row,), {}))
+        return row
+
+    def find(self, cols: Iterable[str], values: Iterable[Any]) -> int | None:
+        """The id of the row with [values] in the unique [cols]."""
+        return self.unique[tuple(cols)].get(tuple(values))
+
+    def conflict(self, row: dict[str, Any], target: list[str] | None) -> int | None:
+        for cols, index in self.unique.items():
+            if target is None or set(cols) == set(target):
+                key = tuple(row[c] for c in cols)
+                if None not in key and (rid := index.get(key)) is not None:
+                    return rid
+        return None
+
+    def candidates(self, condition: _Expr | None, names: set[str], ctx: _Context) -> Iterable[tuple[int, dict]]:
+        """
+        The rows that could meet [condition], found through an index when it fixes a unique set of columns.
+        [names] are what the table is called in the statement, and [ctx] what the rest of the condition can read.
+        """
+        if condition is not None and condition.equalities:
+            fixed = {}
+            for (qualifier, name), value in condition.equalities:
+                if qualifier in names or (qualifier is None and name in self.columns):
+                    if value.constant or (value.column is not None and value.column[0] not in names
+                                          and value.column[0] in ctx.scope):
+                        fixed.setdefault(name, value)
+            for cols, index in self.unique.items():
+                if all(c in fixed for c in cols):
+                    rid = index.get(tuple(fixed[c].fn(ctx) for c in cols))
+                    return () if rid is None else ((rid, self.rows[rid]),)
+        return list(self.rows.items())
+
+    def null_row(self) -> dict[str, Any]:
+        return dict.fromkeys(self.columns)
+
+
+class _Source:
+    __slots__ = ('name', 'alias', 'arrays')
+
+    def __init__(self, name: str, alias: str, arrays: list[_Expr] | None = None):
+        self.name = name
+        self.alias = alias
+        self.arrays = arrays
+
+
+class _Statement:
+    def run(self, database: MemoryDatabase, params: Sequence[Any], undo: list,
+            changes: list) -> tuple[str, list[Record]]:
+        raise NotImplementedError
+
+
+def _project(items: list[tuple[_Expr, str]] | None, contexts: Iterable[_Context]) -> list[Record]:
+    records = []
+    for ctx in contexts:
+        if items is None:
+            records.append(Record([k for row in ctx.rows for k in row], [v for row in ctx.rows for v in row.values()]))
+        else:
+            records.append(Record([name for _, name in items], [node.fn(ctx) for node, _ in items]))
+    return records
+
+
+def _returning(items: list[tuple[_Expr, str]] | None | tuple[()], database: MemoryDatabase, params: Sequence[Any],
+               name: str, tables: dict[str, _Table], rows: list[dict[str, Any]]) -> list[Record]:
+    """The records of a RETURNING clause for the rows written, where [items] is empty if there was none."""
+    if items == ():
+        return []
+    return _project(items, (_Context(database, params, {name: row}, (row,), tables) for row in rows))
+
+
+class _Select(_Statement):
+    __slots__ = ('items', 'source', 'joins', 'where', 'group', 'order', 'limit', 'distinct')
+
+    def __init__(self, items, source, joins, where, group, order, limit, distinct):
+        self.items: list[tuple[_Expr, str]] | None = items
+        self.source: _Source | None = source
+        self.joins: list[tuple[_Source, _Expr, bool]] = joins
+        self.where: _Expr | None = where
+        self.group: list[_Expr] = group
+        self.order: list[tuple[_Expr, bool]] = order
+        self.limit: _Expr | None = limit
+        self.distinct = distinct
+
+    def contexts(self, database: MemoryDatabase, params: Sequence[Any]) -> tuple[list[_Context], _Context]:
+        """A context for each row that meets the conditions, and one for the statement as a whole."""
+        tables = {}
+        base = _Context(database, params, {}, (), tables)
+        if self.source is None:
+            return [base], base
+        if self.source.name == 'unnest':
+            arrays = [a.fn(base) for a in self.source.arrays]
+            found = [_Context(database, params, {self.source.alias: row}, (row,), tables)
+                     for row in ({f'unnest{i}': v for i, v in enumerate(values)} for values in zip(*arrays))]
+        else:
+            table = database.table(self.source.name)
+            names = {self.source.name, self.source.alias}
+            tables.update(dict.fromkeys(names, table))
+            found = [_Context(database, params, dict.fromkeys(names, row), (row,), tables)
+                     for _, row in table.candidates(self.where, names, base)]
+        for source, on, left in self.joins:
+            table = database.table(source.name)
+            names = {source.name, source.alias}
+            tables.update(dict.fromkeys(names, table))
+            joined = []
+            for ctx in found:
+                matched = False
+                for _, row in table.candidates(on, names, ctx):
+                    candidate = _Context(database, params, ctx.scope | dict.fromkeys(names, row), (*ctx.rows, row),
+                                         tables)
+                    if _truthy(on.fn(candidate)):
+                        joined.append(candidate)
+                        matched = True
+                if left and not matched:
+                    row = table.null_row()
+                    joined.append(_Context(database, params, ctx.scope | dict.fromkeys(names, row),
+                                           (*ctx.rows, row), tables))
+            found = joined
+        if self.where is not None:
+            found = [ctx for ctx in found if _truthy(self.where.fn(ctx))]
+        return found, base
+
+    def records(self, database: MemoryDatabase, params: Sequence[Any]) -> list[Record]:
+        found, base = self.contexts(database, params)
+        if self.group or (self.items is not None and any(node.aggregate for node, _ in self.items)):
+            groups: dict[tuple, list[_Context]] = {}
+            for ctx in found:
+                groups.setdefault(tuple(g.fn(ctx) for g in self.group), []).append(ctx)
+            if not groups and not self.group:
+                groups[()] = []
+            found = [_Context(database, params, members[0].scope if members else {},
+                              members[0].rows if members else (), base.tables, members)
+                     for members in groups.values()]
+        records = _project(self.items, found)
+        if self.order:
+            pairs = list(zip(found, records))
+            # sort by the last key first, so that earlier keys take precedence
+            for key, descending in reversed(self.order):
+                if key.constant and isinstance(position := key.fn(base), int):
+                    def value(pair, i=position - 1):
+                        return pair[1][i]
+                else:
+                    def value(pair, fn=key.fn):
+                        return fn(pair[0])
+                # nulls sort as if larger than any other value, like in postgres
+                pairs.sort(key=lambda pair: (True, 0) if (v := value(pair)) is None else (False, v),
+                           reverse=descending)
+            records = [record for _, record in pairs]
+        if self.distinct:
+            records = list({tuple(r): r for r in records}.values())
+        if self.limit is not None:
+            records = records[:self.limit.fn(base)]
+        return records
+
+    def run(self, database, params, undo, changes):
+        records = self.records(database, params)
+        return f'SELECT {len(records)}', records
+
+
+class _Insert(_Statement):
+    __slots__ = ('table', 'cols', 'rows', 'select', 'target', 'action', 'returning')
+
+    def __init__(self, table, cols, rows, select, target, action, returning):
+        self.table: str = table
+        self.cols: list[str] | None = cols
+        self.rows: list[list[_Expr]] | None = rows
+        self.select: _Select | None = select
+        self.target: list[str] | None = target
+        # None to raise on conflicts, empty to do nothing, or the updates to make
+        self.action: list[tuple[str, str | None, _Expr]] | None = action
+        self.returning = returning
+
+    def run(self, database, params, undo, changes):
+        table = database.table(self.table)
+        cols = list(table.columns) if self.cols is None else self.cols
+        base = _Context(database, params, {}, (), {self.table: table})
+        if self.select is not None:
+            values = [tuple(record) for record in self.select.records(database, params)]
+        else:
+            values = [[node.fn(base) for node in row] for row in self.rows]
+        written = []
+        for row_values in values:
+            if len(row_values) != len(cols):
+                raise asyncpg.PostgresSyntaxError(f'INSERT into {self.table} has {len(row_values)} values '
+                                                  f'for {len(cols)} columns')
+            row = table.new_row(base, dict(zip(cols, row_values)))
+            rid = table.conflict(row, self.target) if self.action is not None else None
+            if rid is None:
+                rid = table.next_id
+                table.next_id += 1
+                database.write(table, rid, row, undo, changes)
+            elif not self.action:
+                continue
+            else:
+                old = table.rows[rid]
+                ctx = _Context(database, params, {self.table: old, 'excluded': row}, (old,), base.tables)
+                row = _assign(table, old, self.action, ctx)
+                database.write(table, rid, row, undo, changes)
+            written.append(row)
+        records = _returning(self.returning, database, params, self.table, base.tables, written)
+        return f'INSERT 0 {len(written)}', records
+
+
+def _assign(table: _Table, old: dict[str, Any], assignments: list[tuple[str, str | None, _Expr]],
+            ctx: _Context) -> dict[str, Any]:
+    # every value is worked out from the row as it was, before any are assigned
+    values = [node.fn(ctx) for _, _, node in assignments]
+    new = dict(old)
+    for (target, field, _), value in zip(assignments, values):
+        try:
+            column = table.columns[target]
+        except KeyError:
+            raise asyncpg.UndefinedColumnError(
+                f'column "{target}" of relation "{table.name}" does not exist') from None
+        if field is None:
+            new[target] = column.coerce(value)
+        else:
+            new[target] = new[target]._replace(**{field: value})
+    return new
+
+
+class _Update(_Statement):
+    __slots__ = ('table', 'assignments', 'where', 'returning')
+
+    def __init__(self, table, assignments, where, returning):
+        self.table: str = table
+        self.assignments: list[tuple[str, str | None, _Expr]] = assignments
+        self.where: _Expr | None = where
+        self.returning = returning
+
+    def run(self, database, params, undo, changes):
+        table = database.table(self.table)
+        tables = {self.table: table}
+        base = _Context(database, params, {}, (), tables)
+        written = []
+        for rid, row in table.candidates(self.where, {self.table}, base):
+            ctx = _Context(database, params, {self.table: row}, (row,), tables)
+            if self.where is None or _truthy(self.where.fn(ctx)):
+                new = _assign(table, row, self.assignments, ctx)
+                database.write(table, rid, new, undo, changes)
+                written.append(new)
+        records = _returning(self.returning, database, params, self.table, tables, written)
+        return f'UPDATE {len(written)}', records
+
+
+class _Delete(_Statement):
+    __slots__ = ('table', 'where', 'returning')
+
+    def __init__(self, table, where, returning):
+        self.table: str = table
+        self.where: _Expr | None = where
+        self.returning = returning
+
+    def run(self, database, params, undo, changes):
+        table = database.table(self.table)
+        tables = {self.table: table}
+        base = _Context(database, params, {}, (), tables)
+        deleted = []
+        for rid, row in table.candidates(self.where, {self.table}, base):
+            ctx = _Context(database, params, {self.table: row}, (row,), tables)
+            if self.where is None or _truthy(self.where.fn(ctx)):
+                database.write(table, rid, None, undo, changes)
+                deleted.append(row)
+        records = _returning(self.returning, database, params, self.table, tables, deleted)
+        return f'DELETE {len(deleted)}', records
+
+
+class _CreateTable(_Statement):
+    __slots__ = ('name', 'body')
+
+    def __init__(self, name: str, body: str):
+        self.name = name
+        self.body = body
+
+    def run(self, database, params, undo, changes):
+        if self.name not in database.data:
+            database.data[self.name] = _Table(database, self.name, self.body)
+        return 'CREATE TABLE', []
+
+
+class _CreateStaging(_Statement):
+    """CREATE TEMPORARY TABLE ... AS SELECT ... WITH NO DATA, making a table with some columns of another."""
+    __slots__ = ('name', 'cols', 'source')
+
+    def __init__(self, name: str, cols: list[str], source: str):
+        self.name = name
+        self.cols = cols
+        self.source = source
+
+    def run(self, database, params, undo, changes):
+        source = database.table(self.source)
+        staging = _Table(database, self.name, '')
+        for name in self.cols:
+            # only the types are copied, not the constraints or defaults
+            column = staging.columns[name] = copy.copy(source.columns[name])
+            column.not_null = False
+            column.default = column.generated = column.identity = None
+        database.data[self.name] = staging
+        return 'SELECT 0', []
+
+
+class _DropTable(_Statement):
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def run(self, database, params, undo, changes):
+        database.data.pop(self.name, None)
+        return 'DROP TABLE', []
+
+
+class _AddColumn(_Statement):
+    __slots__ = ('table', 'name', 'definition')
+
+    def __init__(self, table: str, name: str, definition: str):
+        self.table = table
+        self.name = name
+        self.definition = definition
+
+    def run(self, database, params, undo, changes):
+        table = database.table(self.table)
+        if self.name not in table.columns:
+            table.columns[self.name] = _Column(database, self.definition)
+            for row in table.rows.values():
+                row[self.name] = None
+        return 'ALTER TABLE', []
+
+
+class _Ignored(_Statement):
+    """
+    Statements the memory database has no use for, such as creating indexes, sequences, which are started on first
+    use, and trigger functions, which are emulated in Python. The tables they name are still checked to exist.
+    """
+    __slots__ = ('status', 'tables', 'columns')
+
+    def __init__(self, status: str, tables: Iterable[str] = (), columns: Iterable[str] = ()):
+        self.status = status
+        self.tables = tuple(t.strip().lower() for t in tables)
+        # columns of the first table
+        self.columns = tuple(c.strip().lower() for c in columns)
+
+    def run(self, database, params, undo, changes):
+        for name in self.tables:
+            database.table(name)
+        for name in self.columns:
+            if name not in database.table(self.tables[0]).columns:
+                raise asyncpg.UndefinedColumnError(f'column "{name}" does not exist')
+        return self.status, []
+
+
+@functools.lru_cache(maxsize=1024)
+def _collapse(query: str) -> str:
+    return ' '.join(query.split())
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(query: str) -> tuple[_Statement, ...]:
+    statements = []
+    for text in _split(query, ';'):
+        text = _collapse(text)
+        if match := re.fullmatch(r'CREATE TABLE (?:IF NOT EXISTS )?(\w+) ?\((.*)\)', text, re.I | re.S):
+            statements.append(_CreateTable(match.group(1).lower(), match.group(2)))
+        elif match := re.fullmatch(r'CREATE TEMPORARY TABLE (\w+) ON COMMIT DROP AS SELECT (.+) FROM (\w+) '
+                                   r'WITH NO DATA', text, re.I):
+            statements.append(_CreateStaging(match.group(1).lower(),
+                                             [c.strip().lower() for c in match.group(2).split(',')],
+                                             match.group(3).lower()))
+        elif match := re.fullmatch(r'DROP TABLE (?:IF EXISTS )?(\w+)', text, re.I):
+            statements.append(_DropTable(match.group(1).lower()))
+        elif match := re.fullmatch(r'ALTER TABLE (\w+) ADD COLUMN IF NOT EXISTS (\w+) (.+)', text, re.I):
+            statements.append(_AddColumn(match.group(1).lower(), match.group(2).lower(), match.group(3)))
+        # the only other DDL accepted, so that mistakes in any other raise rather than pass unnoticed
+        elif match := re.fullmatch(r'CREATE INDEX (?:IF NOT EXISTS )?\w+ ON (\w+) ?\(([\w, ]+)\)', text, re.I):
+            statements.append(_Ignored('CREATE INDEX', [match.group(1)], match.group(2).split(',')))
+        elif match := re.fullmatch(r'CREATE SEQUENCE (?:IF NOT EXISTS )?\w+(?: OWNED BY (\w+)\.(\w+))?', text, re.I):
+            owner, column = match.groups()
+            statements.append(_Ignored('CREATE SEQUENCE', [owner] if owner else [], [column] if column else []))
+        elif re.fullmatch(r'CREATE OR REPLACE FUNCTION \w+\(\) RETURNS TRIGGER AS \$\$.*\$\$ LANGUAGE plpgsql', text,
+                          re.I):
+            statements.append(_Ignored('CREATE FUNCTION'))
+        elif match := re.fullmatch(r'DO \$\$ BEGIN CREATE TRIGGER \w+ AFTER [\w ]+ ON (\w+) FOR EACH ROW '
+                                   r'EXECUTE FUNCTION \w+\(\); EXCEPTION WHEN duplicate_object THEN null; END \$\$',
+                                   text, re.I):
+            statements.append(_Ignored('DO', [match.group(1)]))
+        elif match := re.fullmatch(r'LOCK TABLE ([\w, ]+) IN [A-Z ]+ MODE', text, re.I):
+            # transactions are not isolated from each other here, so there is nothing for a lock to do
+            statements.append(_Ignored('LOCK TABLE', match.group(1).split(',')))
+        else:
+            statements.append(_Parser(text).statement())
+    return tuple(statements)
+
+
+# connections
+
+class _Transaction:
+    __slots__ = ('conn', '_mark')
+
+    def __init__(self, conn: MemoryConnection):
+        self.conn = conn
+        self._mark: tuple[int, int] | None = None
+
+    async def __aenter__(self):
+        if self.conn.undo is None:
+            self.conn.undo = []
+            self.conn.pending = []
+        else:
+            # nested, like a savepoint
+            self._mark = len(self.conn.undo), len(self.conn.pending)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        undo_start, pending_start = self._mark or (0, 0)
+        if exc_type is not None:
+            self.conn.database.revert(self.conn.undo[undo_start:])
+            del self.conn.undo[undo_start:]
+            del self.conn.pending[pending_start:]
+        if self._mark is None:
+            pending = self.conn.pending
+            self.conn.undo = self.conn.pending = None
+            for channel, payload in pending:
+                self.conn.database.deliver(channel, payload)
+
+
+class _Cursor:
+    """Rows of a query fetched in chunks, or iterated over with `async for`, like an asyncpg cursor."""
+    __slots__ = ('conn', 'query', 'args', '_records', '_pos')
+
+    def __init__(self, conn: MemoryConnection, query: str, args: Sequence[Any]):
+        self.conn = conn
+        self.query = query
+        self.args = args
+        self._records: list[Record] = []
+        self._pos = 0
+
+    async def _start(self) -> _Cursor:
+        self._records = (await self.conn.run(self.query, self.args))[1]
+        return self
+
+    def __await__(self):
+        return self._start().__await__()
+
+    async def fetch(self, n: int) -> list[Record]:
+        chunk = self._records[self._pos:self._pos + n]
+        self._pos += n
+        return chunk
+
+    async def __aiter__(self) -> AsyncIterator[Record]:
+        for record in (await self.conn.run(self.query, self.args))[1]:
+            yield record
+
+
+class MemoryConnection:
+    """
+    A connection to a MemoryDatabase, with the methods of an asyncpg connection that the tables use.
+    Changes made inside a transaction on it are recorded, so that they can be undone if it is rolled back.
+    """
+    __slots__ = ('database', 'undo', 'pending')
+
+    def __init__(self, database: MemoryDatabase):
+        self.database = database
+        self.undo: list[tuple[_Table, int, dict[str, Any] | None]] | None = None
+        self.pending: list[tuple[str, str]] | None = None
+
+    async def run(self, query: str, args: Sequence[Any]) -> tuple[str, list[Record]]:
+        status, records = '', []
+        for statement in _compile(query):
+            undo = []
+            changes = []
+            try:
+                status, records = statement.run(self.database, args, undo, changes)
+                for table, old, new in changes:
+                    for trigger in self.database.triggers.get(table.name, ()):
+                        await trigger(self, old, new)
+            except BaseException:
+                self.database.revert(undo)
+                raise
+            if self.undo is not None:
+                self.undo.extend(undo)
+        return status, records
+
+    def notify(self, channel: str, payload: str) -> None:
+        """Sends a notification to listeners, once the current transaction commits if there is one."""
+        if self.pending is None:
+            self.database.deliver(channel, payload)
+        else:
+            self.pending.append((channel, payload))
+
+    async def execute(self, query: str, *args, timeout: float | None = None) -> str:
+        return (await self.run(query, args))[0]
+
+    async def executemany(self, query: str, args: Iterable[Sequence[Any]], *, timeout: float | None = None) -> None:
+        for arg in args:
+            await self.run(query, arg)
+
+    async def fetch(self, query: str, *args, timeout: float | None = None) -> list[Record]:
+        return (await self.run(query, args))[1]
+
+    async def fetchrow(self, query: str, *args, timeout: float | None = None) -> Record | None:
+        records = (await self.run(query, args))[1]
+        return records[0] if records else None
+
+    async def fetchval(self, query: str, *args, timeout: float | None = None) -> Any:
+        records = (await self.run(query, args))[1]
+        return records[0][0] if records else None
+
+    async def copy_records_to_table(self, table_name: str, *, records: Iterable[Sequence[Any]],
+                                    columns: Sequence[str], timeout: float | None = None) -> str:
+        table = self.database.table(table_name)
+        base = _Context(self.database, (), {}, (), {table_name: table})
+        undo = [] if self.undo is None else self.undo
+        count = 0
+        for record in records:
+            row = table.new_row(base, dict(zip(columns, record)))
+            self.database.write(table, table.next_id, row, undo, [])
+            table.next_id += 1
+            count += 1
+        return f'COPY {count}'
+
+    def transaction(self) -> _Transaction:
+        return _Transaction(self)
+
+    def cursor(self, query: str, *args) -> _Cursor:
+        return _Cursor(self, query, args)
+
+
+class _Acquire:
+    __slots__ = ('database',)
+
+    def __init__(self, database: MemoryDatabase):
+        self.database = database
+
+    async def __aenter__(self) -> MemoryConnection:
+        return MemoryConnection(self.database)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class MemoryDatabase(classes.Database[Record]):
+    """
+    A database held in memory, for benchmarks and load tests on a machine without postgres.
+    It runs the subset of SQL that the tables build, along with simple joins and aggregates, and skips the statements
+    creating trigger functions and triggers that they use. What those would do is emulated in Python instead:
+    composite types are declared with new_type and triggers with add_trigger. Tables set up their own through
+    Table.emulate. Anything else outside the subset raises, so tables only use SQL that runs on both databases.
+    Transactions can be rolled back, but are not isolated from each other. Foreign keys are checked.
+    """
+    __slots__ = ('data', 'types', 'triggers', 'sequences', '_listeners', '_conn')
+
+    def __init__(self, init_pre: classes.InitFunc, init_post: classes.InitFunc):
+        super().__init__(init_pre, init_post)
+        self.data: dict[str, _Table] = {}
+        self.types: dict[str, type[tuple]] = {}
+        self.triggers: collections.defaultdict[str, list[Trigger]] = collections.defaultdict(list)
+        self.sequences: dict[str, int] = {}
+        self._listeners: collections.defaultdict[str, list[classes.ListenerFunc]] = collections.defaultdict(list)
+        self._conn = MemoryConnection(self)
+
+    def new_type(self, name: str, fields: Sequence[str]) -> None:
+        """Declares a composite type, like CREATE TYPE [name] AS (...), so its fields can be read and added."""
+        self.types[name] = collections.namedtuple(name, fields)
+
+    def add_trigger(self, table: str, trigger: Trigger) -> None:
+        """Calls [trigger] after each row of [table] is inserted, updated or deleted."""
+        self.triggers[table].append(trigger)
+
+    def table(self, name: str) -> _Table:
+        try:
+            return self.data[name]
+        except KeyError:
+            raise asyncpg.UndefinedTableError(f'relation "{name}" does not exist') from None
+
+    def next_value(self, sequence: str) -> int:
+        value = self.sequences.get(sequence, 0) + 1
+        self.sequences[sequence] = value
+        return value
+
+    def zero(self, ctx: _Context, node: _Expr) -> Any:
+        """The sum of no values of the column read by [node], which is zero for composite types and otherwise null."""
+        if node.column is not None:
+            qualifier, name = node.column
+            for alias, table in ctx.tables.items():
+                if (qualifier is None or qualifier == alias) and name in table.columns:
+                    composite = table.columns[name].composite
+                    return None if composite is None else composite._make([0] * len(composite._fields))
+        return None
+
+    def write(self, table: _Table, rid: int, row: dict[str, Any] | None, undo: list, changes: list) -> None:
+        """Sets the row [rid] of [table] to [row], deleting it if None, after checking the constraints."""
+        old = table.rows.get(rid)
+        if row is not None:
+            for name, column in table.columns.items():
+                if column.not_null and row[name] is None:
+                    raise asyncpg.NotNullViolationError(
+                        f'null value in column "{name}" of relation "{table.name}" violates not-null constraint')
+            for cols, index in table.unique.items():
+                key = tuple(row[c] for c in cols)
+                if None not in key and index.get(key, rid) != rid:
+                    raise asyncpg.UniqueViolationError(
+                        f'duplicate key value violates unique constraint on {table.name}({", ".join(cols)})')
+            for cols, referenced, referenced_cols in table.foreign:
+                key = tuple(row[c] for c in cols)
+                if None not in key and self.table(referenced).find(referenced_cols, key) is None:
+                    raise asyncpg.ForeignKeyViolationError(
+                        f'insert or update on table "{table.name}" violates foreign key constraint: '
+                        f'key ({", ".join(cols)})={key} is not present in table "{referenced}"')
+        if old is not None:
+            self._check_references(table, old, row)
+        self._set(table, rid, row)
+        undo.append((table, rid, old))
+        changes.append((table, old, row))
+
+    def _check_references(self, table: _Table, old: dict[str, Any], row: dict[str, Any] | None) -> None:
+        for other in self.data.values():
+            for cols, referenced, referenced_cols in other.foreign:
+                if referenced != table.name:
+                    continue
+                key = tuple(old[c] for c in referenced_cols)
+                if row is not None and tuple(row[c] for c in referenced_cols) == key:
+                    continue
+                if any(tuple(r[c] for c in cols) == key for r in other.rows.values()):
+                    raise asyncpg.ForeignKeyViolationError(
+                        f'update or delete on table "{table.name}" violates foreign key constraint: '
+                        f'key ({", ".join(referenced_cols)})={key} is still referenced from table "{other.name}"')
+
+    @staticmethod
+    def _set(table: _Table, rid: int, row: dict[str, Any] | None) -> None:
+        old = table.rows.get(rid)
+        for cols, index in table.unique.items():
+            if old is not None:
+                key = tuple(old[c] for c in cols)
+                if index.get(key) == rid:
+                    del index[key]
+            if row is not None:
+                key = tuple(row[c] for c in cols)
+                if None not in key:
+                    index[key] = rid
+        if row is None:
+            table.rows.pop(rid, None)
+        else:
+            table.rows[rid] = row
+
+    def revert(self, undo: list[tuple[_Table, int, dict[str, Any] | None]]) -> None:
+        for table, rid, old in reversed(undo):
+            self._set(table, rid, old)
+
+    def deliver(self, channel: str, payload: str) -> None:
+        loop = asyncio.get_running_loop()
+        for callback in self._listeners.get(channel, ()):
+            loop.call_soon(callback, payload)
+
+    async def initialise(self) -> None:
+        for table in self.tables.values():
+            table.emulate(self)
+        await super().initialise()
+
+    async def __aenter__(self):
+        await self.initialise()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def _run(self, method: str | Callable[..., Awaitable], query: str, args: Sequence[Any],
+                   rows: bool = False) -> Any:
+        template = _template(query)
+        start = time.perf_counter()
+        try:
+            call = getattr(self._conn, method) if isinstance(method, str) else functools.partial(method, self._conn)
+            result = await call(query, *args)
+        except Exception as e:
+            metrics.registry.counter('db.errors', statement=template, error=type(e).__name__).inc()
+            raise
+        metrics.registry.histogram('db.latency', statement=template).observe(time.perf_counter() - start)
+        if rows:
+            metrics.registry.histogram('db.rows', statement=template).observe(len(result))
+        return result
+
+    def report(self) -> str:
+        lines = [f'In memory: {", ".join(f"{name} {len(t.rows)} rows" for name, t in self.data.items())}',
+                 '\nMost total time:', *_top_statements()]
+        return '\n'.join(lines)
+
+    def execute(self, query, *args, timeout: float | None = None) -> Awaitable[str]:
+        return self._run('execute', query, args)
+
+    def execute_many(self, query, args, *, timeout: float | None = None) -> Awaitable[None]:
+        return self._run('executemany', query, (args,))
+
+    def fetch(self, query, *args, timeout: float | None = None) -> Awaitable[list[Record]]:
+        return self._run('fetch', query, args, rows=True)
+
+    def fetch_row(self, query, *args, timeout: float | None = None) -> Awaitable[Record | None]:
+        return self._run('fetchrow', query, args)
+
+    def fetch_val(self, query, *args, timeout: float | None = None) -> Awaitable[Any]:
+        return self._run('fetchval', query, args)
+
+    def copy_insert(self, query, table: str, cols: Sequence[str], records: Iterable[Sequence],
+                    *, timeout: float | None = None) -> Awaitable[str]:
+        return self._run(classes.copy_insert, query, (table, cols, records))
+
+    def acquire(self) -> _Acquire:
+        return _Acquire(self)
+
+    async def listen(self, channel: str, callback: classes.ListenerFunc,
+                     on_lost: Callable[[], object] | None = None) -> None:
+        # nothing is lost in between, so [on_lost] is never called
+        if callback not in self._listeners[channel]:
+            self._listeners[channel].append(callback)
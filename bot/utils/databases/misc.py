@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import pickle
-from collections.abc import AsyncIterable, Awaitable
+from collections.abc import AsyncIterable, Awaitable, Mapping
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -11,28 +11,118 @@ from . import classes
 
 
 class ViewTable(classes.Table):
-    def __init__(self, database: classes.Database, name: str):
-        super().__init__(database, name, {'id': 'INT PRIMARY KEY', 'data': 'BYTEA NOT NULL'})
+    """
+    Stores persistent views by id, along with their kind, the module and qualified name of their class.
+    Views are stored as a header of the magic bytes and a format version, followed by the pickled state tuple.
+    Rows written before this format, which pickled the whole view, are converted when the table is created.
+    Those that cannot be unpickled are left with no kind, and are reported and pruned like unknown kinds.
+    Views of kinds that are not known are never deleted automatically, only reported, as their cog may have failed
+    to load. prune() deletes them when asked to.
+    """
+    magic = b'PV'
+    version = 1
+
+    def __init__(self, database: classes.Database, name: str, kinds: Mapping[str, type[discordutils.PersistentView]]):
+        super().__init__(database, name, {'id': 'INT PRIMARY KEY', 'data': 'BYTEA NOT NULL', 'kind': 'TEXT'})
+        # kinds to the view classes, filled in as they are defined
+        self.kinds = kinds
 
     async def create(self) -> str:
-        return (await super().create() + '\n' +
-                await self.database.execute(f'CREATE SEQUENCE IF NOT EXISTS view_id_seq OWNED BY {self.name}.id'))
+        result = (await super().create() + '\n' + await self.database.execute(f'''
+            CREATE SEQUENCE IF NOT EXISTS view_id_seq OWNED BY {self.name}.id;
+            ALTER TABLE {self.name} ADD COLUMN IF NOT EXISTS kind TEXT;
+            CREATE INDEX IF NOT EXISTS {self.name}_kind ON {self.name}(kind);
+        '''))
+        for record in await self.database.fetch(f'SELECT id, data FROM {self.name} WHERE kind IS NULL'):
+            try:
+                view = pickle.loads(record['data'])
+            except Exception as e:
+                print(f'Stored view {record["id"]} could not be converted, leaving it alone: {e!r}')
+                continue
+            await self.database.execute(f'UPDATE {self.name} SET data = $2, kind = $3 WHERE id = $1',
+                                        record['id'], self.encode(view), type(view).kind())
+        return result
+
+    def encode(self, view: discordutils.PersistentView) -> bytes:
+        _, _, state = view.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+        return self.magic + bytes((self.version,)) + pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, kind: str, data: bytes) -> discordutils.PersistentView:
+        if data[:len(self.magic)] != self.magic:
+            raise pickle.UnpicklingError('Stored view is missing its header')
+        if (version := data[len(self.magic)]) != self.version:
+            raise pickle.UnpicklingError(f'Unsupported stored view format version {version}')
+        if (cls := self.resolve(kind)) is None:
+            raise KeyError(f'Unknown stored view kind {kind}')
+        view = cls._new_uninitialised()
+        view.__setstate__(pickle.loads(data[len(self.magic) + 1:]))
+        return view
+
+    def resolve(self, kind: str | None) -> type[discordutils.PersistentView] | None:
+        """The class of a kind, also accepting the bare class names stored before kinds included the module."""
+        if kind is None:
+            return None
+        if (cls := self.kinds.get(kind)) is not None or '.' in kind:
+            return cls
+        matches = [c for c in self.kinds.values() if c.__name__ == kind]
+        return matches[0] if len(matches) == 1 else None
 
-    async def get(self, view_id: int) -> discordutils.PersistentView:
-        return pickle.loads(await self.database.fetch_val(f'SELECT data FROM {self.name} WHERE id = $1', view_id))
+    async def get(self, view_id: int) -> discordutils.PersistentView | None:
+        record = await self.database.fetch_row(f'SELECT kind, data FROM {self.name} WHERE id = $1', view_id)
+        if record is None:
+            return None
+        if self.resolve(record['kind']) is None:
+            print(f'Stored view {view_id} is of unknown kind {record["kind"]}, leaving it alone')
+            return None
+        return self.decode(record['kind'], record['data'])
 
-    async def get_all(self) -> AsyncIterable[discordutils.PersistentView]:
+    async def get_all(self, *kinds: str) -> AsyncIterable[discordutils.PersistentView]:
+        """Yields the stored views of known kinds, only those of the given kinds if any are given."""
+        # rows stored under the bare class name are found too
+        names = [*kinds, *(k.rpartition('.')[2] for k in kinds)]
+        query = f'SELECT kind, data FROM {self.name}' + (' WHERE kind = ANY($1)' if kinds else '')
         async with self.database.acquire() as conn:
             async with conn.transaction():
-                async for record in conn.cursor(f'SELECT data FROM {self.name}'):
-                    yield pickle.loads(record['data'])
+                async for record in conn.cursor(query, *((names,) if kinds else ())):
+                    if self.resolve(record['kind']) is not None:
+                        yield self.decode(record['kind'], record['data'])
 
     def add(self, view: discordutils.PersistentView) -> Awaitable[object]:
-        data = pickle.dumps(view)
-        return self.database.execute(f'INSERT INTO {self.name}(id, data) VALUES ($1, $2)', view.custom_id, data)
+        return self.database.execute(f'INSERT INTO {self.name}(id, data, kind) VALUES ($1, $2, $3)',
+                                     view.custom_id, self.encode(view), type(view).kind())
 
     def remove(self, view_id: int) -> Awaitable[object]:
         return self.database.execute(f'DELETE FROM {self.name} WHERE id = $1', view_id)
 
+    async def migrate_kinds(self) -> int:
+        """Renames kinds stored as a bare class name to their full kind, where the class can be told apart."""
+        renamed = 0
+        for kind in await self.unknown_kinds(include_bare=True):
+            if kind is not None and '.' not in kind and (cls := self.resolve(kind)) is not None:
+                result = await self.database.execute(f'UPDATE {self.name} SET kind = $2 WHERE kind = $1',
+                                                     kind, cls.kind())
+                renamed += int(result.split(' ')[-1])
+        return renamed
+
+    async def unknown_kinds(self, include_bare: bool = False) -> dict[str | None, int]:
+        """
+        The number of stored views of each kind that is not known, or is a bare class name if [include_bare].
+        Views that could not be converted from the old format are counted under None.
+        """
+        return {rec['kind']: rec['count'] for rec in await self.database.fetch(
+            f'SELECT kind, count(*) AS count FROM {self.name} GROUP BY kind')
+            if rec['kind'] not in self.kinds and (include_bare or self.resolve(rec['kind']) is None)}
+
+    async def prune(self, *, dry_run: bool = True) -> dict[str | None, int]:
+        """
+        Deletes the stored views of unknown kinds, returning how many there were of each.
+        Only counts them if [dry_run], as they may belong to a cog that failed to load rather than one removed.
+        """
+        unknown = await self.unknown_kinds()
+        if unknown and not dry_run:
+            await self.database.execute(f'DELETE FROM {self.name} WHERE kind = ANY($1) OR (kind IS NULL AND $2)',
+                                        [k for k in unknown if k is not None], None in unknown)
+        return unknown
+
     def get_id(self) -> Awaitable[int]:
         return self.database.fetch_val("SELECT nextval('view_id_seq')")
@@ -1,23 +1,119 @@
 from __future__ import annotations
 
-from collections.abc import Awaitable, Iterable
+import collections
+import datetime
+import functools
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterable, Sequence
 from typing import Any, TypeVar
 
 import asyncpg
 
 from . import classes
+from .. import metrics
 
 __all__ = ('PGDatabase',)
 
 R = TypeVar('R')
 
+logger = logging.getLogger(__name__)
 
-class PGDatabase(classes.Database[R]):
-    __slots__ = ('pool', 'coro')
+# options of create_pool that are not also options of connect
+_pool_options = frozenset({'min_size', 'max_size', 'max_queries', 'max_inactive_connection_lifetime', 'setup', 'init',
+                           'reset', 'loop'})
+
+
+@functools.lru_cache(maxsize=1024)
+def _template(query: str) -> str:
+    """The statement a query was made from, with whitespace collapsed, to label its metrics with."""
+    return ' '.join(query.split())[:120]
+
+
+def _top_statements(limit: int = 10) -> list[str]:
+    """A line for each of the [limit] statements that have taken the most time in total."""
+    latencies = metrics.registry.snapshot('db.latency')
+    lines = []
+    for key, s in sorted(latencies.items(), key=lambda item: item[1]['count'] * item[1]['mean'],
+                         reverse=True)[:limit]:
+        statement = key.removeprefix('db.latency{statement=').removesuffix('}')
+        lines.append(f'{s["count"]}x, total {s["count"] * s["mean"]:.2f}s, p95 {s["p95"] * 1000:.1f}ms: {statement}')
+    return lines
 
-    def __init__(self, *args, **kwargs):
+
+class PGDatabase(classes.Database[R]):
+    """
+    A database backed by an asyncpg pool.
+    Each statement records its latency and rows returned by template under db., along with how long it waited
+    for a connection and how busy the pool is. Statements slower than [slow_threshold] seconds are logged.
+    Notifications are received on a connection of their own, so listening takes none of the pool's capacity.
+    """
+    __slots__ = ('pool', 'coro', '_connect_kwargs', '_listener', 'slow_threshold', 'slow_queries', '_waiting')
+
+    def __init__(self, *args, slow_threshold: float = 0.5, **kwargs):
         super().__init__(*args)
         self.pool = asyncpg.create_pool(**kwargs)
+        self._connect_kwargs = {k: v for k, v in kwargs.items() if k not in _pool_options}
+        # outside the pool, which would stop it listening once released back and count it against its size
+        self._listener: asyncpg.Connection | None = None
+        self.slow_threshold = slow_threshold
+        self.slow_queries: collections.deque[tuple[datetime.datetime, float, str]] = collections.deque(maxlen=50)
+        self._waiting = 0
+
+    def _update_pool_gauges(self) -> None:
+        size = self.pool.get_size()
+        metrics.registry.gauge('db.pool.size').set(size)
+        metrics.registry.gauge('db.pool.in_use').set(size - self.pool.get_idle_size())
+        metrics.registry.gauge('db.pool.max').set(self.pool.get_max_size())
+        metrics.registry.gauge('db.pool.waiting').set(self._waiting)
+
+    async def _run(self, method: str | Callable[..., Awaitable], query: str, args: Iterable, timeout: float | None,
+                   rows: bool = False) -> Any:
+        template = _template(query)
+        start = time.perf_counter()
+        self._waiting += 1
+        try:
+            conn = await self.pool.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            acquired = time.perf_counter()
+            metrics.registry.histogram('db.acquire_wait').observe(acquired - start)
+            self._update_pool_gauges()
+            try:
+                call = getattr(conn, method) if isinstance(method, str) else functools.partial(method, conn)
+                result = await call(query, *args, timeout=timeout)
+            except Exception as e:
+                metrics.registry.counter('db.errors', statement=template, error=type(e).__name__).inc()
+                raise
+        finally:
+            await self.pool.release(conn)
+
+        elapsed = time.perf_counter() - acquired
+        metrics.registry.histogram('db.latency', statement=template).observe(elapsed)
+        if rows:
+            metrics.registry.histogram('db.rows', statement=template).observe(len(result))
+        if elapsed >= self.slow_threshold:
+            self.slow_queries.append((datetime.datetime.now(tz=datetime.timezone.utc), elapsed, template))
+            logger.warning('Slow query (%.3fs): %s', elapsed, template)
+        return result
+
+    def report(self) -> str:
+        """A summary of the pool, the statements taking the most time in total and the latest slow queries."""
+        listening = self._listener is not None and not self._listener.is_closed()
+        lines = [f'Pool: {self.pool.get_size() - self.pool.get_idle_size()}/{self.pool.get_size()} in use '
+                 f'(max {self.pool.get_max_size()}), {self._waiting} waiting',
+                 f'Listener: {"connected" if listening else "not connected"}, outside the pool']
+        wait = metrics.registry.histogram('db.acquire_wait').snapshot()
+        lines.append(f'Acquire wait: p50 {wait["p50"] * 1000:.1f}ms, p95 {wait["p95"] * 1000:.1f}ms, '
+                     f'max {wait["max"] * 1000:.1f}ms')
+        lines.append('\nMost total time:')
+        lines.extend(_top_statements())
+        if self.slow_queries:
+            lines.append(f'\nSlow queries (over {self.slow_threshold}s):')
+            lines.extend(f'{t:%Y-%m-%d %H:%M:%S} {elapsed:.3f}s: {statement}'
+                         for t, elapsed, statement in reversed(self.slow_queries))
+        return '\n'.join(lines)
 
     async def __aenter__(self):
         await self.pool.__aenter__()
@@ -25,22 +121,40 @@ class PGDatabase(classes.Database[R]):
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
         await self.pool.__aexit__(exc_type, exc_val, exc_tb)
 
     def execute(self, query, *args, timeout: float | None = None) -> Awaitable[str]:
-        return self.pool.execute(query, *args, timeout=timeout)
+        return self._run('execute', query, args, timeout)
 
     def execute_many(self, query, args, *, timeout: float | None = None) -> Awaitable[None]:
-        return self.pool.executemany(query, args, timeout=timeout)
+        return self._run('executemany', query, (args,), timeout)
 
     def fetch(self, query, *args, timeout: float | None = None) -> Awaitable[Iterable]:
-        return self.pool.fetch(query, *args, timeout=timeout)
+        return self._run('fetch', query, args, timeout, rows=True)
+
+    def copy_insert(self, query, table: str, cols: Sequence[str], records: Iterable[Sequence],
+                    *, timeout: float | None = None) -> Awaitable[str]:
+        return self._run(classes.copy_insert, query, (table, cols, records), timeout)
 
     def fetch_row(self, query, *args, timeout: float | None = None) -> Awaitable[R | None]:
-        return self.pool.fetchrow(query, *args, timeout=timeout)
+        return self._run('fetchrow', query, args, timeout)
 
     def fetch_val(self, query, *args, timeout: float | None = None) -> Awaitable[Any]:
-        return self.pool.fetchval(query, *args, timeout=timeout)
+        return self._run('fetchval', query, args, timeout)
 
     def acquire(self):
         return self.pool.acquire()
+
+    async def listen(self, channel: str, callback: classes.ListenerFunc,
+                     on_lost: Callable[[], object] | None = None) -> None:
+        if self._listener is not None and self._listener.is_closed():
+            # the connection was lost, so listen again on a new one
+            self._listener = None
+        if self._listener is None:
+            self._listener = await asyncpg.connect(**self._connect_kwargs)
+        await self._listener.add_listener(channel, lambda _conn, _pid, _channel, payload: callback(payload))
+        if on_lost is not None:
+            self._listener.add_termination_listener(lambda _conn: on_lost())
@@ -2,3 +2,4 @@ from .misc import *
 from .views import *
 from .cogs import *
 from .pager import *
+from .digest import *
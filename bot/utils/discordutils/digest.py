@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import traceback
+from collections.abc import Awaitable, Callable, Iterable
+
+import discord
+
+from .. import metrics
+
+__all__ = ('AlertDigest',)
+
+max_embeds = 10
+max_embed_chars = 6000
+
+
+def _pages(embeds: Iterable[discord.Embed]) -> list[list[discord.Embed]]:
+    """Splits [embeds] into as few messages as Discord's limits allow, keeping their order."""
+    pages: list[list[discord.Embed]] = []
+    chars = 0
+    for embed in embeds:
+        if not pages or len(pages[-1]) == max_embeds or chars + len(embed) > max_embed_chars:
+            pages.append([])
+            chars = 0
+        pages[-1].append(embed)
+        chars += len(embed)
+    return pages
+
+
+class AlertDigest:
+    """
+    Merges the alerts sent to a channel within a window of seconds into as few messages as possible.
+    The first alert in a quiet channel is sent straight away, later ones are collected until the window has passed.
+    They are then added to the previous digest if it is still the latest message and has room, and sent in new
+    messages of up to 10 embeds and 6000 characters otherwise.
+    [window] gives the number of seconds, each alert being sent on its own if it is 0 or None.
+    """
+    __slots__ = ('window', '_pending', '_tasks', '_last')
+
+    def __init__(self, window: Callable[[], Awaitable[int | None]]):
+        self.window = window
+        self._pending: dict[int, tuple[discord.TextChannel, list[discord.Embed]]] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+        # channel id to the latest digest sent in it and when it was last changed
+        self._last: dict[int, tuple[discord.Message, float]] = {}
+
+    async def send(self, channel: discord.TextChannel, embed: discord.Embed) -> None:
+        if not (window := await self.window()):
+            await channel.send(embed=embed)
+            return
+        self._pending.setdefault(channel.id, (channel, []))[1].append(embed)
+        if channel.id not in self._tasks:
+            last = self._last.get(channel.id)
+            recent = last is not None and time.monotonic() - last[1] < window
+            self._tasks[channel.id] = asyncio.create_task(self._flush_later(channel, window, recent))
+
+    async def _flush_later(self, channel: discord.TextChannel, window: float, edit: bool) -> None:
+        try:
+            await asyncio.sleep(window if edit else 0)
+            await self._flush(channel, edit)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            del self._tasks[channel.id]
+        # alerts sent while the previous ones were being sent have no task of their own
+        if channel.id in self._pending:
+            self._tasks[channel.id] = asyncio.create_task(self._flush_later(channel, window, True))
+
+    async def _flush(self, channel: discord.TextChannel, edit: bool) -> None:
+        _, embeds = self._pending.pop(channel.id, (channel, []))
+        last = self._last.get(channel.id)
+        # only the latest message is added to, so that alerts are not hidden further up the channel
+        if embeds and edit and last is not None and channel.last_message_id == last[0].id:
+            existing = last[0].embeds
+            chars = sum(map(len, existing))
+            n = 0
+            while (n < len(embeds) and len(existing) + n < max_embeds
+                   and chars + len(embeds[n]) <= max_embed_chars):
+                chars += len(embeds[n])
+                n += 1
+            if n:
+                self._last[channel.id] = await last[0].edit(embeds=[*existing, *embeds[:n]]), time.monotonic()
+                metrics.registry.counter('digest.messages', action='edit').inc()
+                embeds = embeds[n:]
+        for page in _pages(embeds):
+            self._last[channel.id] = await channel.send(embeds=page), time.monotonic()
+            metrics.registry.counter('digest.messages', action='send').inc()
+
+    async def close(self) -> None:
+        """Sends any alerts still being collected."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # a task cancelled before it started never reaches its finally, so it is not removed by itself
+        self._tasks.clear()
+        for channel, _ in list(self._pending.values()):
+            await self._flush(channel, False)
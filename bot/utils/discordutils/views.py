@@ -11,7 +11,7 @@ import discord
 from .. import config
 
 __all__ = ('Choices', 'LinkButton', 'LinkView', 'MultiLinkView', 'TimeoutView', 'PersistentView', 'PersistentButton',
-           'persistent_button', 'single_modal', 'disable_all', 'enable_all')
+           'persistent_button', 'single_modal', 'disable_all', 'enable_all', 'dispatch_restored')
 
 
 # Setup buttons for user to make choices
@@ -81,6 +81,8 @@ class TimeoutView(discord.ui.View, abc.ABC):
 class PersistentView(discord.ui.View, abc.ABC):
     __persistent_children__ = None
     bot: 'DBBot | None' = None
+    # kinds of every persistent view, as module.qualname, to the class, used to restore stored views
+    kinds: dict[str, Type['PersistentView']] = {}
 
     def __init__(self, *args, custom_id: int, **kwargs):
         super().__init__(*args, timeout=None, **kwargs)
@@ -114,8 +116,20 @@ class PersistentView(discord.ui.View, abc.ABC):
     def __reduce_ex__(self, protocol: int):
         return self._new_uninitialised, (), (1, self.custom_id, *self.get_state())
 
+    @classmethod
+    def kind(cls) -> str:
+        """The name stored views of this class are recorded under, unique unlike the class name alone."""
+        return f'{cls.__module__}.{cls.__qualname__}'
+
+    @staticmethod
+    def parse_custom_id(item_custom_id: str) -> int | None:
+        """The custom id of the view that made an item with this custom id, if it was a persistent view."""
+        _, _, view_id = item_custom_id.rpartition(' ')
+        return int(view_id) if view_id.isdigit() else None
+
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__()
+        PersistentView.kinds[cls.kind()] = cls
         cls.__persistent_children__ = []
         for base in reversed(cls.__mro__):
             for member in base.__dict__.values():
@@ -192,3 +206,19 @@ def enable_all(view: discord.ui.View):
     for c in view.children:
         if isinstance(c, discord.ui.Button):
             c.disabled = False
+
+
+def dispatch_restored(view: discord.ui.View, interaction: discord.Interaction) -> bool:
+    """
+    Runs the callback of the item of [view] that [interaction] is for, returning whether it could.
+    discord.py dispatches component interactions to views before on_interaction runs, so a view restored there
+    missed the interaction. This relies on View._dispatch_item, so only versions it is known on are used.
+    """
+    if not (2, 0) <= discord.version_info[:2] < (3, 0) or not hasattr(view, '_dispatch_item'):
+        return False
+    custom_id = interaction.data.get('custom_id')
+    for item in view.children:
+        if getattr(item, 'custom_id', None) == custom_id:
+            view._dispatch_item(item, interaction)
+            return True
+    return False
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import traceback
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Generic, TypeVar
+
+from . import metrics
+
+__all__ = ('Dispatcher',)
+
+T = TypeVar('T')
+
+
+class Dispatcher(Generic[T]):
+    """
+    Hands events to [workers] workers, so that a burst of events queues up instead of each starting a handler.
+    Events with the same key are handled one at a time in order. An event still waiting is superseded by a later one
+    with the same key, combined with it by [merge], which by default keeps the later event.
+    Once [max_pending] keys are waiting, put() waits for room, pushing back on whatever produces the events.
+    Metrics are recorded under dispatch., labelled with [name] as dispatcher.
+    """
+    __slots__ = ('name', 'handler', 'key', 'merge', 'workers', 'max_pending', '_pending', '_active', '_ready', '_room',
+                 '_blocked', '_tasks')
+
+    def __init__(self, name: str, handler: Callable[[T], Awaitable[object]], key: Callable[[T], Hashable],
+                 workers: int = 4, max_pending: int = 1000, merge: Callable[[T, T], T] | None = None):
+        self.name = name
+        self.handler = handler
+        self.key = key
+        self.merge = merge if merge is not None else (lambda _old, new: new)
+        self.workers = workers
+        self.max_pending = max_pending
+        # key to when it started waiting and its latest event
+        self._pending: dict[Hashable, tuple[float, T]] = {}
+        self._active: set[Hashable] = set()
+        # keys with a pending event that are not being handled
+        self._ready: asyncio.Queue[Hashable] = asyncio.Queue()
+        self._room = asyncio.Semaphore(max_pending)
+        # the number of put() calls waiting for room
+        self._blocked = 0
+        self._tasks: list[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Stops the workers, dropping any events still waiting, including those of put() calls waiting for room."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # start afresh, so that the dropped events neither hold room nor leave keys in the queue
+        self._pending.clear()
+        self._active.clear()
+        self._ready = asyncio.Queue()
+        room, self._room = self._room, asyncio.Semaphore(self.max_pending)
+        # wake the put() calls waiting on the old room, which then drop their events
+        for _ in range(self._blocked):
+            room.release()
+        metrics.registry.gauge('dispatch.pending', dispatcher=self.name).set(0)
+
+    async def put(self, event: T) -> None:
+        key = self.key(event)
+        if key not in self._pending:
+            room = self._room
+            self._blocked += 1
+            try:
+                await room.acquire()
+            finally:
+                self._blocked -= 1
+            if room is not self._room:
+                # stop() was called while waiting
+                return
+            # another event with this key may have been put while waiting for room
+            if key not in self._pending:
+                self._pending[key] = time.perf_counter(), event
+                metrics.registry.gauge('dispatch.pending', dispatcher=self.name).set(len(self._pending))
+                if key not in self._active:
+                    self._ready.put_nowait(key)
+                return
+            self._room.release()
+        queued, pending = self._pending[key]
+        self._pending[key] = queued, self.merge(pending, event)
+        metrics.registry.counter('dispatch.coalesced', dispatcher=self.name).inc()
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._ready.get()
+            queued, event = self._pending.pop(key)
+            self._room.release()
+            self._active.add(key)
+            metrics.registry.gauge('dispatch.pending', dispatcher=self.name).set(len(self._pending))
+            metrics.registry.histogram('dispatch.lag', dispatcher=self.name).observe(time.perf_counter() - queued)
+            try:
+                await self.handler(event)
+            except Exception:
+                metrics.registry.counter('dispatch.errors', dispatcher=self.name).inc()
+                traceback.print_exc()
+            finally:
+                self._active.discard(key)
+                # an event that arrived while this one was being handled
+                if key in self._pending:
+                    self._ready.put_nowait(key)
+            metrics.registry.counter('dispatch.handled', dispatcher=self.name).inc()
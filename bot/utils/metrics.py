@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import collections
+import math
+from typing import Any
+
+__all__ = ('Counter', 'Gauge', 'Histogram', 'Registry', 'registry')
+
+
+class Counter:
+    """A value that only goes up."""
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Gauge:
+    """A value that is set to the current state of something."""
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Histogram:
+    """
+    A distribution of observed values.
+    The count, sum and max cover every observation, while percentiles come from the latest [size] of them.
+    """
+    __slots__ = ('count', 'total', 'max', '_samples')
+
+    def __init__(self, size: int = 1024):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self._samples: collections.deque[float] = collections.deque(maxlen=size)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self._samples.append(value)
+
+    def percentiles(self, *ps: float) -> list[float]:
+        samples = sorted(self._samples)
+        if not samples:
+            return [0.] * len(ps)
+        return [samples[max(0, math.ceil(p / 100 * len(samples)) - 1)] for p in ps]
+
+    def snapshot(self) -> dict[str, float]:
+        p50, p95, p99 = self.percentiles(50, 95, 99)
+        return {'count': self.count, 'mean': self.total / self.count if self.count else 0.,
+                'p50': p50, 'p95': p95, 'p99': p99, 'max': self.max}
+
+
+class Registry:
+    """Holds metrics by name and labels, creating them when first used."""
+
+    def __init__(self):
+        self._metrics: dict[tuple[str, tuple[tuple[str, str], ...]], Counter | Gauge | Histogram] = {}
+
+    def _get(self, kind: type, name: str, labels: dict[str, Any]) -> Any:
+        key = name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = kind()
+        elif not isinstance(metric, kind):
+            raise TypeError(f'Metric {name} is a {type(metric).__name__}, not a {kind.__name__}!')
+        return metric
+
+    def counter(self, name: str, **labels: Any) -> Counter:
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name: str, **labels: Any) -> Gauge:
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name: str, **labels: Any) -> Histogram:
+        return self._get(Histogram, name, labels)
+
+    def snapshot(self, prefix: str = '') -> dict[str, Any]:
+        """The current values of the metrics with names starting with [prefix], keyed like name{label=value}."""
+        result = {}
+        for (name, labels), metric in sorted(self._metrics.items(), key=lambda item: item[0]):
+            if name.startswith(prefix):
+                label_str = ','.join(f'{k}={v}' for k, v in labels)
+                result[f'{name}{{{label_str}}}' if label_str else name] = metric.snapshot()
+        return result
+
+    def dump(self, prefix: str = '') -> str:
+        """The current values of the metrics as text, one per line."""
+        lines = []
+        for key, value in self.snapshot(prefix).items():
+            if isinstance(value, dict):
+                value = ' '.join(f'{k}={v:.4g}' for k, v in value.items())
+            lines.append(f'{key} {value:.4g}' if isinstance(value, float) else f'{key} {value}')
+        return '\n'.join(lines)
+
+    def clear(self) -> None:
+        self._metrics.clear()
+
+
+registry = Registry()
@@ -1,4 +1,4 @@
 from .data_classes import *
 from .resources import *
 from .misc import *
-from . import api, constants, link, models, formulas
+from . import api, constants, link, models, formulas, ratelimit, records, audit, builder
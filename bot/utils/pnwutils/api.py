@@ -1,31 +1,149 @@
 from __future__ import annotations
 
-from typing import Any, Iterable
+import asyncio
+import collections
+import copy
+import functools
+import itertools
+import re
+import time
+from collections.abc import AsyncIterator, Awaitable
+from typing import Any, Iterable, TypeVar
 
 import aiohttp
 
-__all__ = ('APIError', 'APIQuery')
+__all__ = ('APIError', 'APIQuery', 'CombinedQuery')
 
-from . import constants
-from .. import config
+from . import audit, builder, constants, graphql
+from .ratelimit import Priority, get_limiter
+from .records import Record, record_type
+from .. import config, metrics
+
+# how many times a request is retried after being rate limited
+max_retries = 3
+
+T = TypeVar('T')
 
 
 class APIError(Exception):
     """Error raised when an exception occurs when trying to call the API."""
 
-    def __init__(self, message: str, info: Any = None):
+    def __init__(self, message: str, info: Any = None, category: str = 'unknown'):
         super().__init__(message)
         self.info = info
+        self.category = category
+
+
+def _error_category(errors: Any) -> str:
+    try:
+        return errors[0].get('extensions', {}).get('category', 'graphql')
+    except (AttributeError, IndexError, KeyError, TypeError):
+        return 'graphql'
+
+
+async def _post(session: aiohttp.ClientSession, api_key: str, payload: dict[str, Any],
+                bot_headers: bool = False, priority: Priority = Priority.INTERACTIVE,
+                name: str = 'anonymous') -> dict[str, Any]:
+    """
+    Sends a request to the API, returning the data of the response.
+    The request is scheduled by the rate limiter of the api key, and retried if it is rate limited.
+    Metrics on the request are recorded under the given query name.
+    """
+    headers = {'X-Bot-Key': config.api_key_mut, 'X-Api-Key': config.api_key} if bot_headers else {}
+    limiter = get_limiter(api_key)
+    # time spent waiting on the rate limiter is not counted
+    elapsed = 0.
+    try:
+        for attempt in range(max_retries + 1):
+            await limiter.acquire(priority)
+            sent = time.perf_counter()
+            try:
+                async with session.post(constants.base_api_url, params={'api_key': api_key},
+                                        json=payload, headers=headers) as response:
+                    limiter.update(response.headers)
+                    if response.status == 429:
+                        if attempt < max_retries:
+                            metrics.registry.counter('api.retries', query=name).inc()
+                            limiter.throttle(float(response.headers.get('Retry-After', 2 ** attempt)))
+                            continue
+                        raise APIError('Rate limited by the API!', category='rate_limited')
+                    body = await response.read()
+                    metrics.registry.histogram('api.response_bytes', query=name).observe(len(body))
+                    try:
+                        data = await response.json()
+                    except aiohttp.ContentTypeError:
+                        raise APIError(f'Response received was of type {response.content_type}\n'
+                                       f' content: {await response.text()}', category='content_type')
+                    break
+            finally:
+                elapsed += time.perf_counter() - sent
+
+        try:
+            return data['data']
+        except KeyError:
+            raise APIError(f'Error in fetching data: {data["errors"]}', data['errors'],
+                           _error_category(data['errors'])) from None
+        except TypeError:
+            if isinstance(data, list):
+                error_msg = data[0]["errors"][0]["message"]
+                raise APIError(f'Error in fetching data: {error_msg}', error_msg, 'graphql') from None
+            raise
+    except APIError as e:
+        metrics.registry.counter('api.errors', query=name, category=e.category).inc()
+        raise
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        metrics.registry.counter('api.errors', query=name, category=type(e).__name__).inc()
+        raise
+    finally:
+        metrics.registry.histogram('api.latency', query=name).observe(elapsed)
+
+
+async def _gather_or_cancel(*aws: Awaitable[T]) -> list[T]:
+    """
+    Runs [aws] concurrently and returns their results in order, like asyncio.gather.
+    The first to fail cancels the rest, which are waited on before its error is raised, like an asyncio.TaskGroup
+    (which needs Python 3.11).
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+_missing = object()
 
 
 class APIQuery:
     def __init__(self, query_text: str, check_more: bool = False, bot_headers: bool = False,
-                 **variable_types: type | list[type]):
+                 concurrency: int = 4, cache_ttl: float | None = None, cache_size: int = 64,
+                 records: bool = False, **variable_types: type | list[type]):
 
         self.query_text = query_text
         self.variable_types = variable_types
         self.check_more = check_more
         self.bot_headers = bot_headers
+        # maximum number of pages fetched at once, when the page count is known
+        self.concurrency = concurrency
+
+        # responses are only cached if a ttl (in seconds) is given
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache: collections.OrderedDict[tuple, tuple[float, Any]] = collections.OrderedDict()
+        self._in_flight: dict[tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.operation, = graphql.parse(query_text)
+
+        # when set, rows are turned into records derived from the selections of the query to save memory
+        self.record_type: type[Record] | None = None
+        if records:
+            data = next(f for f in self.operation.selections[0].selections if f.name == 'data')
+            self.record_type = record_type(data.selections, self.operation.name or 'Record')
 
         if check_more:
             self.variable_types['page'] = int
@@ -33,34 +151,20 @@ class APIQuery:
     def get_query(self, variables: dict[str, Any]) -> dict[str, str | dict[str, Any]]:
         return {'query': self.query_text, 'variables': variables}
 
-    async def _query(self, session: aiohttp.ClientSession, api_key: str, variables: dict):
-        headers = {'X-Bot-Key': config.api_key_mut, 'X-Api-Key': config.api_key} if self.bot_headers else {}
-        async with session.post(constants.base_api_url, params={'api_key': api_key},
-                                json=self.get_query(variables), headers=headers) as response:
-            try:
-                data = await response.json()
-            except aiohttp.ContentTypeError:
-                raise APIError(f'Response received was of type {response.content_type}\n'
-                               f' content: {await response.text()}')
-
-        try:
-            data = data['data']
-        except KeyError:
-            raise APIError(f'Error in fetching data: {data["errors"]}', data['errors']) from None
-        except TypeError:
-            if isinstance(data, list):
-                error_msg = data[0]["errors"][0]["message"]
-                raise APIError(f'Error in fetching data: {error_msg}', error_msg) from None
-            raise
-
+    async def _query(self, session: aiohttp.ClientSession, api_key: str, variables: dict,
+                     priority: Priority = Priority.INTERACTIVE):
+        data = await _post(session, api_key, self.get_query(variables), self.bot_headers, priority,
+                           self.operation.name)
         # get the only child of the dict
-        return next(iter(data.values()))
+        data = next(iter(data.values()))
+        if self.record_type is not None:
+            data['data'] = list(map(self.record_type.from_dict, data['data']))
+        elif audit.enabled:
+            data = audit.wrap(self.operation.name, data)
+        return data
 
-    async def query(self, session: aiohttp.ClientSession, *, api_key: str = config.api_key,
-                    **variables) -> Iterable[dict[str, Any]] | dict[str, Any]:
-        # alex put a limit of 500 entries returned per call, check_more decides if we should
-        # try to get the next 500 entries
-        # Set page to first page if more entries than possible in 1 call wanted
+    def _normalise(self, variables: dict[str, Any]) -> dict[str, Any]:
+        """Checks the names of the given variables, and converts them to the types expected."""
         if not set(variables.keys()) <= set(self.variable_types.keys()):
             raise APIError(f'Key mismatch! Variables: {self.variable_types}, Passed: {variables}')
         variables = {k: v for k, v in variables.items() if v is not None}
@@ -70,17 +174,211 @@ class APIQuery:
                 variables[k] = list(map(ty[0], variables[k]))
             else:
                 variables[k] = ty(variables[k])
+        return variables
+
+    async def query(self, session: aiohttp.ClientSession, *, api_key: str = config.api_key, cache: bool = True,
+                    priority: Priority = Priority.INTERACTIVE,
+                    **variables) -> Iterable[dict[str, Any]] | dict[str, Any]:
+        """
+        Calls the API with the given variables.
+        If this query has a cache ttl and [cache] is true, a cached response is returned if one is still fresh,
+        and concurrent identical calls share a single request.
+        [priority] decides which requests are made first when close to the rate limit.
+        """
+        variables = self._normalise(variables)
+        if self.cache_ttl is None or not cache:
+            return await self._fetch(session, api_key, variables, priority)
+
+        key = self._cache_key(api_key, variables)
+        if (data := self._get_cached(key)) is not _missing:
+            return data
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(session, api_key, variables, priority))
+            task.add_done_callback(functools.partial(self._store, key))
+            self._in_flight[key] = task
+        else:
+            # an identical request is already being made, share its result
+            self.hits += 1
+        return copy.deepcopy(await asyncio.shield(task))
+
+    async def stream(self, session: aiohttp.ClientSession, *, api_key: str = config.api_key,
+                     priority: Priority = Priority.INTERACTIVE, **variables) -> AsyncIterator[dict[str, Any]]:
+        """
+        Calls a paginated query with the given variables, yielding the entries of each page as it arrives.
+        The next page is requested while the entries of the current page are being consumed.
+        """
+        if not self.check_more:
+            raise APIError('Only paginated queries can be streamed!')
+        variables = self._normalise(variables)
+        first_page = page = variables.setdefault('page', 1)
+        task = asyncio.create_task(self._query(session, api_key, variables, priority))
+        try:
+            while task is not None:
+                data = await task
+                if data['paginatorInfo']['hasMorePages']:
+                    page += 1
+                    task = asyncio.create_task(self._query(session, api_key, {**variables, 'page': page}, priority))
+                else:
+                    task = None
+                for entry in data['data']:
+                    yield entry
+        finally:
+            # consumer stopped early
+            if task is not None:
+                task.cancel()
+            metrics.registry.histogram('api.pages', query=self.operation.name).observe(page - first_page + 1)
+
+    @staticmethod
+    def _cache_key(api_key: str, variables: dict[str, Any]) -> tuple:
+        return api_key, tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in variables.items()))
 
-        data = await self._query(session, api_key, variables)
+    def _get_cached(self, key: tuple) -> Any:
+        entry = self._cache.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return _missing
+        self._cache.move_to_end(key)
+        self.hits += 1
+        # copied so that callers modifying the data do not affect the cached version
+        return copy.deepcopy(entry[1])
+
+    def _put(self, key: tuple, data: Any) -> None:
+        self._cache[key] = (time.monotonic() + self.cache_ttl, data)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _store(self, key: tuple, task: asyncio.Task) -> None:
+        del self._in_flight[key]
+        if not task.cancelled() and task.exception() is None:
+            self._put(key, task.result())
+
+    def cache_info(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache)}
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    async def _fetch(self, session: aiohttp.ClientSession, api_key: str, variables: dict[str, Any],
+                     priority: Priority = Priority.INTERACTIVE) -> Iterable[dict[str, Any]] | dict[str, Any]:
+        # alex put a limit of 500 entries returned per call, check_more decides if we should
+        # try to get the next 500 entries
+        # Set page to first page if more entries than possible in 1 call wanted
+        data = await self._query(session, api_key, variables, priority)
 
         if self.check_more:
-            variables.setdefault('page', 1)
+            first_page = variables.setdefault('page', 1)
             result = data['data']
+            if data['paginatorInfo']['hasMorePages'] and (last := data['paginatorInfo'].get('lastPage')):
+                # page count is known, so fetch the remaining pages concurrently
+                semaphore = asyncio.Semaphore(self.concurrency)
+
+                async def fetch_page(page: int) -> dict[str, Any]:
+                    async with semaphore:
+                        return await self._query(session, api_key, {**variables, 'page': page}, priority)
+
+                # kept in order, and if a page fails the others are cancelled instead of left to run
+                pages = await _gather_or_cancel(*map(fetch_page, range(variables['page'] + 1, last + 1)))
+                for data in pages:
+                    result.extend(data['data'])
+                variables['page'] = last
+
+            # either lastPage was not selected, or more entries were added while fetching
             while data['paginatorInfo']['hasMorePages']:
                 variables['page'] += 1
-                data = await self._query(session, api_key, variables)
+                data = await self._query(session, api_key, variables, priority)
                 result.extend(data['data'])
 
+            metrics.registry.histogram('api.pages', query=self.operation.name).observe(
+                variables['page'] - first_page + 1)
             # linter does not realise that in this case, the query call will always return Iterable[dict[str, Any]]
             return result
         return data
+
+
+_variable_pattern = re.compile(r'\$(\w+)')
+
+
+def _aliased(f: graphql.Field, prefix: str, alias: str | None = None) -> builder.Field:
+    """Rebuilds a parsed field, with its variables given [prefix] so that they do not clash with other queries."""
+    arguments = {k: _variable_pattern.sub(rf'${prefix}\1', v) for k, v in f.arguments.items()}
+    selections = (_aliased(g, prefix) if g.selections or g.alias or g.arguments else g.name for g in f.selections)
+    return builder.Field(f.name, *selections, alias=alias or f.alias, **arguments)
+
+
+class CombinedQuery:
+    """
+    Combines several queries into a single request.
+    The top level field of each query is aliased and its variables renamed, so that they do not clash,
+    and the response is split back up into the results of each query.
+    Fragments are spread into the fields that use them, so a request only selects what the queries in it need.
+    Queries with a cache ttl are only included in the request if they do not have a fresh cached result,
+    and concurrent identical calls share a single request.
+    """
+
+    def __init__(self, *queries: APIQuery):
+        self.queries = queries
+        # used to label metrics
+        self.name = '+'.join(q.operation.name for q in queries)
+        self._parts: list[tuple[dict[str, str], builder.Field]] = []
+        self._in_flight: dict[tuple, asyncio.Task] = {}
+        for i, q in enumerate(queries):
+            if q.check_more:
+                raise ValueError('Paginated queries cannot be combined!')
+            if q.operation.kind != 'query':
+                raise ValueError('Only queries can be combined!')
+            if len(q.operation.selections) != 1:
+                raise ValueError('Only queries with a single top level field can be combined!')
+            prefix = f'q{i}_'
+            self._parts.append(({f'{prefix}{k}': v for k, v in q.operation.variables.items()},
+                                _aliased(q.operation.selections[0], prefix, f'q{i}')))
+
+    @functools.cache
+    def _document(self, indices: tuple[int, ...]) -> str:
+        variables = {k: v for i in indices for k, v in self._parts[i][0].items()}
+        return builder.Query('combined', variables, *(self._parts[i][1] for i in indices)).text
+
+    async def _fetch(self, session: aiohttp.ClientSession, api_key: str, indices: tuple[int, ...],
+                     variables: list[dict[str, Any]], priority: Priority) -> dict[str, Any]:
+        payload = {'query': self._document(indices),
+                   'variables': {f'q{i}_{k}': v for i in indices for k, v in variables[i].items()}}
+        data = await _post(session, api_key, payload, priority=priority, name=self.name)
+        for i in indices:
+            q = self.queries[i]
+            if q.cache_ttl is not None:
+                q.misses += 1
+                q._put(q._cache_key(api_key, variables[i]), copy.deepcopy(data[f'q{i}']))
+        return data
+
+    async def query(self, session: aiohttp.ClientSession, *variables: dict[str, Any],
+                    api_key: str = config.api_key, priority: Priority = Priority.INTERACTIVE) -> tuple[Any, ...]:
+        """
+        Calls the API once for all the queries, returning a tuple of their results.
+        The variables for each query should be given as dicts in the same order as the queries,
+        trailing queries without variables can be left out.
+        """
+        variables = [q._normalise(v) for q, v in itertools.zip_longest(self.queries, variables, fillvalue={})]
+        results: list[Any] = [None] * len(self.queries)
+        fetching = []
+        for i, (q, v) in enumerate(zip(self.queries, variables)):
+            if q.cache_ttl is not None and (data := q._get_cached(q._cache_key(api_key, v))) is not _missing:
+                results[i] = data
+            else:
+                fetching.append(i)
+
+        if fetching:
+            indices = tuple(fetching)
+            key = (api_key, tuple(APIQuery._cache_key(api_key, variables[i])[1] for i in indices), indices)
+            task = self._in_flight.get(key)
+            if task is None:
+                task = self._in_flight[key] = asyncio.create_task(
+                    self._fetch(session, api_key, indices, variables, priority))
+                task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            data = copy.deepcopy(await asyncio.shield(task))
+            for i in fetching:
+                results[i] = data[f'q{i}']
+                if audit.enabled:
+                    results[i] = audit.wrap(self.queries[i].operation.name, results[i])
+        return tuple(results)
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import collections
+import copy
+import os
+from typing import Any
+
+__all__ = ('AuditDict', 'wrap', 'report', 'reset')
+
+# when enabled, query results are wrapped to track which of their fields are read
+enabled = bool(os.environ.get('PNW_QUERY_AUDIT'))
+
+# operation name to the fields fetched and the fields read, as dotted paths
+_fetched: collections.defaultdict[str, set[str]] = collections.defaultdict(set)
+_read: collections.defaultdict[str, set[str]] = collections.defaultdict(set)
+
+
+class AuditDict(dict):
+    """A dict recording the keys read from it."""
+    __slots__ = ('_operation', '_path')
+
+    def __getitem__(self, key: str) -> Any:
+        value = super().__getitem__(key)
+        _read[self._operation].add(f'{self._path}{key}')
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def _read_all(self) -> None:
+        _read[self._operation].update(f'{self._path}{key}' for key in dict.keys(self))
+
+    def values(self):
+        self._read_all()
+        return super().values()
+
+    def items(self):
+        self._read_all()
+        return super().items()
+
+    def __iter__(self):
+        # overriding this stops ** unpacking from copying the values directly, so their reads are recorded
+        return super().__iter__()
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> AuditDict:
+        result = _audit_dict(self._operation, self._path)
+        for key, value in dict.items(self):
+            dict.__setitem__(result, key, copy.deepcopy(value, memo))
+        return result
+
+
+def _audit_dict(operation: str, path: str) -> AuditDict:
+    d = AuditDict()
+    d._operation = operation
+    d._path = path
+    return d
+
+
+def wrap(operation: str, data: Any, path: str = '') -> Any:
+    """Wraps the dicts in a query result, recording the fields in it as fetched."""
+    if isinstance(data, list):
+        return [wrap(operation, value, path) for value in data]
+    if not isinstance(data, dict):
+        return data
+    result = _audit_dict(operation, path)
+    for key, value in data.items():
+        _fetched[operation].add(f'{path}{key}')
+        dict.__setitem__(result, key, wrap(operation, value, f'{path}{key}.'))
+    return result
+
+
+def report() -> dict[str, list[str]]:
+    """The fields of each operation that were fetched but never read."""
+    return {op: unread for op, fetched in _fetched.items()
+            if (unread := sorted(f for f in fetched - _read[op] if not f.startswith('paginatorInfo')))}
+
+
+def reset() -> None:
+    _fetched.clear()
+    _read.clear()
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+from typing import Any
+
+import aiohttp
+
+from .api import APIQuery
+from .ratelimit import Priority
+from .. import config
+
+__all__ = ('BatchedQuery',)
+
+
+class BatchedQuery:
+    """
+    Merges lookups of single entities into one call of an underlying query which takes a list of ids.
+    Keys requested within [delay] seconds of each other are fetched together,
+    and each row is handed back to the callers that asked for it.
+    """
+
+    def __init__(self, query: APIQuery, key: str, field: str = 'id', delay: float = 0.005, max_batch: int = 500):
+        self.query = query
+        self.key = key
+        self.field = field
+        self.delay = delay
+        self.max_batch = max_batch
+        self._pending: dict[tuple[aiohttp.ClientSession, str, Priority], dict[int, asyncio.Future]] = {}
+        # batches being fetched, kept so that they are not garbage collected while running
+        self._tasks: set[asyncio.Task] = set()
+
+    async def load(self, session: aiohttp.ClientSession, key: int | str, *, api_key: str = config.api_key,
+                   priority: Priority = Priority.INTERACTIVE) -> dict[str, Any] | None:
+        """Get the row with the given key, or None if there is no such row."""
+        key = int(key)
+        group = (session, api_key, priority)
+        batch = self._pending.get(group)
+        if batch is None:
+            batch = self._pending[group] = {}
+            asyncio.get_running_loop().call_later(self.delay, self._dispatch, group)
+        future = batch.get(key)
+        if future is None:
+            future = batch[key] = asyncio.get_running_loop().create_future()
+        # copied as the same row may be given to several callers
+        return copy.deepcopy(await asyncio.shield(future))
+
+    def _dispatch(self, group: tuple[aiohttp.ClientSession, str, Priority]) -> None:
+        batch = self._pending.pop(group)
+        keys = list(batch)
+        for i in range(0, len(keys), self.max_batch):
+            task = asyncio.create_task(self._fetch(group, {k: batch[k] for k in keys[i:i + self.max_batch]}))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, group: tuple[aiohttp.ClientSession, str, Priority],
+                     futures: dict[int, asyncio.Future]) -> None:
+        session, api_key, priority = group
+        try:
+            data = await self.query.query(session, api_key=api_key, priority=priority, **{self.key: list(futures)})
+        except asyncio.CancelledError:
+            # such as when the bot is closing, the callers are cancelled too rather than left waiting forever
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures.values():
+                future.set_exception(e)
+            return
+
+        rows = {int(row[self.field]): row for row in (data if self.query.check_more else data['data'])}
+        for k, future in futures.items():
+            future.set_result(rows.get(k))
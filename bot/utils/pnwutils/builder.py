@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import functools
+from typing import Union
+
+__all__ = ('Field', 'Fragment', 'Query')
+
+Selection = Union[str, 'Field', 'Fragment']
+
+
+def _argument(value: str | int | float | bool) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+class Field:
+    """
+    A field to select, along with its own selections and arguments.
+    Arguments are written as given, so variables are passed as strings like '$nation_id'.
+    """
+    __slots__ = ('name', 'selections', 'arguments', 'alias')
+
+    def __init__(self, name: str, *selections: Selection, alias: str | None = None,
+                 **arguments: str | int | float | bool):
+        self.name = name
+        self.selections = selections
+        self.arguments = tuple((k, _argument(v)) for k, v in arguments.items())
+        self.alias = alias
+
+    def _key(self) -> tuple:
+        return self.name, self.selections, self.arguments, self.alias
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Field) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+
+class Fragment:
+    """A named set of selections on a type, shared between queries."""
+    __slots__ = ('name', 'on', 'selections')
+
+    def __init__(self, name: str, on: str, *selections: Selection):
+        self.name = name
+        self.on = on
+        self.selections = selections
+
+    def _key(self) -> tuple:
+        return self.name, self.on, self.selections
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Fragment) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+
+class Query:
+    """
+    A query document built from declared selections.
+    Fragments used anywhere in it are defined once after the operation.
+    """
+    __slots__ = ('name', 'variables', 'selections', 'kind')
+
+    def __init__(self, name: str, variables: dict[str, str], *selections: Selection, kind: str = 'query'):
+        self.name = name
+        # variable names (without the $) to their types, such as '[Int]'
+        self.variables = tuple(variables.items())
+        self.selections = selections
+        self.kind = kind
+
+    def _key(self) -> tuple:
+        return self.name, self.variables, self.selections, self.kind
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Query) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    @property
+    def text(self) -> str:
+        return _compile(self)
+
+
+def _render(selections: tuple[Selection, ...], depth: int, fragments: dict[str, Fragment]) -> list[str]:
+    indent = '    ' * depth
+    lines = []
+    for s in selections:
+        if isinstance(s, str):
+            lines.append(f'{indent}{s}')
+        elif isinstance(s, Fragment):
+            if fragments.setdefault(s.name, s) != s:
+                raise ValueError(f'Conflicting definitions of fragment {s.name}!')
+            lines.append(f'{indent}...{s.name}')
+        else:
+            head = f'{s.alias}: {s.name}' if s.alias else s.name
+            if s.arguments:
+                head += f'({", ".join(f"{k}: {v}" for k, v in s.arguments)})'
+            if s.selections:
+                lines.append(f'{indent}{head} {{')
+                lines.extend(_render(s.selections, depth + 1, fragments))
+                lines.append(f'{indent}}}')
+            else:
+                lines.append(f'{indent}{head}')
+    return lines
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(query: Query) -> str:
+    fragments: dict[str, Fragment] = {}
+    variables = f'({", ".join(f"${k}: {v}" for k, v in query.variables)})' if query.variables else ''
+    lines = [f'{query.kind} {query.name}{variables} {{', *_render(query.selections, 1, fragments), '}']
+    # fragments can use other fragments, so keep going until every one used has been defined
+    done = set()
+    while len(done) < len(fragments):
+        for name, fragment in list(fragments.items()):
+            if name in done:
+                continue
+            done.add(name)
+            lines.append(f'\nfragment {name} on {fragment.on} {{')
+            lines.extend(_render(fragment.selections, 1, fragments))
+            lines.append('}')
+    return '\n'.join(lines) + '\n'
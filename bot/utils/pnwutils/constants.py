@@ -1,9 +1,11 @@
+import os
 from typing import Final
 
 from .resources import Resources
 
 base_url: Final[str] = 'https://politicsandwar.com/'
-base_api_url: Final[str] = 'https://api.politicsandwar.com/graphql'
+# can be pointed at a local stand in for the API, such as the one in bench
+base_api_url: Final[str] = os.environ.get('PNW_API_URL', 'https://api.politicsandwar.com/graphql')
 market_res: Final[tuple[str, ...]] = Resources.all_res[1:]
 market_res_title: Final[tuple[str, ...]] = tuple(res.title() for res in market_res)
 
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+
+__all__ = ('Field', 'Operation', 'parse')
+
+# commas are insignificant in graphql, so they are skipped along with whitespace and comments
+_token_pattern = re.compile(r'\.\.\.|[{}()\[\]:!=$@]|"(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|\w+')
+_comment_pattern = re.compile(r'#[^\n]*')
+
+
+@dataclass
+class Field:
+    """A field in a selection set, along with its own selections if it is an object."""
+    name: str
+    alias: str | None = None
+    # the values of the arguments are kept as written, such as '$nation_id' or '500'
+    arguments: dict[str, str] = field(default_factory=dict)
+    selections: list[Field] = field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        """The key of this field in the response."""
+        return self.alias or self.name
+
+
+@dataclass
+class Operation:
+    """A query or mutation, with all fragments spread into its selections."""
+    kind: str
+    name: str | None
+    # variable names (without the $) to their types, such as '[Int]'
+    variables: dict[str, str]
+    selections: list[Field]
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.tokens = _token_pattern.findall(_comment_pattern.sub('', text))
+        self.pos = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self) -> str:
+        if (tok := self.peek()) is None:
+            raise ValueError('Unexpected end of query text!')
+        self.pos += 1
+        return tok
+
+    def expect(self, expected: str) -> None:
+        if (tok := self.next()) != expected:
+            raise ValueError(f'Expected {expected!r} in query text, found {tok!r}!')
+
+    def document(self) -> list[Operation]:
+        operations = []
+        fragments = {}
+        while (tok := self.peek()) is not None:
+            if tok == '{':
+                operations.append(Operation('query', None, {}, self.selection_set()))
+                continue
+            self.next()
+            if tok == 'fragment':
+                name = self.next()
+                self.expect('on')
+                self.next()
+                self.directives()
+                fragments[name] = self.selection_set()
+            elif tok in ('query', 'mutation', 'subscription'):
+                name = None if self.peek() in ('(', '{', '@') else self.next()
+                variables = self.variable_definitions() if self.peek() == '(' else {}
+                self.directives()
+                operations.append(Operation(tok, name, variables, self.selection_set()))
+            else:
+                raise ValueError(f'Unexpected {tok!r} in query text!')
+
+        for op in operations:
+            op.selections = _expand(op.selections, fragments, ())
+        return operations
+
+    def selection_set(self) -> list[Field]:
+        self.expect('{')
+        selections = []
+        while self.peek() != '}':
+            if self.peek() == '...':
+                self.next()
+                if self.peek() in ('on', '{', '@'):
+                    # inline fragment, its fields are merged in directly
+                    if self.peek() == 'on':
+                        self.next()
+                        self.next()
+                    self.directives()
+                    selections.extend(self.selection_set())
+                else:
+                    # fragment spreads are expanded once all fragments are known
+                    selections.append(Field(f'...{self.next()}'))
+                    self.directives()
+                continue
+            name = self.next()
+            alias = None
+            if self.peek() == ':':
+                self.next()
+                alias, name = name, self.next()
+            f = Field(name, alias)
+            if self.peek() == '(':
+                f.arguments = self.arguments()
+            self.directives()
+            if self.peek() == '{':
+                f.selections = self.selection_set()
+            selections.append(f)
+        self.next()
+        return selections
+
+    def arguments(self) -> dict[str, str]:
+        self.expect('(')
+        args = {}
+        while self.peek() != ')':
+            name = self.next()
+            self.expect(':')
+            args[name] = self.value()
+        self.next()
+        return args
+
+    def value(self) -> str:
+        tok = self.next()
+        if tok == '$':
+            return f'${self.next()}'
+        if tok in ('[', '{'):
+            close = ']' if tok == '[' else '}'
+            parts = []
+            while self.peek() != close:
+                if tok == '{':
+                    parts.append(f'{self.next()}: ')
+                    self.expect(':')
+                    parts[-1] += self.value()
+                else:
+                    parts.append(self.value())
+            self.next()
+            return f'{tok}{", ".join(parts)}{close}'
+        return tok
+
+    def variable_definitions(self) -> dict[str, str]:
+        self.expect('(')
+        variables = {}
+        while self.peek() != ')':
+            self.expect('$')
+            name = self.next()
+            self.expect(':')
+            variables[name] = self.type()
+            if self.peek() == '=':
+                self.next()
+                self.value()
+            self.directives()
+        self.next()
+        return variables
+
+    def type(self) -> str:
+        if self.peek() == '[':
+            self.next()
+            ty = f'[{self.type()}]'
+            self.expect(']')
+        else:
+            ty = self.next()
+        if self.peek() == '!':
+            self.next()
+            ty += '!'
+        return ty
+
+    def directives(self) -> None:
+        while self.peek() == '@':
+            self.next()
+            self.next()
+            if self.peek() == '(':
+                self.arguments()
+
+
+def _expand(selections: list[Field], fragments: dict[str, list[Field]], seen: tuple[str, ...]) -> list[Field]:
+    """Replaces fragment spreads with their fields, merging fields with the same key."""
+    merged: dict[str, Field] = {}
+    for f in selections:
+        if f.name.startswith('...'):
+            name = f.name[3:]
+            if name in seen:
+                raise ValueError(f'Fragment {name} spreads itself!')
+            try:
+                spread = _expand(fragments[name], fragments, seen + (name,))
+            except KeyError:
+                raise ValueError(f'Unknown fragment {name}!') from None
+        else:
+            spread = [Field(f.name, f.alias, f.arguments, _expand(f.selections, fragments, seen))]
+        for g in spread:
+            if (existing := merged.get(g.key)) is None:
+                merged[g.key] = g
+            elif g.selections:
+                existing.selections = _expand(existing.selections + g.selections, fragments, seen)
+    return list(merged.values())
+
+
+def parse(text: str) -> list[Operation]:
+    """Parses a graphql document, returning its operations."""
+    return _Parser(text).document()
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import enum
+import time
+from collections.abc import Mapping
+
+from .. import config
+
+__all__ = ('Priority', 'RateLimiter', 'get_limiter', 'stats')
+
+
+class Priority(enum.IntEnum):
+    """Lanes requests are scheduled in, lower values are served first."""
+    INTERACTIVE = 0
+    ALERT = 1
+    BACKGROUND = 2
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all requests made with one api key.
+    Requests only take a token when no request of a higher priority is waiting,
+    and background requests leave [reserve] tokens in the bucket for the other lanes.
+    The bucket holds [limit] tokens, regained over [window] seconds. Unless [follow_headers] is off, the limit and
+    the tokens left are kept in line with the rate limit headers the API sends back.
+    """
+
+    def __init__(self, limit: int = config.api_rate_limit, window: float = config.api_rate_window,
+                 reserve: int = 5, follow_headers: bool = True):
+        self.capacity = limit
+        self.window = window
+        # tokens regained per second
+        self.rate = limit / window
+        self.reserve = reserve
+        self.follow_headers = follow_headers
+        self.tokens = float(limit)
+        # the reset time of the window the last response was counted in
+        self._reset: float | None = None
+        self._updated = time.monotonic()
+        # monotonic time before which no requests should be made
+        self._blocked_until = 0.0
+        self._changed = asyncio.Event()
+
+        self.queued = dict.fromkeys(Priority, 0)
+        self.served = dict.fromkeys(Priority, 0)
+        self.total_wait = dict.fromkeys(Priority, 0.0)
+        self.max_wait = dict.fromkeys(Priority, 0.0)
+        self.throttled = 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _delay(self, priority: Priority, now: float) -> float | None:
+        """
+        Seconds to wait before a request of the given priority may be made, or 0 if it can be made now.
+        None means waiting until a request of a higher priority is served.
+        """
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if any(self.queued[p] for p in Priority if p < priority):
+            return None
+        needed = 1 + self.reserve * (priority is Priority.BACKGROUND)
+        return max(0., (needed - self.tokens) / self.rate)
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE) -> None:
+        """Wait until a request of the given priority can be made."""
+        start = time.monotonic()
+        self.queued[priority] += 1
+        try:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if (delay := self._delay(priority, now)) == 0:
+                    self.tokens -= 1
+                    break
+                try:
+                    # with no delay, this waits until woken by a change to the bucket or queues
+                    await asyncio.wait_for(self._changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.queued[priority] -= 1
+            self._notify()
+
+        waited = time.monotonic() - start
+        self.served[priority] += 1
+        self.total_wait[priority] += waited
+        self.max_wait[priority] = max(self.max_wait[priority], waited)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Syncs the bucket with the rate limit headers of a response."""
+        if not self.follow_headers:
+            return
+        if (limit := headers.get('X-RateLimit-Limit')) is not None and int(limit) != self.capacity:
+            self._refill(time.monotonic())
+            self.capacity = int(limit)
+            self.rate = self.capacity / self.window
+            self._notify()
+        if (remaining := headers.get('X-RateLimit-Remaining')) is None:
+            return
+        # reset is given as a unix timestamp
+        reset = headers.get('X-RateLimit-Reset')
+        reset = None if reset is None else float(reset)
+        if reset is not None and (self._reset is None or reset > self._reset):
+            # the first response of a new window, whose count is the one to go by
+            self._reset = reset
+            self.tokens = min(self.capacity, float(remaining))
+            self._notify()
+        else:
+            # responses of the same window can arrive out of order, so only the lowest count is trusted
+            self.tokens = min(self.tokens, float(remaining))
+        if int(remaining) <= 0 and reset is not None:
+            self._block(reset - time.time())
+
+    def throttle(self, retry_after: float) -> None:
+        """Stops all requests for [retry_after] seconds, after being rate limited."""
+        self.throttled += 1
+        self._block(retry_after)
+
+    def _block(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + max(0., seconds))
+        self._notify()
+
+    def stats(self) -> dict[str, dict[str, float | int | None]]:
+        return {
+            'bucket': {'tokens': round(self.tokens, 2), 'capacity': self.capacity, 'rate': round(self.rate, 2),
+                       'throttled': self.throttled,
+                       'blocked_for': round(max(0., self._blocked_until - time.monotonic()), 2)},
+            **{p.name.lower(): {
+                'queued': self.queued[p], 'served': self.served[p],
+                'avg_wait': self.total_wait[p] / self.served[p] if self.served[p] else 0.,
+                'max_wait': self.max_wait[p]
+            } for p in Priority}
+        }
+
+
+_limiters: dict[str, RateLimiter] = {}
+
+
+def get_limiter(api_key: str) -> RateLimiter:
+    """Get the rate limiter for the given api key."""
+    try:
+        return _limiters[api_key]
+    except KeyError:
+        limiter = _limiters[api_key] = RateLimiter()
+        return limiter
+
+
+def stats() -> list[dict[str, dict[str, float | int | None]]]:
+    """Stats of every rate limiter, without exposing the api keys they belong to."""
+    return [limiter.stats() for limiter in _limiters.values()]
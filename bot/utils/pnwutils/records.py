@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from collections.abc import Iterator, Sequence
+from typing import Any, ClassVar
+
+from . import graphql
+
+__all__ = ('Record', 'RecordList', 'record_type')
+
+
+class Record:
+    """
+    Base of the slotted classes made for the selections of a query, used in place of dicts to save memory.
+    Fields can be read as attributes or with subscripts, so code written for dicts keeps working.
+    """
+    __slots__ = ()
+    _fields: ClassVar[tuple[str, ...]] = ()
+    # fields with selections of their own, to the record type of their values
+    _nested: ClassVar[dict[str, type[Record]]] = {}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> Record:
+        self = cls.__new__(cls)
+        for name in cls._fields:
+            setattr(self, name, cls._convert(name, data.get(name), False))
+        return self
+
+    @classmethod
+    def _convert(cls, name: str, value: Any, pack: bool) -> Any:
+        if value is None or (sub := cls._nested.get(name)) is None:
+            return value
+        if isinstance(value, list):
+            return RecordList(sub, value)
+        return sub._pack(value) if pack else sub.from_dict(value)
+
+    @classmethod
+    def _pack(cls, data: dict[str, Any]) -> tuple:
+        """Turns a dict into a tuple of its values, which takes less memory than a record."""
+        return tuple(cls._convert(name, data.get(name), True) for name in cls._fields)
+
+    @classmethod
+    def _unpack(cls, values: tuple) -> Record:
+        self = cls.__new__(cls)
+        for name, value in zip(cls._fields, values):
+            if isinstance(value, tuple):
+                value = cls._nested[name]._unpack(value)
+            setattr(self, name, value)
+        return self
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._fields
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def keys(self) -> tuple[str, ...]:
+        return self._fields
+
+    def to_dict(self) -> dict[str, Any]:
+        return {name: (value.to_dict() if isinstance(value, Record) else
+                       [r.to_dict() for r in value] if isinstance(value, RecordList) else value)
+                for name, value in zip(self._fields, map(self.get, self._fields))}
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Record):
+            return NotImplemented
+        return self._fields == other._fields and all(self.get(f) == other.get(f) for f in self._fields)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({", ".join(f"{f}={self.get(f)!r}" for f in self._fields)})'
+
+
+class RecordList(Sequence):
+    """A nested list of records, kept as tuples and only turned into records when accessed."""
+    __slots__ = ('_type', '_rows')
+
+    def __init__(self, record: type[Record], rows: list[dict[str, Any]]):
+        self._type = record
+        self._rows = tuple(map(record._pack, rows))
+
+    def __getitem__(self, index: int | slice) -> Record | list[Record]:
+        if isinstance(index, slice):
+            return [self._type._unpack(row) for row in self._rows[index]]
+        return self._type._unpack(self._rows[index])
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __iter__(self) -> Iterator[Record]:
+        return map(self._type._unpack, self._rows)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, RecordList):
+            return self._type is other._type and self._rows == other._rows
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'RecordList({list(self)!r})'
+
+
+def record_type(selections: list[graphql.Field], name: str = 'Record') -> type[Record]:
+    """Makes a record type with the given selections as its fields."""
+    fields = tuple(f.key for f in selections)
+    nested = {f.key: record_type(f.selections, f'{name}_{f.key}') for f in selections if f.selections}
+    return type(name, (Record,), {'__slots__': fields, '_fields': fields, '_nested': nested})
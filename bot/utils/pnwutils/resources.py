@@ -64,8 +64,14 @@ class Resources:
             if (res_amount := self[res_name])
         }
 
-    def to_row(self) -> str:
-        return f'ROW({",".join(map(str, self.values()))})'
+    def to_record(self) -> tuple[int, ...]:
+        """The amounts in order, which asyncpg binds as a `resources` value, such as in `balance + $1`."""
+        return tuple(self.values())
+
+    @classmethod
+    def from_record(cls, record: Iterable[int]) -> Resources:
+        """Makes an instance of this class from a `resources` value fetched from the database."""
+        return cls(*record)
 
     def update(self, **kwargs):
         for k, v in kwargs.items():
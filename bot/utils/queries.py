@@ -1,4 +1,17 @@
-from .pnwutils.api import APIQuery
+from __future__ import annotations
+
+from .pnwutils.api import APIQuery, CombinedQuery
+from .pnwutils.batch import BatchedQuery
+from .pnwutils.builder import Field, Fragment, Query
+from .pnwutils.resources import Resources
+
+
+def nation_by_id_query(name: str, *fields: str | Field | Fragment, **kwargs) -> APIQuery:
+    """Builds a query for the given fields of nations, looked up by a list of ids."""
+    return APIQuery(Query(name, {'nation_id': '[Int]'}, Field(
+        'nations', Field('data', 'id', *fields), id='$nation_id', first=500
+    )).text, nation_id=[int], **kwargs)
+
 
 # mutations
 withdrawal_query_text = '''
@@ -96,40 +109,13 @@ query finance_nation_info($nation_id: [Int]) {
 finance_nation_info_query = APIQuery(finance_nation_info_query_text, nation_id=int)
 
 # bank_cog.py
-resources_fragment = '''
-fragment resources on Bankrec {
-    money
-    coal
-    oil
-    uranium
-    iron
-    bauxite
-    lead
-    gasoline
-    munitions
-    steel
-    aluminum
-    food
-}
-'''
+resources_fragment = Fragment('resources', 'Bankrec', *Resources.all_res)
 
-bank_transactions_query_text = '''
-query bank_transactions($alliance_id: [Int]) {
-    alliances(id: $alliance_id, first: 1) {
-        data {
-            bankrecs {
-                sender_id
-                sender_type
-                recipient_id
-                recipient_type
-                date
-                ...resources
-            }
-        }
-    }
-}
-''' + resources_fragment
-bank_transactions_query = APIQuery(bank_transactions_query_text, alliance_id=int)
+bank_transactions_query = APIQuery(Query('bank_transactions', {'alliance_id': '[Int]'}, Field(
+    'alliances', Field('data', Field(
+        'bankrecs', 'sender_id', 'sender_type', 'recipient_id', 'recipient_type', 'date', resources_fragment
+    )), id='$alliance_id', first=1
+)).text, alliance_id=int)
 
 # some notes on the format of this data
 # id: unique id of this transaction
@@ -145,40 +131,15 @@ bank_transactions_query = APIQuery(bank_transactions_query_text, alliance_id=int
 # but converse is not true due to the existence of inter-alliance transactions
 # if stype/rtype is 2 then sid/rid is definitely the alliance id unless both stype/rtype is 2
 
-bank_revenue_query_text = '''
-query bank_revenue_query($alliance_id: [Int], $after: DateTime) {
-    alliances(id: $alliance_id) {
-        data {
-            taxrecs(after: $after) {
-                ...resources
-            }
-        }
-    }
-}
-''' + resources_fragment
-bank_revenue_query = APIQuery(bank_revenue_query_text, alliance_id=int, after=str)
+bank_revenue_query = APIQuery(Query('bank_revenue_query', {'alliance_id': '[Int]', 'after': 'DateTime'}, Field(
+    'alliances', Field('data', Field('taxrecs', resources_fragment, after='$after')), id='$alliance_id'
+)).text, alliance_id=int, after=str)
 
-nation_name_query_text = '''
-query nation_name($nation_id: [Int]) {
-    nations(id: $nation_id, first: 1) {
-        data {
-            nation_name
-        }
-    }
-}
-'''
-nation_name_query = APIQuery(nation_name_query_text, nation_id=int)
+nation_name_query = nation_by_id_query('nation_name', 'nation_name')
+nation_name_batch = BatchedQuery(nation_name_query, 'nation_id')
 
-leader_name_query_text = '''
-query nation_name($nation_id: [Int]) {
-    nations(id: $nation_id, first: 1) {
-        data {
-            leader_name
-        }
-    }
-}
-'''
-leader_name_query = APIQuery(leader_name_query_text, nation_id=int)
+leader_name_query = nation_by_id_query('leader_name', 'leader_name')
+leader_name_batch = BatchedQuery(leader_name_query, 'nation_id')
 
 bank_info_query_text = '''
 query bank_info($alliance_id: [Int]) {
@@ -200,7 +161,7 @@ query bank_info($alliance_id: [Int]) {
     }
 }
 '''
-bank_info_query = APIQuery(bank_info_query_text, alliance_id=int)
+bank_info_query = APIQuery(bank_info_query_text, cache_ttl=10, alliance_id=int)
 
 alliance_name_query_text = '''
 query alliance_name($alliance_id: [Int]) {
@@ -262,7 +223,7 @@ query treasures_query {
     }
 }
 '''
-treasures_query = APIQuery(treasures_query_text)
+treasures_query = APIQuery(treasures_query_text, cache_ttl=300)
 
 colours_query_text = '''
 query colour_query {
@@ -272,7 +233,7 @@ query colour_query {
     }
 }
 '''
-colours_query = APIQuery(colours_query_text)
+colours_query = APIQuery(colours_query_text, cache_ttl=300)
 
 nation_revenue_query_text = '''query revenue_query($nation_ids: [Int], $tax_ids: [Int]) {
     nations(id: $nation_ids, tax_id: $tax_ids) {
@@ -349,25 +310,20 @@ nation_revenue_query_text = '''query revenue_query($nation_ids: [Int], $tax_ids:
 '''
 nation_revenue_query = APIQuery(nation_revenue_query_text, nation_ids=[int], tax_ids=[int])
 
+# everything needed to calculate revenue, in one request
+revenue_query = CombinedQuery(nation_revenue_query, treasures_query, colours_query)
+
 # util.py
 
-nation_register_query_text = '''
-query nation_info($nation_id: [Int]) {
-    nations(id: $nation_id, first: 1) {
-        data {
-            alliance_id
-            discord
-        }
-    }
-}
-'''
-nation_register_query = APIQuery(nation_register_query_text, nation_id=int)
+nation_register_query = nation_by_id_query('nation_register', 'alliance_id', 'discord')
+nation_register_batch = BatchedQuery(nation_register_query, 'nation_id')
 
 alliance_member_res_query_text = '''
 query alliance_members_res($alliance_id: [Int], $page: Int) {
     nations(alliance_id: $alliance_id, first: 500, page: $page, vmode: false) {
         paginatorInfo {
             hasMorePages
+            lastPage
         }
         data {
             alliance_position
@@ -383,13 +339,14 @@ query alliance_members_res($alliance_id: [Int], $page: Int) {
     }
 }
 '''
-alliance_member_res_query = APIQuery(alliance_member_res_query_text, True, alliance_id=int)
+alliance_member_res_query = APIQuery(alliance_member_res_query_text, True, records=True, alliance_id=int)
 
 alliance_activity_query_text = '''
 query alliance_activity($alliance_id: [Int], $page: Int) {
     nations(alliance_id: $alliance_id, first: 500, page: $page, vmode: false) {
         paginatorInfo {
             hasMorePages
+            lastPage
         }
         data {
             alliance_position
@@ -443,7 +400,7 @@ query nation_military_query($nation_id: [Int]) {
 military_query = APIQuery(military_query_text, nation_id=int)
 
 alliance_tiers_query_text = '''
-query nation_discord($alliance_ids: [Int]) {
+query alliance_tiers($alliance_ids: [Int]) {
     alliances(id: $alliance_ids) {
         data {
             nations {
@@ -469,6 +426,7 @@ query global_trade_prices($page: Int) {
         }
         paginatorInfo {
             hasMorePages
+            lastPage
         }
     }
 }
@@ -478,157 +436,61 @@ global_trade_prices_query = APIQuery(global_trade_prices_query_text, True)
 # war related queries
 # both detectors and war.py
 
-nation_war_data_fragment = '''
-fragment war_data on War {
-    id
-    date
-    winner_id
-    turns_left
-    war_type
-    att_id
-    def_id
-    att_resistance
-    def_resistance
-    att_points
-    def_points
-}
-
-fragment nation_data on Nation {
-    id
-    nation_name
-    score
-    num_cities
-    war_policy
-    soldiers
-    tanks
-    aircraft
-    ships
-    missiles
-    nukes
-    beige_turns
-    alliance_position
-    alliance {
-        id
-        name
-    }
-}
-'''
-
-new_war_query_text = '''
-query new_war($war_id: [Int]) {
-    wars(id: $war_id, first: 1) {
-        data {
-            id
-            turns_left
-            war_type
-            att_id
-            def_id
-            attacker {
-                ...new_war_nation_data
-            }
-            defender {
-                ...new_war_nation_data
-            }
-        }
-    }
-}
-
-fragment new_war_nation_data on Nation {
-    nation_name
-    score
-    beige_turns
-    num_cities
-    war_policy
-    soldiers
-    tanks
-    aircraft
-    ships
-    missiles
-    nukes
-    alliance_position
-    alliance {
-        id
-        name
-    }
-}
-'''
-new_war_query = APIQuery(new_war_query_text, war_id=int)
-
-update_war_query_text = '''
-query update_war($war_id: [Int]) {
-    wars(id: $war_id, first: 1) {
-        data {
-            ...war_data
-            attacker {
-                ...nation_data
-            }
-            defender {
-                ...nation_data
-            }
-            attacks(min_id: 0) {
-                type
-                date
-            }
-        }
-    }
-}
-''' + nation_war_data_fragment
-update_war_query = APIQuery(update_war_query_text, war_id=int)
-
-individual_war_query_text = '''
-query individual_war($war_id: [Int]) {
-    wars(id: $war_id, active: false) {
-        data {
-            ...war_data
-            attacker {
-                ...nation_data
-                population
-            }
-            defender {
-                ...nation_data
-                population
-            }
-            attacks(min_id: 0) {
-                type
-                date
-            }
-        }
-    }
-}
-''' + nation_war_data_fragment
-individual_war_query = APIQuery(individual_war_query_text, war_id=int)
-
-nation_active_wars_query_text = '''
-query nation_active_wars($nation_id: [Int]) {
-    wars(nation_id: $nation_id) {
-        data {
-            ...war_data
-            attacker {
-                ...nation_data
-            }
-            defender {
-                ...nation_data
-            }
-            attacks(min_id: 0) {
-                type
-                date
-            }
-        }
-    }
-}
-''' + nation_war_data_fragment
-nation_active_wars_query = APIQuery(nation_active_wars_query_text, nation_id=int)
-
-nation_score_query_text = '''
-query nation_score_query($nation_id: [Int]) {
-    nations(id: $nation_id) {
-        data {
-            score
-        }
-    }
-}
-'''
-nation_score_query = APIQuery(nation_score_query_text, nation_id=int)
+war_data_fragment = Fragment(
+    'war_data', 'War',
+    'id', 'date', 'winner_id', 'turns_left', 'war_type', 'att_id', 'def_id',
+    'att_resistance', 'def_resistance', 'att_points', 'def_points'
+)
+nation_data_fragment = Fragment(
+    'nation_data', 'Nation',
+    'id', 'nation_name', 'score', 'num_cities', 'war_policy', 'soldiers', 'tanks', 'aircraft', 'ships',
+    'missiles', 'nukes', 'beige_turns', 'alliance_position', Field('alliance', 'id', 'name')
+)
+war_attacks_field = Field('attacks', 'type', 'date', min_id=0)
+
+new_war_query = APIQuery(Query('new_war', {'war_id': '[Int]'}, Field(
+    'wars', Field(
+        'data', 'id', 'turns_left', 'war_type', 'att_id', 'def_id',
+        Field('attacker', nation_data_fragment), Field('defender', nation_data_fragment)
+    ), id='$war_id', first=500
+)).text, war_id=[int])
+new_war_batch = BatchedQuery(new_war_query, 'war_id')
+
+update_war_query = APIQuery(Query('update_war', {'war_id': '[Int]'}, Field(
+    'wars', Field(
+        'data', war_data_fragment, Field('attacker', nation_data_fragment), Field('defender', nation_data_fragment),
+        war_attacks_field
+    ), id='$war_id', first=500
+)).text, war_id=[int])
+update_war_batch = BatchedQuery(update_war_query, 'war_id')
+
+individual_war_query = APIQuery(Query('individual_war', {'war_id': '[Int]'}, Field(
+    'wars', Field(
+        'data', war_data_fragment, Field('attacker', nation_data_fragment, 'population'),
+        Field('defender', nation_data_fragment, 'population'), war_attacks_field
+    ), id='$war_id', active=False
+)).text, war_id=int)
+
+nation_active_wars_query = APIQuery(Query('nation_active_wars', {'nation_id': '[Int]'}, Field(
+    'wars', Field(
+        'data', war_data_fragment, Field('attacker', nation_data_fragment), Field('defender', nation_data_fragment),
+        war_attacks_field
+    ), nation_id='$nation_id'
+)).text, nation_id=int)
+
+# the active wars of an alliance, with everything the war detector shows about them
+alliance_wars_query = APIQuery(Query('alliance_wars', {'alliance_id': '[Int]', 'page': 'Int'}, Field(
+    'wars', Field('paginatorInfo', 'hasMorePages', 'lastPage'), Field(
+        'data', war_data_fragment, 'att_alliance_id', 'def_alliance_id',
+        Field('attacker', nation_data_fragment), Field('defender', nation_data_fragment)
+    ), alliance_id='$alliance_id', active=True, first=500, page='$page'
+)).text, True, alliance_id=[int])
+
+nation_data_query = nation_by_id_query('nation_data', nation_data_fragment)
+nation_data_batch = BatchedQuery(nation_data_query, 'nation_id')
+
+nation_score_query = nation_by_id_query('nation_score_query', 'score', cache_ttl=60)
+nation_score_batch = BatchedQuery(nation_score_query, 'nation_id')
 
 find_slots_query_text = '''
 query find_slots_query($alliance_ids: [Int], $min_score: Float, $max_score: Float, $page: Int) {
@@ -636,6 +498,7 @@ query find_slots_query($alliance_ids: [Int], $min_score: Float, $max_score: Floa
             min_score: $min_score, max_score: $max_score, page: $page) {
         paginatorInfo {
             hasMorePages
+            lastPage
         }
         data {
             id
@@ -651,10 +514,11 @@ query find_slots_query($alliance_ids: [Int], $min_score: Float, $max_score: Floa
     }
 }
 '''
-find_slots_query = APIQuery(find_slots_query_text, True, alliance_ids=[int], min_score=float, max_score=float)
+find_slots_query = APIQuery(find_slots_query_text, True, records=True,
+                             alliance_ids=[int], min_score=float, max_score=float)
 
 find_in_range_query_text = '''
-query find_slots_query($alliance_id: [Int], $min_score: Float, $max_score: Float, $page: Int) {
+query find_in_range($alliance_id: [Int], $min_score: Float, $max_score: Float, $page: Int) {
     nations(alliance_id: $alliance_id, first: 500,
             min_score: $min_score, max_score: $max_score, page: $page) {
         data {
@@ -682,14 +546,4 @@ spy_sat_query = APIQuery(spy_sat_query_text, alliance_id=int, min_score=float, m
 
 # applications.py
 
-acceptance_query_text = '''
-query acceptance_data($nation_id: [Int]) {
-    nations(id: $nation_id, first: 1) {
-        data {
-            nation_name
-            leader_name
-        }
-    }
-}
-'''
-acceptance_query = APIQuery(acceptance_query_text, nation_id=int)
+acceptance_query = nation_by_id_query('acceptance_data', 'nation_name', 'leader_name')
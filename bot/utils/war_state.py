@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import time
+from typing import Any
+
+import aiohttp
+import pnwkit
+
+from . import config, databases, pnwutils, queries
+
+__all__ = ('WarStore', 'BreakpointTracker', 'war_fields')
+
+# the fields of a war kept by the store and checkpointed, its nations are kept separately
+war_fields = ('id', 'date', 'winner_id', 'turns_left', 'war_type', 'att_id', 'def_id', 'att_alliance_id',
+              'def_alliance_id', 'att_resistance', 'def_resistance', 'att_points', 'def_points')
+_id_fields = ('id', 'winner_id', 'att_id', 'def_id', 'att_alliance_id', 'def_alliance_id')
+
+
+def _normalise(war: dict[str, Any] | pnwkit.War) -> dict[str, Any]:
+    """Puts a war from the API or from a subscription payload in the same form, that of update_war_query."""
+    state = {field: war.get(field) for field in war_fields}
+    for field in _id_fields:
+        if state[field] is not None:
+            state[field] = int(state[field])
+    if isinstance(state['date'], datetime.datetime):
+        state['date'] = state['date'].isoformat()
+    # payloads give the war type as an enum
+    state['war_type'] = getattr(state['war_type'], 'name', state['war_type'])
+    return state
+
+
+def _row(state: dict[str, Any]) -> tuple:
+    return tuple(datetime.datetime.fromisoformat(state[f]) if f == 'date' else state[f] for f in war_fields)
+
+
+class WarStore:
+    """
+    The active wars of an alliance by id, kept up to date from subscription payloads instead of being fetched again.
+    Nations are only fetched when a war needs one that is not known or was fetched over [nation_ttl] seconds ago.
+    Changes are written to [table] by checkpoint(), so that wars can be restored by load() after a restart.
+    """
+    __slots__ = ('table', 'alliance_id', 'nation_ttl', 'wars', 'nations', '_dirty', '_ended')
+
+    def __init__(self, table: databases.Table, alliance_id: int = config.alliance_id, nation_ttl: float = 300):
+        self.table = table
+        self.alliance_id = alliance_id
+        self.nation_ttl = nation_ttl
+        self.wars: dict[int, dict[str, Any]] = {}
+        # nation id to when it was fetched and its data
+        self.nations: dict[int, tuple[float, dict[str, Any]]] = {}
+        self._dirty: set[int] = set()
+        self._ended: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.wars)
+
+    def __contains__(self, war_id: int) -> bool:
+        return war_id in self.wars
+
+    def get(self, war_id: int) -> dict[str, Any] | None:
+        return self.wars.get(war_id)
+
+    def _remove(self, war_id: int) -> None:
+        del self.wars[war_id]
+        self._dirty.discard(war_id)
+        self._ended.add(war_id)
+
+    def _put(self, state: dict[str, Any]) -> tuple[dict[str, Any] | None, dict[str, Any] | None]:
+        previous = self.wars.get(state['id'])
+        if previous is not None:
+            # fields missing from a payload keep their last known values
+            state = {k: previous[k] if v is None else v for k, v in state.items()}
+        ended = state['winner_id'] or (state['turns_left'] is not None and state['turns_left'] <= 0)
+        if ended or self.alliance_id not in (state['att_alliance_id'], state['def_alliance_id']):
+            if previous is not None:
+                self._remove(state['id'])
+            return previous, None
+        self.wars[state['id']] = state
+        self._dirty.add(state['id'])
+        self._ended.discard(state['id'])
+        return previous, state
+
+    def apply(self, war: pnwkit.War) -> tuple[dict[str, Any] | None, dict[str, Any] | None]:
+        """
+        Updates the store from a subscription payload.
+        Returns the war as it was before and as it is now, each None if the war was not or is no longer active.
+        """
+        return self._put(_normalise(war))
+
+    async def seed(self, session: aiohttp.ClientSession) -> int:
+        """
+        Replaces the wars with the active wars of the alliance from the API, along with their nations.
+        The pages are fetched in the background lane, so that they do not hold up alerts and commands.
+        """
+        seen = set()
+        async for war in queries.alliance_wars_query.stream(session, alliance_id=[self.alliance_id],
+                                                            priority=pnwutils.ratelimit.Priority.BACKGROUND):
+            now = time.monotonic()
+            for side in (war.pop('attacker'), war.pop('defender')):
+                if side is not None:
+                    self.nations[int(side['id'])] = (now, side)
+            _, state = self._put(_normalise(war))
+            if state is not None:
+                seen.add(state['id'])
+        for war_id in self.wars.keys() - seen:
+            self._remove(war_id)
+        return len(self.wars)
+
+    async def nation(self, session: aiohttp.ClientSession, nation_id: int) -> dict[str, Any] | None:
+        """The data of a nation, as in nation_data_fragment, fetched only if missing or stale."""
+        entry = self.nations.get(nation_id)
+        if entry is not None and time.monotonic() - entry[0] < self.nation_ttl:
+            return entry[1]
+        data = await queries.nation_data_batch.load(session, nation_id, priority=pnwutils.ratelimit.Priority.ALERT)
+        if data is not None:
+            self.nations[nation_id] = (time.monotonic(), data)
+        return data
+
+    async def complete(self, session: aiohttp.ClientSession, war_id: int) -> dict[str, Any] | None:
+        """The war with its attacker and defender, in the form of update_war_query, or None if it is not active."""
+        war = self.wars.get(war_id)
+        if war is None:
+            return None
+        attacker, defender = await asyncio.gather(self.nation(session, war['att_id']),
+                                                  self.nation(session, war['def_id']))
+        if attacker is None or defender is None:
+            return None
+        return {**war, 'attacker': attacker, 'defender': defender}
+
+    async def load(self) -> None:
+        """Restores the wars from the last checkpoint, which should be done before any payloads are applied."""
+        for rec in await self.table.select(*war_fields):
+            state = dict(rec)
+            state['date'] = state['date'].isoformat()
+            self.wars[state['id']] = state
+
+    async def checkpoint(self) -> None:
+        """Writes the wars changed since the last checkpoint, deleting those that have ended."""
+        dirty, self._dirty = self._dirty, set()
+        ended, self._ended = self._ended, set()
+        try:
+            if dirty:
+                await self.table.upsert_many(*war_fields, values=[
+                    _row(self.wars[i]) for i in dirty if i in self.wars], conflict=('id',))
+            if ended:
+                await self.table.delete().where_any(id=ended)
+        except BaseException:
+            # try again on the next checkpoint
+            self._dirty |= dirty
+            self._ended |= ended
+            raise
+        # nations are only kept while one of their wars is
+        in_war = {w[f] for w in self.wars.values() for f in ('att_id', 'def_id')}
+        self.nations = {k: v for k, v in self.nations.items() if k in in_war}
+
+
+class BreakpointTracker:
+    """
+    The resistance below which each war next alerts, so that a war only alerts again after losing another 20.
+    Entries are dropped when their war ends, or by expire() once it would have expired after 60 turns.
+    Changes are written to [table] in batches by flush(), and restored by load() after a restart.
+    """
+    __slots__ = ('table', 'breakpoints', '_dirty', '_removed')
+
+    def __init__(self, table: databases.Table):
+        self.table = table
+        # war id to its breakpoint and when the war expires, as a timestamp
+        self.breakpoints: dict[int, tuple[int, float]] = {}
+        self._dirty: set[int] = set()
+        self._removed: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.breakpoints)
+
+    def cross(self, war_id: int, resistance: int, date: str) -> bool:
+        """
+        Whether [resistance] has fallen to the breakpoint of the war that started at [date], lowering it if so.
+        The first time a war is seen its breakpoint is set below [resistance], so it alerts straight away.
+        """
+        if (entry := self.breakpoints.get(war_id)) is not None:
+            if resistance > entry[0]:
+                return False
+            self.breakpoints[war_id] = entry[0] - 20, entry[1]
+        else:
+            expires = pnwutils.time_after_turns(60, datetime.datetime.fromisoformat(date)).timestamp()
+            self.breakpoints[war_id] = (resistance // 20) * 20, expires
+        self._dirty.add(war_id)
+        self._removed.discard(war_id)
+        return True
+
+    def discard(self, war_id: int) -> None:
+        if self.breakpoints.pop(war_id, None) is not None:
+            self._dirty.discard(war_id)
+            self._removed.add(war_id)
+
+    def expire(self) -> None:
+        """Drops the breakpoints of wars that have expired."""
+        now = time.time()
+        for war_id in [i for i, (_, expires) in self.breakpoints.items() if expires <= now]:
+            self.discard(war_id)
+
+    async def load(self) -> None:
+        """
+        Restores the breakpoints from the last flush, merged with any set since.
+        The lower breakpoint of the two is kept, so that a war does not alert again for resistance it already has.
+        """
+        for rec in await self.table.select('war_id', 'breakpoint', 'expires'):
+            if rec['war_id'] in self._removed:
+                continue
+            entry = self.breakpoints.get(rec['war_id'])
+            if entry is None or rec['breakpoint'] < entry[0]:
+                self.breakpoints[rec['war_id']] = rec['breakpoint'], rec['expires'].timestamp()
+        self.expire()
+
+    async def flush(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        removed, self._removed = self._removed, set()
+        try:
+            if dirty:
+                rows = [(i, *self.breakpoints[i]) for i in dirty if i in self.breakpoints]
+                await self.table.upsert_many('war_id', 'breakpoint', 'expires', values=[
+                    (i, b, datetime.datetime.fromtimestamp(expires, datetime.timezone.utc)) for i, b, expires in rows
+                ], conflict=('war_id',))
+            if removed:
+                await self.table.delete().where_any(war_id=removed)
+        except BaseException:
+            # try again on the next flush
+            self._dirty |= dirty
+            self._removed |= removed
+            raise
@@ -9,6 +9,9 @@ from bot.utils import config
 
 cog_logger = logging.getLogger('cogs')
 cog_logger.addHandler(logging.FileHandler('logs.txt'))
+# slow queries and the like
+database_logger = logging.getLogger('bot.utils.databases')
+database_logger.addHandler(logging.FileHandler('logs.txt'))
 
 
 async def main():
@@ -0,0 +1,5 @@
+import os
+
+# the config reads these when imported, the tests never use them
+for _key in ('BOT_TOKEN', 'API_KEY', 'API_KEY_MUT', 'OFFSHORE_API_KEY', 'DB_URL'):
+    os.environ.setdefault(f'MYSQLCONNSTR_{_key}', 'test')
@@ -0,0 +1,110 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from bot.utils.pnwutils import api, graphql
+from bot.utils.pnwutils.builder import Field, Fragment, Query
+
+city_fragment = Fragment('city_fields', 'City', 'id', 'infrastructure')
+cities_query = api.APIQuery(Query('cities', {'id': '[Int]'}, Field(
+    'cities', Field('data', city_fragment), id='$id')).text, id=[int])
+colours_query = api.APIQuery(Query('colours', {}, Field('colors', 'color', 'turn_bonus')).text, cache_ttl=60)
+pages_query = api.APIQuery(Query('pages', {'page': 'Int'}, Field(
+    'nations', Field('paginatorInfo', 'hasMorePages', 'lastPage'), Field('data', 'id'), page='$page')).text, True)
+
+
+class TestPaginatedQuery(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.started = []
+        self.cancelled = []
+
+    async def page(self, session, api_key, variables, priority=None, last=5, failing=None):
+        page = variables.get('page', 1)
+        self.started.append(page)
+        try:
+            await asyncio.sleep(0.01 if page != failing else 0)
+        except asyncio.CancelledError:
+            self.cancelled.append(page)
+            raise
+        if page == failing:
+            raise api.APIError('failed')
+        return {'paginatorInfo': {'hasMorePages': page < last, 'lastPage': last}, 'data': [{'id': page}]}
+
+    async def test_pages_in_order(self):
+        with mock.patch.object(pages_query, '_query', self.page):
+            result = await pages_query.query(None)
+        self.assertEqual([r['id'] for r in result], [1, 2, 3, 4, 5])
+
+    async def test_failed_page_cancels_others(self):
+        async def page(*args, **kwargs):
+            return await self.page(*args, **kwargs, failing=3)
+        with mock.patch.object(pages_query, '_query', page):
+            with self.assertRaises(api.APIError):
+                await pages_query.query(None)
+        self.assertEqual(sorted(self.cancelled), [2, 4, 5])
+
+    async def test_gather_or_cancel_results_in_order(self):
+        async def value(v, delay):
+            await asyncio.sleep(delay)
+            return v
+        self.assertEqual(await api._gather_or_cancel(value(1, 0.02), value(2, 0)), [1, 2])
+
+
+class TestCombinedQuery(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.combined = api.CombinedQuery(cities_query, colours_query)
+        colours_query.clear_cache()
+        self.requests = []
+
+    async def post(self, session, api_key, payload, bot_headers=False, priority=None, name=''):
+        self.requests.append(payload)
+        await asyncio.sleep(0)
+        data = {}
+        if 'q0' in payload['query']:
+            data['q0'] = {'data': [{'id': i, 'infrastructure': 100} for i in payload['variables']['q0_id']]}
+        if 'q1' in payload['query']:
+            data['q1'] = [{'color': 'aqua', 'turn_bonus': 5}]
+        return data
+
+    def test_document_renames_variables(self):
+        operation, = graphql.parse(self.combined._document((0, 1)))
+        self.assertEqual(operation.variables, {'q0_id': '[Int]'})
+        self.assertEqual([f.key for f in operation.selections], ['q0', 'q1'])
+        self.assertEqual(operation.selections[0].arguments, {'id': '$q0_id'})
+
+    def test_document_spreads_fragments(self):
+        # fragments are spread into the fields, so a request without the cities leaves them out entirely
+        self.assertNotIn('fragment', self.combined._document((0, 1)))
+        self.assertIn('infrastructure', self.combined._document((0,)))
+        self.assertNotIn('infrastructure', self.combined._document((1,)))
+
+    async def test_split_and_cached(self):
+        with mock.patch.object(api, '_post', self.post):
+            cities, colours = await self.combined.query(None, {'id': [1, 2]})
+            self.assertEqual([c['id'] for c in cities['data']], [1, 2])
+            self.assertEqual(colours, [{'color': 'aqua', 'turn_bonus': 5}])
+            # the colours are cached, so only the cities are requested again
+            _, colours = await self.combined.query(None, {'id': [3]})
+        self.assertEqual(colours, [{'color': 'aqua', 'turn_bonus': 5}])
+        self.assertEqual(len(self.requests), 2)
+        self.assertNotIn('colors', self.requests[1]['query'])
+
+    async def test_concurrent_calls_share_request(self):
+        with mock.patch.object(api, '_post', self.post):
+            first, second, other = await asyncio.gather(
+                self.combined.query(None, {'id': [1]}), self.combined.query(None, {'id': [1]}),
+                self.combined.query(None, {'id': [2]}))
+        self.assertEqual(first, second)
+        self.assertIsNot(first[0], second[0])
+        self.assertEqual(other[0]['data'], [{'id': 2, 'infrastructure': 100}])
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.combined._in_flight, {})
+
+    def test_rejects_paginated(self):
+        paginated = api.APIQuery(Query('paged', {}, Field('nations', Field('data', 'id'), page='$page')).text, True)
+        with self.assertRaises(ValueError):
+            api.CombinedQuery(cities_query, paginated)
+
+
+if __name__ == '__main__':
+    unittest.main()
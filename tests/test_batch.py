@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+
+from bot.utils.pnwutils import api
+from bot.utils.pnwutils.batch import BatchedQuery
+from bot.utils.pnwutils.ratelimit import Priority
+
+
+class FakeQuery:
+    """Stands in for an APIQuery, recording the ids asked for in each call."""
+    check_more = False
+
+    def __init__(self, missing=(), error=None):
+        self.calls = []
+        self.missing = set(missing)
+        self.error = error
+
+    async def query(self, session, *, api_key, priority, nation_id):
+        self.calls.append((priority, sorted(nation_id)))
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return {'data': [{'id': str(i), 'score': i * 10} for i in nation_id if i not in self.missing]}
+
+
+class TestBatchedQuery(unittest.IsolatedAsyncioTestCase):
+    async def test_lookups_merged(self):
+        query = FakeQuery(missing={3})
+        batch = BatchedQuery(query, 'nation_id')
+        rows = await asyncio.gather(*(batch.load(None, i) for i in (1, 2, 2, 3)))
+        self.assertEqual([r and r['score'] for r in rows], [10, 20, 20, None])
+        self.assertEqual(query.calls, [(Priority.INTERACTIVE, [1, 2, 3])])
+        # each caller has its own copy of a row
+        self.assertIsNot(rows[1], rows[2])
+        self.assertEqual(batch._tasks, set())
+
+    async def test_split_by_size_and_priority(self):
+        query = FakeQuery()
+        batch = BatchedQuery(query, 'nation_id', max_batch=2)
+        await asyncio.gather(*(batch.load(None, i) for i in (1, 2, 3)),
+                             batch.load(None, 4, priority=Priority.BACKGROUND))
+        self.assertEqual(sorted(query.calls), [(Priority.INTERACTIVE, [1, 2]), (Priority.INTERACTIVE, [3]),
+                                               (Priority.BACKGROUND, [4])])
+
+    async def test_errors_reach_every_caller(self):
+        batch = BatchedQuery(FakeQuery(error=api.APIError('failed')), 'nation_id')
+        results = await asyncio.gather(batch.load(None, 1), batch.load(None, 2), return_exceptions=True)
+        self.assertTrue(all(isinstance(r, api.APIError) for r in results))
+        self.assertEqual(batch._tasks, set())
+
+    async def test_cancelled_fetch_cancels_callers(self):
+        query = FakeQuery()
+        started = asyncio.Event()
+
+        async def blocked(*args, **kwargs):
+            started.set()
+            await asyncio.Event().wait()
+        query.query = blocked
+        batch = BatchedQuery(query, 'nation_id', delay=0)
+        loads = asyncio.gather(batch.load(None, 1), batch.load(None, 2), return_exceptions=True)
+        await started.wait()
+        task, = batch._tasks
+        task.cancel()
+        results = await asyncio.wait_for(loads, 1)
+        self.assertTrue(all(isinstance(r, asyncio.CancelledError) for r in results))
+
+    async def test_tasks_kept_while_fetching(self):
+        batch = BatchedQuery(FakeQuery(), 'nation_id', delay=0)
+        load = asyncio.create_task(batch.load(None, 1))
+        while not batch._tasks:
+            await asyncio.sleep(0)
+        self.assertEqual(len(batch._tasks), 1)
+        await load
+        self.assertEqual(batch._tasks, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+import asyncio
+import datetime
+import os
+import unittest
+from unittest import mock
+
+import aiohttp
+import asyncpg
+
+from bot import dbbot
+from bot.utils import pnwutils
+
+# a postgres database to also run these tests against, which is wiped before each test
+postgres_url = os.environ.get('TEST_DATABASE_URL')
+
+
+class DatabaseTests:
+    """Scenarios run against every database backend, so that they behave the same."""
+    url: str
+
+    async def asyncSetUp(self):
+        if not self.url.startswith('memory:'):
+            conn = await asyncpg.connect(self.url)
+            try:
+                await conn.execute('DROP SCHEMA public CASCADE; CREATE SCHEMA public')
+            finally:
+                await conn.close()
+        self.session = aiohttp.ClientSession()
+        self.bot = dbbot.DBBot(self.session, self.url)
+        self.database = self.bot.database
+        await self.database.__aenter__()
+
+    async def asyncTearDown(self):
+        await self.database.__aexit__(None, None, None)
+        await self.session.close()
+
+    async def settle(self):
+        """Lets notifications of changes arrive."""
+        await asyncio.sleep(0.05 if self.url.startswith('memory:') else 0.5)
+
+    async def register(self, *discord_ids: int) -> None:
+        for discord_id in discord_ids:
+            await self.database.get_table('users').insert(discord_id=discord_id, nation_id=discord_id + 100)
+
+    async def deposit(self, discord_id: int, resources: pnwutils.Resources) -> None:
+        await self.database.get_table('users').update('balance = balance + $1', resources.to_record()).where(
+            discord_id=discord_id)
+
+    async def balance(self, discord_id: int) -> pnwutils.Resources:
+        return pnwutils.Resources.from_record(
+            await self.database.get_table('users').select_val('balance').where(discord_id=discord_id))
+
+    async def total(self) -> pnwutils.Resources:
+        return pnwutils.Resources.from_record(
+            await self.database.get_table('balance_totals').select_val('sum(total)'))
+
+    async def test_insert_and_select(self):
+        await self.register(1, 2)
+        users = self.database.get_table('users')
+        self.assertEqual(await users.select_val('nation_id').where(discord_id=2), 102)
+        self.assertEqual(await self.balance(1), pnwutils.Resources())
+        self.assertTrue(await users.exists(discord_id=1))
+        self.assertFalse(await users.exists(discord_id=3))
+
+    async def test_balance_total_trigger(self):
+        await self.register(1, 2)
+        await self.deposit(1, pnwutils.Resources(money=10, food=3))
+        await self.deposit(2, pnwutils.Resources(money=5))
+        self.assertEqual(await self.total(), pnwutils.Resources(money=15, food=3))
+        await self.database.get_table('users').delete().where(discord_id=1)
+        self.assertEqual(await self.total(), pnwutils.Resources(money=5))
+
+    async def test_transaction_rollback(self):
+        await self.register(1)
+        with self.assertRaises(ZeroDivisionError):
+            async with self.database.transaction() as t:
+                await t.get_table('users').update('balance = balance + $1', pnwutils.Resources(money=10).to_record()
+                                                  ).where(discord_id=1)
+                await t.get_table('users').insert(discord_id=2, nation_id=102)
+                1 / 0
+        self.assertEqual(await self.balance(1), pnwutils.Resources())
+        self.assertFalse(await self.database.get_table('users').exists(discord_id=2))
+        self.assertEqual(await self.total(), pnwutils.Resources())
+
+    async def test_insert_many_on_conflict(self):
+        await self.register(1)
+        users = self.database.get_table('users')
+        added = await users.insert_many('discord_id', 'nation_id', values=[(1, 999), (2, 102), (3, 103)]).on_conflict(
+            '(discord_id)').action_nothing()
+        self.assertEqual(added, 2)
+        self.assertEqual(await users.select_val('nation_id').where(discord_id=1), 101)
+        self.assertEqual(await users.select_val('count(*)'), 3)
+        # without a target, rows clashing on any unique column are skipped, here the nation of member 1
+        added = await users.insert_many('discord_id', 'nation_id', values=[(5, 101), (6, 106)]).on_conflict(
+            ).action_nothing()
+        self.assertEqual(added, 1)
+        self.assertFalse(await users.exists(discord_id=5))
+        written = await users.upsert_many('discord_id', 'nation_id', values=[(1, 201), (4, 104)],
+                                          conflict=('discord_id',))
+        self.assertEqual(written, 2)
+        self.assertEqual(await users.select_val('nation_id').where(discord_id=1), 201)
+        self.assertEqual(await users.select_val('count(*)'), 5)
+
+    async def test_where_any(self):
+        await self.register(1, 2, 3)
+        users = self.database.get_table('users')
+        found = await users.select('discord_id').where_any(discord_id={1, 3, 5}).order_by('discord_id')
+        self.assertEqual([rec['discord_id'] for rec in found], [1, 3])
+        found = await users.select('discord_id').where_not_any(discord_id=[1, 3]).order_by('discord_id')
+        self.assertEqual([rec['discord_id'] for rec in found], [2])
+        await users.delete().where_any(discord_id=[2, 3])
+        self.assertEqual(await users.select_val('count(*)'), 1)
+
+    async def test_kv_notified_of_changes(self):
+        kv = self.database.get_kv('kv_ints')
+        await self.database.execute("INSERT INTO kv_ints(key, value) VALUES ('a', 1)")
+        await self.settle()
+        self.assertEqual(kv.cache, {'a': 1})
+        await self.database.execute("DELETE FROM kv_ints WHERE key = 'a'")
+        await self.settle()
+        self.assertEqual(kv.cache, {})
+
+    async def record_deposit(self, discord_id: int, resources: pnwutils.Resources) -> None:
+        async with self.database.transaction() as t:
+            await t.get_table('users').update('balance = balance + $1', resources.to_record()).where(
+                discord_id=discord_id)
+            await t.get_table('ledger').record(discord_id, 'deposit', resources)
+
+    async def test_ledger_balance_at(self):
+        ledger = self.bot.ledger
+        await self.register(1)
+        await self.deposit(1, pnwutils.Resources(money=100))
+        await ledger.snapshot()
+        before = datetime.datetime.now(tz=datetime.timezone.utc)
+        # so that the entry is recorded after the snapshot, rather than at the same time
+        await asyncio.sleep(0.01)
+        await self.record_deposit(1, pnwutils.Resources(money=20))
+        after = datetime.datetime.now(tz=datetime.timezone.utc)
+        self.assertEqual(pnwutils.Resources.from_record(await ledger.balance_at(1, after)),
+                         pnwutils.Resources(money=120))
+        await ledger.snapshot()
+        self.assertEqual(pnwutils.Resources.from_record(await ledger.balance_at(1, before)),
+                         pnwutils.Resources(money=100))
+        flows = await ledger.flows(1, before, after + datetime.timedelta(seconds=1))
+        self.assertEqual({k: pnwutils.Resources.from_record(v) for k, v in flows.items()},
+                         {'deposit': pnwutils.Resources(money=20)})
+
+    async def test_ledger_registered_after_snapshot(self):
+        ledger = self.bot.ledger
+        await ledger.snapshot()
+        self.assertIsNone(await ledger.balance_at(1, datetime.datetime.now(tz=datetime.timezone.utc)))
+        await self.register(1)
+        await self.record_deposit(1, pnwutils.Resources(money=30))
+        await self.record_deposit(1, pnwutils.Resources(food=5))
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        self.assertEqual(pnwutils.Resources.from_record(await ledger.balance_at(1, now)),
+                         pnwutils.Resources(money=30, food=5))
+
+    async def test_unconvertible_view_left_alone(self):
+        views = self.bot.view_table
+        await self.database.execute('INSERT INTO views(id, data) VALUES (1, $1)', b'not a pickle')
+        # as when the bot starts with a stored view from before the current format that cannot be read
+        await views.create()
+        self.assertIsNone(await views.get(1))
+        self.assertEqual(await views.unknown_kinds(), {None: 1})
+        self.assertEqual(await views.prune(dry_run=False), {None: 1})
+        self.assertEqual(await views.select_val('count(*)'), 0)
+
+    async def test_ledger_snapshot_once_at_start(self):
+        await self.register(1)
+        await self.bot.ledger.create()
+        await self.record_deposit(1, pnwutils.Resources(money=5))
+        # as when the bot starts again, once a snapshot exists no more are taken until the daily one
+        await self.bot.ledger.create()
+        self.assertEqual(await self.database.fetch_val('SELECT count(*) FROM ledger_snapshots'), 1)
+
+    async def test_ledger_entry_rolled_back_with_balance(self):
+        await self.register(1)
+        with self.assertRaises(ZeroDivisionError):
+            async with self.database.transaction() as t:
+                await t.get_table('ledger').record(1, 'deposit', pnwutils.Resources(money=20))
+                1 / 0
+        self.assertEqual(await self.database.get_table('ledger').select_val('count(*)'), 0)
+
+    async def test_kv_refreshes_applied_in_order(self):
+        kv = self.database.get_kv('kv_ints')
+        # the first read is slow and sees the older value, so it would finish after the second
+        reads = iter([(0.05, 1), (0, 2)])
+
+        async def fetch_val(database, query, *args):
+            delay, value = next(reads)
+            await asyncio.sleep(delay)
+            return value
+        with mock.patch.object(type(self.database), 'fetch_val', fetch_val):
+            await asyncio.gather(kv.refresh('a'), kv.refresh('a'))
+        self.assertEqual(kv.cache, {'a': 2})
+
+    async def test_kv_set_in_committed_transaction(self):
+        kv = self.database.get_kv('kv_ints')
+        async with self.database.transaction() as t:
+            await t.get_kv('kv_ints').set('a', 1)
+            self.assertEqual(await t.get_kv('kv_ints').get('a'), 1)
+        self.assertEqual(await kv.get('a'), 1)
+        await self.settle()
+        self.assertEqual(await kv.get('a'), 1)
+
+    async def test_kv_set_in_rolled_back_transaction(self):
+        kv = self.database.get_kv('kv_ints')
+        await kv.set('a', 1)
+        with self.assertRaises(ZeroDivisionError):
+            async with self.database.transaction() as t:
+                await t.get_kv('kv_ints').set('a', 2)
+                1 / 0
+        self.assertEqual(await kv.get('a'), 1)
+        await self.settle()
+        self.assertEqual(await kv.get('a'), 1)
+        self.assertEqual(await self.database.fetch_val("SELECT value FROM kv_ints WHERE key = 'a'"), 1)
+
+    async def test_kv_caches_reload_after_listen_lost(self):
+        kv = self.database.get_kv('kv_ints')
+        await kv.set('a', 1)
+        self.database._on_listen_lost()
+        self.assertIsNone(kv.cache)
+        await self.settle()
+        self.assertEqual(kv.cache, {'a': 1})
+        await self.database.execute("UPDATE kv_ints SET value = 2 WHERE key = 'a'")
+        await self.settle()
+        self.assertEqual(kv.cache, {'a': 2})
+
+
+class TestMemoryDatabase(DatabaseTests, unittest.IsolatedAsyncioTestCase):
+    url = 'memory:'
+
+    async def test_ddl_checked(self):
+        # only the DDL the tables use is accepted, and the tables and columns it names must exist
+        with self.assertRaises(NotImplementedError):
+            await self.database.execute('CREATE VIEW balances AS SELECT balance FROM users')
+        with self.assertRaises(NotImplementedError):
+            await self.database.execute('ALTER TABLE users DROP COLUMN balance')
+        with self.assertRaises(asyncpg.UndefinedTableError):
+            await self.database.execute('CREATE INDEX IF NOT EXISTS missing_id ON missing(id)')
+        with self.assertRaises(asyncpg.UndefinedColumnError):
+            await self.database.execute('CREATE INDEX IF NOT EXISTS users_missing ON users(missing)')
+        await self.database.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS note TEXT')
+        await self.register(1)
+        self.assertIsNone(await self.database.get_table('users').select_val('note').where(discord_id=1))
+
+
+@unittest.skipUnless(postgres_url, 'TEST_DATABASE_URL is not set')
+class TestPostgresDatabase(DatabaseTests, unittest.IsolatedAsyncioTestCase):
+    url = postgres_url or ''
+
+    async def test_ledger_change_committed_after_snapshot_started(self):
+        await self.register(1)
+        await self.deposit(1, pnwutils.Resources(money=100))
+        await self.bot.ledger.snapshot()
+        async with self.database.transaction() as t:
+            await t.get_table('users').update('balance = balance + $1', pnwutils.Resources(money=20).to_record()
+                                              ).where(discord_id=1)
+            # the snapshot waits for this transaction, rather than missing its change
+            snapshot = asyncio.create_task(self.bot.ledger.snapshot())
+            await asyncio.sleep(0.2)
+            self.assertFalse(snapshot.done())
+            await t.get_table('ledger').record(1, 'deposit', pnwutils.Resources(money=20))
+        await snapshot
+        await self.record_deposit(1, pnwutils.Resources(money=5))
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        self.assertEqual(pnwutils.Resources.from_record(await self.bot.ledger.balance_at(1, now)),
+                         pnwutils.Resources(money=125))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import unittest
+
+import discord
+
+from bot.utils.discordutils import digest
+
+
+class FakeMessage:
+    def __init__(self, channel, message_id, embeds):
+        self.channel = channel
+        self.id = message_id
+        self.embeds = embeds
+
+    async def edit(self, *, embeds):
+        self.channel.edits.append(embeds)
+        return FakeMessage(self.channel, self.id, embeds)
+
+
+class FakeChannel:
+    ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(self.ids)
+        self.last_message_id = None
+        self.sent = []
+        self.edits = []
+
+    async def send(self, *, embed=None, embeds=None):
+        embeds = [embed] if embed is not None else embeds
+        assert len(embeds) <= digest.max_embeds and sum(map(len, embeds)) <= digest.max_embed_chars
+        self.sent.append(embeds)
+        message = FakeMessage(self, next(self.ids), embeds)
+        self.last_message_id = message.id
+        return message
+
+
+def alert(n, size=10):
+    return discord.Embed(title=str(n), description='x' * size)
+
+
+class TestPages(unittest.TestCase):
+    def test_embed_limit(self):
+        pages = digest._pages(alert(i) for i in range(25))
+        self.assertEqual(list(map(len, pages)), [10, 10, 5])
+        self.assertEqual([e.title for page in pages for e in page], [str(i) for i in range(25)])
+
+    def test_character_limit(self):
+        pages = digest._pages([alert(0, 2500), alert(1, 2500), alert(2, 2500), alert(3)])
+        self.assertEqual([[e.title for e in page] for page in pages], [['0', '1'], ['2', '3']])
+        self.assertTrue(all(sum(map(len, page)) <= digest.max_embed_chars for page in pages))
+
+
+class TestAlertDigest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.window = 0.05
+        self.digest = digest.AlertDigest(self.get_window)
+        self.channel = FakeChannel()
+
+    async def get_window(self):
+        return self.window
+
+    async def settle(self):
+        while self.digest._tasks:
+            await asyncio.sleep(0.01)
+
+    async def test_no_window_sends_each(self):
+        self.window = 0
+        await self.digest.send(self.channel, alert(1))
+        await self.digest.send(self.channel, alert(2))
+        self.assertEqual([[e.title for e in embeds] for embeds in self.channel.sent], [['1'], ['2']])
+
+    async def test_later_alerts_added_to_latest(self):
+        await self.digest.send(self.channel, alert(1))
+        await self.settle()
+        self.assertEqual(len(self.channel.sent), 1)
+        await self.digest.send(self.channel, alert(2))
+        await self.digest.send(self.channel, alert(3))
+        await self.settle()
+        self.assertEqual(len(self.channel.sent), 1)
+        self.assertEqual([e.title for e in self.channel.edits[-1]], ['1', '2', '3'])
+
+    async def test_new_message_when_not_latest(self):
+        await self.digest.send(self.channel, alert(1))
+        await self.settle()
+        # someone else has posted since, so the digest is not edited
+        self.channel.last_message_id = -1
+        await self.digest.send(self.channel, alert(2))
+        await self.settle()
+        self.assertEqual(self.channel.edits, [])
+        self.assertEqual([[e.title for e in embeds] for embeds in self.channel.sent], [['1'], ['2']])
+
+    async def test_overflow_split_into_messages(self):
+        await self.digest.send(self.channel, alert(0))
+        await self.settle()
+        for i in range(1, 25):
+            await self.digest.send(self.channel, alert(i, 1000 if i == 24 else 10))
+        await self.settle()
+        self.assertEqual(len(self.channel.edits[-1]), digest.max_embeds)
+        self.assertEqual([len(embeds) for embeds in self.channel.sent], [1, 10, 5])
+        titles = [e.title for e in self.channel.edits[-1]] + [e.title for e in self.channel.sent[1]] + [
+            e.title for e in self.channel.sent[2]]
+        self.assertEqual(titles, [str(i) for i in range(25)])
+
+    async def test_alert_during_flush_delivered(self):
+        release = asyncio.Event()
+        send = self.channel.send
+
+        async def blocked_send(**kwargs):
+            await release.wait()
+            return await send(**kwargs)
+        self.channel.send = blocked_send
+        await self.digest.send(self.channel, alert(1))
+        # the first alert has been taken and is being sent when the second comes in
+        while self.channel.id in self.digest._pending:
+            await asyncio.sleep(0)
+        await self.digest.send(self.channel, alert(2))
+        release.set()
+        await self.settle()
+        titles = [e.title for embeds in self.channel.sent + self.channel.edits[-1:] for e in embeds]
+        self.assertEqual(sorted(set(titles)), ['1', '2'])
+
+    async def test_close_sends_pending(self):
+        await self.digest.send(self.channel, alert(1))
+        await self.settle()
+        self.window = 60
+        await self.digest.send(self.channel, alert(2))
+        await self.digest.close()
+        self.assertEqual(self.digest._tasks, {})
+        self.assertEqual([[e.title for e in embeds] for embeds in self.channel.sent], [['1'], ['2']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import asyncio
+import unittest
+
+from bot.utils.dispatch import Dispatcher
+
+
+class TestDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.handled = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def handle(self, event):
+        await self.release.wait()
+        self.handled.append(event)
+
+    async def drain(self, dispatcher):
+        while len(dispatcher) or dispatcher._active:
+            await asyncio.sleep(0)
+
+    async def test_same_key_in_order(self):
+        dispatcher = Dispatcher('test', self.handle, key=lambda e: e[0], workers=4)
+        dispatcher.start()
+        self.release.clear()
+        await dispatcher.put(('a', 1))
+        await asyncio.sleep(0)
+        # the first is being handled, so these wait behind it rather than running alongside
+        await dispatcher.put(('a', 2))
+        await dispatcher.put(('b', 1))
+        self.release.set()
+        await self.drain(dispatcher)
+        await dispatcher.stop()
+        self.assertEqual([e for e in self.handled if e[0] == 'a'], [('a', 1), ('a', 2)])
+        self.assertIn(('b', 1), self.handled)
+
+    async def test_waiting_events_coalesce(self):
+        dispatcher = Dispatcher('test', self.handle, key=lambda e: e[0], workers=1,
+                                merge=lambda old, new: (new[0], old[1] + new[1]))
+        for i in range(1, 4):
+            await dispatcher.put(('a', i))
+        await dispatcher.put(('b', 10))
+        self.assertEqual(len(dispatcher), 2)
+        dispatcher.start()
+        await self.drain(dispatcher)
+        await dispatcher.stop()
+        self.assertEqual(self.handled, [('a', 6), ('b', 10)])
+
+    async def test_full_put_waits_for_room(self):
+        dispatcher = Dispatcher('test', self.handle, key=lambda e: e, workers=1, max_pending=2)
+        await dispatcher.put(1)
+        await dispatcher.put(2)
+        blocked = asyncio.create_task(dispatcher.put(3))
+        await asyncio.sleep(0)
+        self.assertFalse(blocked.done())
+        # a key already waiting is merged without needing room
+        await asyncio.wait_for(dispatcher.put(1), 1)
+        dispatcher.start()
+        await asyncio.wait_for(blocked, 1)
+        await self.drain(dispatcher)
+        await dispatcher.stop()
+        self.assertEqual(sorted(self.handled), [1, 2, 3])
+
+    async def test_errors_do_not_stop_workers(self):
+        async def handle(event):
+            if event == 1:
+                raise ValueError(event)
+            self.handled.append(event)
+        dispatcher = Dispatcher('test', handle, key=lambda e: e, workers=1)
+        dispatcher.start()
+        await dispatcher.put(1)
+        await dispatcher.put(2)
+        await self.drain(dispatcher)
+        await dispatcher.stop()
+        self.assertEqual(self.handled, [2])
+
+    async def test_stop_drops_waiting_events(self):
+        dispatcher = Dispatcher('test', self.handle, key=lambda e: e, workers=1, max_pending=2)
+        dispatcher.start()
+        self.release.clear()
+        await dispatcher.put(1)
+        await asyncio.sleep(0)
+        await dispatcher.put(2)
+        await dispatcher.put(3)
+        await dispatcher.stop()
+        self.assertEqual(len(dispatcher), 0)
+        # after restarting, the dropped events neither run nor hold room
+        self.release.set()
+        dispatcher.start()
+        await asyncio.wait_for(dispatcher.put(4), 1)
+        await asyncio.wait_for(dispatcher.put(5), 1)
+        await self.drain(dispatcher)
+        await dispatcher.stop()
+        self.assertEqual(sorted(self.handled), [4, 5])
+
+    async def test_stop_releases_blocked_put(self):
+        dispatcher = Dispatcher('test', self.handle, key=lambda e: e, workers=1, max_pending=1)
+        await dispatcher.put(1)
+        blocked = asyncio.create_task(dispatcher.put(2))
+        await asyncio.sleep(0)
+        self.assertFalse(blocked.done())
+        await dispatcher.stop()
+        await asyncio.wait_for(blocked, 1)
+        self.assertEqual(len(dispatcher), 0)
+        dispatcher.start()
+        await asyncio.wait_for(dispatcher.put(3), 1)
+        await self.drain(dispatcher)
+        await dispatcher.stop()
+        self.assertEqual(self.handled, [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from bot.utils.pnwutils import graphql
+from bot.utils.pnwutils.builder import Field, Fragment, Query
+
+
+class TestParse(unittest.TestCase):
+    def test_operation(self):
+        operation, = graphql.parse('''
+            # a comment
+            query nations($id: [Int!]!, $page: Int = 1) {
+                nations(id: $id, first: 500, page: $page) { data { id nation_name } }
+            }''')
+        self.assertEqual((operation.kind, operation.name), ('query', 'nations'))
+        self.assertEqual(operation.variables, {'id': '[Int!]!', 'page': 'Int'})
+        nations, = operation.selections
+        self.assertEqual(nations.arguments, {'id': '$id', 'first': '500', 'page': '$page'})
+        self.assertEqual([f.name for f in nations.selections[0].selections], ['id', 'nation_name'])
+
+    def test_fragments_spread_and_merged(self):
+        operation, = graphql.parse('''
+            query { nation { id ...a ...b ... on Nation { score } } }
+            fragment a on Nation { cities { id } }
+            fragment b on Nation { cities { land } alias: nation_name }''')
+        nation, = operation.selections
+        self.assertEqual([f.key for f in nation.selections], ['id', 'cities', 'alias', 'score'])
+        self.assertEqual([f.name for f in nation.selections[1].selections], ['id', 'land'])
+        self.assertEqual(nation.selections[2].name, 'nation_name')
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            graphql.parse('query { nation { ...missing } }')
+        with self.assertRaises(ValueError):
+            graphql.parse('query { nation { ...a } } fragment a on Nation { ...a }')
+        with self.assertRaises(ValueError):
+            graphql.parse('query { nation { id }')
+
+
+class TestBuilder(unittest.TestCase):
+    def test_text_parses_back(self):
+        fragment = Fragment('inner', 'City', 'id', Field('nation', 'id'))
+        query = Query('cities', {'id': '[Int]'}, Field('cities', Field('data', fragment, 'land'), id='$id', first=500,
+                                                        active=True))
+        operation, = graphql.parse(query.text)
+        self.assertEqual(operation.variables, {'id': '[Int]'})
+        cities, = operation.selections
+        self.assertEqual(cities.arguments, {'id': '$id', 'first': '500', 'active': 'true'})
+        self.assertEqual([f.key for f in cities.selections[0].selections], ['id', 'nation', 'land'])
+
+    def test_fragments_defined_once(self):
+        inner = Fragment('inner', 'Nation', 'id')
+        outer = Fragment('outer', 'Nation', inner, 'score')
+        text = Query('q', {}, Field('a', outer), Field('b', inner)).text
+        self.assertEqual(text.count('fragment inner'), 1)
+        self.assertEqual(text.count('fragment outer'), 1)
+
+    def test_conflicting_fragments(self):
+        query = Query('q', {}, Field('a', Fragment('f', 'Nation', 'id')), Field('b', Fragment('f', 'Nation', 'score')))
+        with self.assertRaises(ValueError):
+            query.text
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import time
+import unittest
+
+from bot.utils.pnwutils.ratelimit import Priority, RateLimiter
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+    def test_refill(self):
+        limiter = RateLimiter(limit=10, window=1)
+        limiter.tokens = 0
+        limiter._updated = 100.
+        limiter._refill(100.5)
+        self.assertAlmostEqual(limiter.tokens, 5)
+        limiter._refill(200.)
+        self.assertEqual(limiter.tokens, 10)
+
+    async def test_acquire_takes_token(self):
+        limiter = RateLimiter(limit=10, window=1)
+        await limiter.acquire()
+        self.assertAlmostEqual(limiter.tokens, 9, places=1)
+        self.assertEqual(limiter.served[Priority.INTERACTIVE], 1)
+
+    async def test_higher_priority_served_first(self):
+        limiter = RateLimiter(limit=4, window=1, reserve=0)
+        order = []
+
+        async def request(priority):
+            await limiter.acquire(priority)
+            order.append(priority)
+
+        limiter.tokens = 0
+        limiter._updated = time.monotonic()
+        background = asyncio.create_task(request(Priority.BACKGROUND))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(request(Priority.INTERACTIVE))
+        await asyncio.wait_for(asyncio.gather(background, interactive), 2)
+        self.assertEqual(order, [Priority.INTERACTIVE, Priority.BACKGROUND])
+
+    async def test_background_leaves_reserve(self):
+        limiter = RateLimiter(limit=10, window=1000, reserve=5)
+        limiter.tokens = 5
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.acquire(Priority.BACKGROUND), 0.05)
+        await asyncio.wait_for(limiter.acquire(Priority.INTERACTIVE), 0.05)
+
+    def test_update_from_headers(self):
+        limiter = RateLimiter(limit=60, window=60)
+        reset = time.time() + 30
+        limiter.update({'X-RateLimit-Limit': '600', 'X-RateLimit-Remaining': '550', 'X-RateLimit-Reset': str(reset)})
+        self.assertEqual(limiter.capacity, 600)
+        self.assertAlmostEqual(limiter.rate, 10)
+        self.assertEqual(limiter.tokens, 550)
+        # a stale count from the same window does not raise the tokens
+        limiter.update({'X-RateLimit-Limit': '600', 'X-RateLimit-Remaining': '580', 'X-RateLimit-Reset': str(reset)})
+        self.assertEqual(limiter.tokens, 550)
+        # a new window does
+        limiter.update({'X-RateLimit-Limit': '600', 'X-RateLimit-Remaining': '599',
+                        'X-RateLimit-Reset': str(reset + 60)})
+        self.assertEqual(limiter.tokens, 599)
+
+    def test_exhausted_blocks_until_reset(self):
+        limiter = RateLimiter()
+        limiter.update({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(time.time() + 10)})
+        self.assertGreater(limiter._delay(Priority.INTERACTIVE, time.monotonic()), 5)
+
+    def test_headers_ignored_when_not_followed(self):
+        limiter = RateLimiter(limit=60, window=60, follow_headers=False)
+        limiter.update({'X-RateLimit-Limit': '600', 'X-RateLimit-Remaining': '1'})
+        self.assertEqual(limiter.capacity, 60)
+        self.assertEqual(limiter.tokens, 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from bot.utils.pnwutils import graphql, records
+
+operation, = graphql.parse('''
+    query nations { nations { data { id nation_name alliance { id name } cities { id infrastructure } } } }''')
+Nation = records.record_type(operation.selections[0].selections[0].selections, 'Nation')
+
+
+def nation(**fields):
+    return {'id': '1', 'nation_name': 'A', 'alliance': {'id': '2', 'name': 'B'},
+            'cities': [{'id': '3', 'infrastructure': 100.5}, {'id': '4', 'infrastructure': 200}]} | fields
+
+
+class TestRecord(unittest.TestCase):
+    def test_fields(self):
+        record = Nation.from_dict(nation())
+        self.assertEqual(record.keys(), ('id', 'nation_name', 'alliance', 'cities'))
+        self.assertEqual((record.id, record['nation_name']), ('1', 'A'))
+        self.assertEqual(record.alliance['name'], 'B')
+        self.assertIn('cities', record)
+        self.assertNotIn('score', record)
+        with self.assertRaises(KeyError):
+            record['score']
+        self.assertEqual(record.get('score', 0), 0)
+        # records are slotted, so they have no per instance dict
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_nested_lists(self):
+        record = Nation.from_dict(nation())
+        self.assertIsInstance(record.cities, records.RecordList)
+        self.assertEqual(len(record.cities), 2)
+        self.assertEqual(record.cities[1].infrastructure, 200)
+        self.assertEqual([c['id'] for c in record.cities], ['3', '4'])
+        self.assertEqual([c.id for c in record.cities[:1]], ['3'])
+
+    def test_missing_and_null_fields(self):
+        record = Nation.from_dict({'id': '1', 'alliance': None})
+        self.assertIsNone(record.nation_name)
+        self.assertIsNone(record.alliance)
+        self.assertIsNone(record.cities)
+
+    def test_round_trip(self):
+        data = nation()
+        self.assertEqual(Nation.from_dict(data).to_dict(), data)
+        self.assertEqual(Nation.from_dict(data), Nation.from_dict(nation()))
+        self.assertNotEqual(Nation.from_dict(data), Nation.from_dict(nation(cities=[])))
+
+
+if __name__ == '__main__':
+    unittest.main()
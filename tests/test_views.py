@@ -0,0 +1,54 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import aiohttp
+import discord
+
+from bot import dbbot
+from bot.utils import discordutils
+
+
+class TestRestoreViews(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = aiohttp.ClientSession()
+        self.bot = dbbot.DBBot(self.session, 'memory:')
+        self.view = mock.Mock(custom_id=5)
+        self.gets = 0
+        self.dispatched = []
+
+    async def asyncTearDown(self):
+        await self.session.close()
+
+    async def get(self, view_id):
+        self.gets += 1
+        await asyncio.sleep(0.01)
+        return self.view if view_id == self.view.custom_id else None
+
+    def listen(self, view, message_id=None):
+        self.bot.hot_views[view.custom_id] = view
+
+    def dispatch(self, view, interaction):
+        self.dispatched.append(interaction)
+        return True
+
+    @staticmethod
+    def press(custom_id):
+        return mock.Mock(type=discord.InteractionType.component, data={'custom_id': custom_id})
+
+    async def test_presses_during_restore_dispatched(self):
+        first, second = self.press('accept 5'), self.press('reject 5')
+        with mock.patch.object(self.bot.view_table, 'get', self.get), \
+                mock.patch.object(self.bot, '_listen_to_view', self.listen), \
+                mock.patch.object(discordutils, 'dispatch_restored', self.dispatch):
+            await asyncio.gather(self.bot.on_interaction(first), self.bot.on_interaction(second))
+            # once it is listening, discord.py dispatches presses to it itself
+            await self.bot.on_interaction(self.press('accept 5'))
+            await self.bot.on_interaction(self.press('accept 6'))
+        self.assertEqual(self.gets, 2)
+        self.assertEqual(self.dispatched, [first, second])
+        self.assertEqual(self.bot.restoring_views, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import datetime
+import time
+import unittest
+from unittest import mock
+
+import aiohttp
+
+from bot import dbbot
+from bot.utils import pnwutils, queries, war_state
+
+alliance_id = 1
+
+
+def war(war_id, **fields):
+    return {'id': str(war_id), 'date': '2026-01-01T00:00:00+00:00', 'winner_id': '0', 'turns_left': 60,
+            'war_type': 'ORDINARY', 'att_id': '10', 'def_id': '20', 'att_alliance_id': str(alliance_id),
+            'def_alliance_id': '2', 'att_resistance': 100, 'def_resistance': 100, 'att_points': 3,
+            'def_points': 3} | fields
+
+
+class TestWarStore(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = aiohttp.ClientSession()
+        self.bot = dbbot.DBBot(self.session, 'memory:')
+        await self.bot.database.__aenter__()
+        self.store = war_state.WarStore(self.bot.database.get_table('active_wars'), alliance_id)
+
+    async def asyncTearDown(self):
+        await self.bot.database.__aexit__(None, None, None)
+        await self.session.close()
+
+    def test_apply_keeps_missing_fields(self):
+        before, after = self.store.apply(war(1))
+        self.assertIsNone(before)
+        self.assertEqual(after['id'], 1)
+        before, after = self.store.apply(war(1, def_resistance=80, att_points=None))
+        self.assertEqual(before['def_resistance'], 100)
+        self.assertEqual((after['def_resistance'], after['att_points']), (80, 3))
+
+    def test_apply_drops_ended_and_other_wars(self):
+        self.store.apply(war(1))
+        self.assertEqual(self.store.apply(war(1, winner_id='10'))[1], None)
+        self.assertNotIn(1, self.store)
+        self.assertEqual(self.store.apply(war(2, att_alliance_id='3'))[1], None)
+        self.assertEqual(len(self.store), 0)
+
+    async def test_seed_in_background(self):
+        self.store.apply(war(1))
+
+        async def stream(session, **variables):
+            self.assertEqual(variables['priority'], pnwutils.ratelimit.Priority.BACKGROUND)
+            yield war(2, attacker={'id': '10'}, defender={'id': '20'})
+
+        with mock.patch.object(queries.alliance_wars_query, 'stream', stream):
+            self.assertEqual(await self.store.seed(self.session), 1)
+        self.assertNotIn(1, self.store)
+        self.assertIn(2, self.store)
+        self.assertEqual(set(self.store.nations), {10, 20})
+
+    async def test_checkpoint_and_load(self):
+        self.store.apply(war(1))
+        self.store.apply(war(2))
+        await self.store.checkpoint()
+        self.store.apply(war(2, winner_id='10'))
+        await self.store.checkpoint()
+        store = war_state.WarStore(self.store.table, alliance_id)
+        await store.load()
+        self.assertEqual(set(store.wars), {1})
+        self.assertEqual(store.get(1), self.store.get(1))
+
+
+class TestBreakpointTracker(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = aiohttp.ClientSession()
+        self.bot = dbbot.DBBot(self.session, 'memory:')
+        await self.bot.database.__aenter__()
+        self.tracker = war_state.BreakpointTracker(self.bot.database.get_table('war_breakpoints'))
+        self.date = datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
+
+    async def asyncTearDown(self):
+        await self.bot.database.__aexit__(None, None, None)
+        await self.session.close()
+
+    def test_cross(self):
+        # the first time a war is seen it alerts, then only once it has lost another 20
+        self.assertTrue(self.tracker.cross(1, 95, self.date))
+        self.assertEqual(self.tracker.breakpoints[1][0], 80)
+        self.assertFalse(self.tracker.cross(1, 90, self.date))
+        self.assertFalse(self.tracker.cross(1, 81, self.date))
+        self.assertTrue(self.tracker.cross(1, 80, self.date))
+        self.assertEqual(self.tracker.breakpoints[1][0], 60)
+        self.assertFalse(self.tracker.cross(1, 70, self.date))
+
+    def test_expire(self):
+        self.tracker.cross(1, 100, self.date)
+        old = (datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=10)).isoformat()
+        self.tracker.cross(2, 100, old)
+        self.assertLess(self.tracker.breakpoints[2][1], time.time())
+        self.tracker.expire()
+        self.assertEqual(set(self.tracker.breakpoints), {1})
+        self.assertEqual(self.tracker._removed, {2})
+
+    async def test_flush_and_load(self):
+        self.tracker.cross(1, 100, self.date)
+        self.tracker.cross(2, 100, self.date)
+        await self.tracker.flush()
+        self.tracker.discard(2)
+        await self.tracker.flush()
+        tracker = war_state.BreakpointTracker(self.tracker.table)
+        await tracker.load()
+        self.assertEqual(set(tracker.breakpoints), {1})
+        self.assertEqual(tracker.breakpoints[1][0], 100)
+        self.assertAlmostEqual(tracker.breakpoints[1][1], self.tracker.breakpoints[1][1], places=3)
+
+    async def test_load_keeps_lower_breakpoint(self):
+        self.tracker.cross(1, 100, self.date)
+        self.tracker.cross(2, 50, self.date)
+        self.tracker.cross(3, 100, self.date)
+        await self.tracker.flush()
+        tracker = war_state.BreakpointTracker(self.tracker.table)
+        # seen before the checkpoint was loaded, one lower and one higher than stored, and one that has ended
+        tracker.cross(1, 55, self.date)
+        tracker.cross(2, 75, self.date)
+        tracker.cross(3, 75, self.date)
+        tracker.discard(3)
+        await tracker.load()
+        self.assertEqual({i: b for i, (b, _) in tracker.breakpoints.items()}, {1: 40, 2: 40})
+
+
+if __name__ == '__main__':
+    unittest.main()